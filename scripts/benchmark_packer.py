@@ -0,0 +1,176 @@
+'''
+Self-contained offline packer benchmark. Times each packer over a grid of
+num_eps, flow size dists, load fractions and check_dont_exceed_one_ep_load,
+with packer inputs generated from a seed (see
+trafpy_vectorised_packer/benchmarking.py) rather than from hydra configs,
+the benchmark importer or wandb. Each case is repeated after warmup runs,
+and results are written to a JSON file so that they can be diffed between
+commits, e.g.:
+
+    $ python benchmark_packer.py --num_eps 8 16 32 64 --save_path before.json
+    $ python benchmark_packer.py --num_eps 8 16 32 64 --save_path after.json --baseline before.json
+
+Cases which raise (e.g. heavy-tailed flows which cannot be packed without
+exceeding an end point's max load) are recorded with their error rather than
+stopping the benchmark.
+'''
+from trafpy_vectorised_packer import benchmarking
+
+import argparse
+import json
+import time
+import os
+
+
+if __name__ == '__main__':
+    # init arg parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                '--packers',
+                '-p',
+                help=f'Packers to benchmark, either names ({list(benchmarking.PACKER_CLS_PATHS.keys())}) or import paths of packer classes.',
+                type=str,
+                nargs='+',
+                default=['vectorised', 'base'],
+            )
+    parser.add_argument(
+                '--num_eps',
+                '-N',
+                help='Numbers of end points to benchmark.',
+                type=int,
+                nargs='+',
+                default=[8, 16, 32, 64, 128, 256, 512, 1024, 2048],
+            )
+    parser.add_argument(
+                '--num_flows',
+                help='Number of flows to pack per case. If auto, uses num_demands_factor * num_eps ** 2 flows (as with min_num_demands: auto in scripts/packer_speed_test.py).',
+                type=str,
+                default='auto',
+            )
+    parser.add_argument(
+                '--num_demands_factor',
+                help='Number of flows per src-dst pair if num_flows is auto.',
+                type=float,
+                default=5,
+            )
+    parser.add_argument(
+                '--flow_size_dists',
+                '-f',
+                help=f'Flow size dists to benchmark, from {list(benchmarking.FLOW_SIZE_DISTS.keys())}.',
+                type=str,
+                nargs='+',
+                default=['weibull_lambda_2100', 'weibull_lambda_4100', 'pareto'],
+            )
+    parser.add_argument(
+                '--loads',
+                '-l',
+                help='Target load fractions to benchmark.',
+                type=float,
+                nargs='+',
+                default=[0.1, 0.5, 0.9],
+            )
+    parser.add_argument(
+                '--check_dont_exceed_one_ep_load',
+                help='Values of check_dont_exceed_one_ep_load to benchmark.',
+                type=int,
+                nargs='+',
+                choices=[0, 1],
+                default=[1, 0],
+            )
+    parser.add_argument(
+                '--base_max_num_eps',
+                help='Max num_eps to benchmark packers other than vectorised at, since the original packer scales poorly with num_eps. If 0, benchmarks all num_eps.',
+                type=int,
+                default=128,
+            )
+    parser.add_argument(
+                '--vectorised_packer_kwargs',
+                help='JSON dict of extra kwargs (e.g. \'{"backend": "numba"}\') to construct the vectorised packer with.',
+                type=json.loads,
+                default={},
+            )
+    parser.add_argument(
+                '--num_repeats',
+                '-r',
+                help='Number of timed repeats of each case.',
+                type=int,
+                default=3,
+            )
+    parser.add_argument(
+                '--num_warmup',
+                '-w',
+                help='Number of untimed warmup runs of each case.',
+                type=int,
+                default=1,
+            )
+    parser.add_argument(
+                '--seed',
+                help='Seed from which packer inputs are generated.',
+                type=int,
+                default=0,
+            )
+    parser.add_argument(
+                '--save_path',
+                '-s',
+                help='Path to save JSON results to.',
+                type=str,
+                default='packer_benchmark.json',
+            )
+    parser.add_argument(
+                '--baseline',
+                '-b',
+                help='Path to JSON results of a previous run (e.g. of another commit) to compare packing times against.',
+                type=str,
+                default=None,
+            )
+    args = parser.parse_args()
+
+    cases = benchmarking.get_benchmark_cases(packer=args.packers,
+                                             num_eps=args.num_eps,
+                                             flow_size_dist=args.flow_size_dists,
+                                             load=args.loads,
+                                             check_dont_exceed_one_ep_load=[bool(check) for check in args.check_dont_exceed_one_ep_load])
+    if args.base_max_num_eps > 0:
+        cases = [case for case in cases if case['packer'] == 'vectorised' or case['num_eps'] <= args.base_max_num_eps]
+
+    print(f'~'*100)
+    print(f'Running {len(cases)} benchmark cases ({args.num_warmup} warmup + {args.num_repeats} timed runs each)')
+    print(f'~'*100)
+    benchmark_start_t = time.time()
+    environment, results = benchmarking.get_environment_info(), []
+    for case_idx, case in enumerate(cases):
+        num_flows = int(args.num_demands_factor * case['num_eps'] ** 2) if args.num_flows == 'auto' else int(args.num_flows)
+        inputs = benchmarking.gen_packer_inputs(num_eps=case['num_eps'],
+                                                num_flows=num_flows,
+                                                flow_size_dist=case['flow_size_dist'],
+                                                load=case['load'],
+                                                seed=args.seed)
+        packer_kwargs = args.vectorised_packer_kwargs if case['packer'] == 'vectorised' else {}
+        result = {'case': case, 'num_flows': num_flows, 'packer_kwargs': packer_kwargs, 'error': None}
+        try:
+            result.update(benchmarking.benchmark_packer(benchmarking.get_packer_cls(case['packer']),
+                                                        inputs,
+                                                        num_repeats=args.num_repeats,
+                                                        num_warmup=args.num_warmup,
+                                                        check_dont_exceed_one_ep_load=case['check_dont_exceed_one_ep_load'],
+                                                        **packer_kwargs))
+            print(f'Case {case_idx+1} of {len(cases)} {case} | num_flows: {num_flows} | pack_time_min: {result["pack_time_min"]:.3f} s | flows_per_second: {result["flows_per_second"]:.1f} | jensen_shannon_distance: {result["jensen_shannon_distance"]:.4f}')
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+            print(f'Case {case_idx+1} of {len(cases)} {case} | num_flows: {num_flows} | ERROR: {result["error"]}')
+        results.append(result)
+
+        # save after every case so that partial results are kept if the benchmark is stopped
+        with open(args.save_path, 'w') as f:
+            json.dump({'environment': environment, 'args': vars(args), 'results': results}, f, indent=4)
+    print(f'~'*100)
+    print(f'Ran {len(cases)} benchmark cases in {time.time() - benchmark_start_t:.3f} s. Saved results to {os.path.abspath(args.save_path)}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        print(f'~'*100)
+        print(f'Packing time vs. baseline {args.baseline} (commit {baseline["environment"]["git_commit"]}):')
+        for case, baseline_pack_time, pack_time, ratio in benchmarking.compare_benchmark_results(results, baseline['results']):
+            print(f'{case} | baseline: {baseline_pack_time:.3f} s | current: {pack_time:.3f} s | ratio: {ratio:.3f}')
+    print(f'~'*100)
@@ -0,0 +1,130 @@
+'''
+Offline benchmark of packing K replicate sets of flows (e.g. the seeds of a
+sweep) with a single packer's pack_the_flow_replicates() vs. with K separate
+packers, over a grid of num_eps and load fractions, e.g.:
+
+    $ python benchmark_packer_replicates.py --num_eps 16 64 128 --num_flows 8000 --num_replicates 8
+
+Packer inputs are generated from a seed per replicate (see
+trafpy_vectorised_packer/benchmarking.py) and results are written to a JSON
+file.
+'''
+from trafpy_vectorised_packer import benchmarking
+
+import argparse
+import json
+import time
+import os
+
+
+if __name__ == '__main__':
+    # init arg parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                '--num_eps',
+                '-N',
+                help='Numbers of end points to benchmark.',
+                type=int,
+                nargs='+',
+                default=[16, 64, 128],
+            )
+    parser.add_argument(
+                '--num_flows',
+                help='Number of flows to pack per replicate.',
+                type=int,
+                default=8000,
+            )
+    parser.add_argument(
+                '--num_replicates',
+                '-K',
+                help='Number of replicates (seeds) to pack.',
+                type=int,
+                default=8,
+            )
+    parser.add_argument(
+                '--flow_size_dist',
+                '-f',
+                help=f'Flow size dist, from {list(benchmarking.FLOW_SIZE_DISTS.keys())}.',
+                type=str,
+                default='weibull_lambda_4100',
+            )
+    parser.add_argument(
+                '--loads',
+                '-l',
+                help='Target load fractions to benchmark.',
+                type=float,
+                nargs='+',
+                default=[0.5, 0.9],
+            )
+    parser.add_argument(
+                '--check_dont_exceed_one_ep_load',
+                help='Values of check_dont_exceed_one_ep_load to benchmark.',
+                type=int,
+                nargs='+',
+                choices=[0, 1],
+                default=[1],
+            )
+    parser.add_argument(
+                '--num_repeats',
+                '-r',
+                help='Number of timed repeats of each case.',
+                type=int,
+                default=3,
+            )
+    parser.add_argument(
+                '--num_warmup',
+                '-w',
+                help='Number of untimed warmup runs of each case.',
+                type=int,
+                default=1,
+            )
+    parser.add_argument(
+                '--seed',
+                help='Seed of the first replicate, with replicate k generated from seed + k.',
+                type=int,
+                default=0,
+            )
+    parser.add_argument(
+                '--save_path',
+                '-s',
+                help='Path to save JSON results to.',
+                type=str,
+                default='packer_replicates_benchmark.json',
+            )
+    args = parser.parse_args()
+
+    cases = benchmarking.get_benchmark_cases(num_eps=args.num_eps,
+                                             load=args.loads,
+                                             check_dont_exceed_one_ep_load=[bool(check) for check in args.check_dont_exceed_one_ep_load])
+
+    print(f'~'*100)
+    print(f'Running {len(cases)} replicate benchmark cases of {args.num_replicates} replicates of {args.num_flows} flows ({args.num_warmup} warmup + {args.num_repeats} timed runs each)')
+    print(f'~'*100)
+    benchmark_start_t = time.time()
+    environment, results = benchmarking.get_environment_info(), []
+    packer_cls = benchmarking.get_packer_cls('vectorised')
+    for case_idx, case in enumerate(cases):
+        replicate_inputs = [benchmarking.gen_packer_inputs(num_eps=case['num_eps'],
+                                                           num_flows=args.num_flows,
+                                                           flow_size_dist=args.flow_size_dist,
+                                                           load=case['load'],
+                                                           seed=args.seed+replicate_idx) for replicate_idx in range(args.num_replicates)]
+        result = {'case': case, 'num_flows': args.num_flows, 'num_replicates': args.num_replicates, 'error': None}
+        try:
+            result.update(benchmarking.benchmark_packer_replicates(packer_cls,
+                                                                   replicate_inputs,
+                                                                   num_repeats=args.num_repeats,
+                                                                   num_warmup=args.num_warmup,
+                                                                   check_dont_exceed_one_ep_load=case['check_dont_exceed_one_ep_load']))
+            print(f'Case {case_idx+1} of {len(cases)} {case} | separate: {result["separate_pack_time_min"]:.3f} s | replicates: {result["replicates_pack_time_min"]:.3f} s | speedup: {result["speedup"]:.2f}x | jensen_shannon_distance: {result["separate_jensen_shannon_distance"]:.4f} vs. {result["replicates_jensen_shannon_distance"]:.4f}')
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+            print(f'Case {case_idx+1} of {len(cases)} {case} | ERROR: {result["error"]}')
+        results.append(result)
+
+        # save after every case so that partial results are kept if the benchmark is stopped
+        with open(args.save_path, 'w') as f:
+            json.dump({'environment': environment, 'args': vars(args), 'results': results}, f, indent=4)
+    print(f'~'*100)
+    print(f'Ran {len(cases)} replicate benchmark cases in {time.time() - benchmark_start_t:.3f} s. Saved results to {os.path.abspath(args.save_path)}')
+    print(f'~'*100)
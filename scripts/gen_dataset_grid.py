@@ -0,0 +1,279 @@
+'''
+Parallel dataset generation over a grid of pulse_gen.py parameters. Expands
+the grid of seeds x loads x network sizes (X) x node dist skews (sd) x flow
+size dist lambdas into one task per cell and generates the cells on a
+bounded process pool, e.g.:
+
+    $ python gen_dataset_grid.py --seeds 0 1 --loads 0.5 0.7 0.9 --X 2 --sds 1 2 3 4 --lambdas 2100 3100 4100 -n 8
+
+The network and node dist of each (X, sd) and the flow size dist of each
+lambda are generated once in the main process (seeded with --setup_seed, so
+every seed and load of a network size and skew packs towards the same node
+dist) rather than once per cell. Node dists are saved to .npy files which
+the workers memory-map read-only, so they are shared between workers rather
+than copied into each.
+
+Each cell is saved as a columnar dataset (see
+trafpy_vectorised_packer/columnar.py) which is written to a temporary
+directory and only renamed to its final path once complete, so an
+interrupted grid can be resumed by re-running the same command: cells whose
+dataset already exists are skipped.
+'''
+from trafpy_vectorised_packer import columnar
+
+import argparse
+import multiprocessing
+import itertools
+import random
+import shutil
+import time
+import os
+
+import numpy as np
+
+
+# node dist skew params of each sd (as in pulse_gen.py)
+SK_ND = [0, 0.25, 0.5, 0.75, 0.5625, 0.8125, 0.3125, 0.5625, 0.8125]
+SK_PR = [1, 0.64, 0.64, 0.64, 0.16, 0.16, 0.32, 0.32, 0.32]
+
+# per-process cache of the memory-mapped node dists of each (X, sd), so that workers reuse them across cells
+_worker_node_dists = {}
+
+
+def get_num_eps(X):
+    return int(X * 64)
+
+
+def get_save_dir(path_to_save, task):
+    return path_to_save+"/lambda{}_seed{}_load{}_N{}_sd{}".format(task['lambda'], task['seed'], task['load'], get_num_eps(task['X']), task['sd'])
+
+
+def is_task_complete(save_dir):
+    try:
+        columnar.ColumnarDemandReader(save_dir)
+        return True
+    except Exception:
+        return False
+
+
+def gen_setups(grid, setups_dir, setup_seed=0):
+    '''
+    Generates the network and node dist of each (X, sd) and the flow size
+    dist of each lambda of the grid once. Node dists are saved to .npy files
+    in setups_dir for the workers to memory-map; everything else is small
+    and is passed to the workers with each task.
+    '''
+    import trafpy.generator as tpg
+    from trafpy.utils import seed_stochastic_modules_globally
+
+    os.makedirs(setups_dir, exist_ok=True)
+    network_setups = {}
+    for X, sd in itertools.product(grid['X'], grid['sd']):
+        seed_stochastic_modules_globally(default_seed=setup_seed,
+                                         numpy_module=np,
+                                         random_module=random)
+        ns = get_num_eps(X)
+        SN, SK = SK_ND[sd-1], SK_PR[sd-1]
+        net = tpg.gen_arbitrary_network(ep_label=None, num_eps=ns, ep_capacity=100000)
+        node_dist = tpg.gen_multimodal_node_dist(eps=net.graph['endpoints'],
+                                                 skewed_nodes=[],
+                                                 skewed_node_probs=[SK/(SN*ns) for _ in range(int(SN*ns))],
+                                                 show_fig=False,
+                                                 plot_chord=False,
+                                                 num_skewed_nodes=int(SN*ns))
+        node_dist_path = os.path.join(setups_dir, f'node_dist_N{ns}_sd{sd}.npy')
+        np.save(node_dist_path, np.asarray(node_dist))
+        network_setups[(X, sd)] = {'eps': list(net.graph['endpoints']),
+                                   'node_dist_path': node_dist_path,
+                                   'network_rate_capacity': net.graph['max_nw_capacity'],
+                                   'ep_link_capacity': net.graph['ep_link_capacity']}
+
+    flow_size_dists = {}
+    for _lambda in grid['lambda']:
+        flow_size_dists[_lambda] = tpg.gen_named_val_dist(dist='weibull',
+                                                          params={'_alpha': 4.8, '_lambda': _lambda},
+                                                          return_data=False,
+                                                          show_fig=False,
+                                                          round_to_nearest=1000)
+
+    return network_setups, flow_size_dists
+
+
+def run_task(task):
+    '''
+    Generates and saves the dataset of one cell of the grid. Returns a dict
+    of the task, its save_dir and its generation time, or its error if it
+    raised (so that one failed cell does not stop the grid).
+    '''
+    import trafpy.generator as tpg
+    from trafpy.utils import seed_stochastic_modules_globally
+
+    start_t = time.time()
+    result = {'task': {key: val for key, val in task.items() if key not in {'network_setup', 'flow_size_dist'}}, 'save_dir': task['save_dir'], 'error': None}
+    tmp_save_dir = task['save_dir'] + '.tmp'
+    try:
+        seed_stochastic_modules_globally(default_seed=task['seed'],
+                                         numpy_module=np,
+                                         random_module=random)
+        network_setup = task['network_setup']
+        if network_setup['node_dist_path'] not in _worker_node_dists:
+            _worker_node_dists[network_setup['node_dist_path']] = np.load(network_setup['node_dist_path'], mmap_mode='r')
+        ns = get_num_eps(task['X'])
+        flow_centric_demand_data = tpg.create_demand_data(eps=network_setup['eps'],
+                                                          node_dist=_worker_node_dists[network_setup['node_dist_path']],
+                                                          flow_size_dist=task['flow_size_dist'],
+                                                          interarrival_time_dist={0.125: 1},
+                                                          network_load_config={'network_rate_capacity': network_setup['network_rate_capacity'],
+                                                                               'ep_link_capacity': network_setup['ep_link_capacity'],
+                                                                               'target_load_fraction': task['load']},
+                                                          jensen_shannon_distance_threshold=task['jensen_shannon_distance_threshold'],
+                                                          min_num_demands=ns*ns,
+                                                          min_last_demand_arrival_time=task['min_last_demand_arrival_time'],
+                                                          check_dont_exceed_one_ep_load=True,
+                                                          auto_node_dist_correction=True,
+                                                          print_data=task['print_data'],
+                                                          )
+
+        # write to a temporary dir and only rename to the final dir once complete, so that the final dir only ever holds complete datasets
+        columnar.write_demand_data(tmp_save_dir, flow_centric_demand_data, overwrite=True, metadata=result['task'])
+        if task['export_mat']:
+            columnar.convert_to_mat(tmp_save_dir, tmp_save_dir+'.mat')
+            os.replace(tmp_save_dir+'.mat', task['save_dir']+'.mat')
+        if os.path.exists(task['save_dir']):
+            # only reached if overwriting
+            shutil.rmtree(task['save_dir'])
+        os.replace(tmp_save_dir, task['save_dir'])
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+        shutil.rmtree(tmp_save_dir, ignore_errors=True)
+    result['time'] = time.time() - start_t
+    return result
+
+
+if __name__ == '__main__':
+    # init arg parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                '--seeds',
+                help='Seeds of the grid.',
+                type=int,
+                nargs='+',
+                default=[0, 1],
+            )
+    parser.add_argument(
+                '--loads',
+                '-l',
+                help='Target load fractions of the grid.',
+                type=float,
+                nargs='+',
+                default=[0.5, 0.7, 0.9],
+            )
+    parser.add_argument(
+                '--X',
+                help='Network sizes of the grid, in multiples of 64 end points.',
+                type=float,
+                nargs='+',
+                default=[2],
+            )
+    parser.add_argument(
+                '--sds',
+                help=f'Node dist skews of the grid, as 1-indexed sd values of pulse_gen.py (1 to {len(SK_ND)}).',
+                type=int,
+                nargs='+',
+                default=[1, 2, 3, 4],
+            )
+    parser.add_argument(
+                '--lambdas',
+                help='Weibull flow size dist _lambda params of the grid.',
+                type=int,
+                nargs='+',
+                default=[2100, 3100, 4100],
+            )
+    parser.add_argument(
+                '--num_workers',
+                '-n',
+                help='Number of worker processes. If None, uses the number of cores.',
+                type=int,
+                default=None,
+            )
+    parser.add_argument(
+                '--path_to_save',
+                '-s',
+                help='Dir to save the dataset of each cell of the grid to.',
+                type=str,
+                default='/scratch/datasets/trafpy_pulse_gen/',
+            )
+    parser.add_argument(
+                '--setup_seed',
+                help='Seed with which the network and node dist of each network size and skew are generated.',
+                type=int,
+                default=0,
+            )
+    parser.add_argument(
+                '--jensen_shannon_distance_threshold',
+                help='Jensen Shannon distance threshold passed to tpg.create_demand_data().',
+                type=float,
+                default=0.1,
+            )
+    parser.add_argument(
+                '--min_last_demand_arrival_time',
+                help='Min last demand arrival time passed to tpg.create_demand_data().',
+                type=float,
+                default=250,
+            )
+    parser.add_argument(
+                '--export_mat',
+                help='If given, also exports each cell\'s dataset to a .mat file.',
+                action='store_true',
+            )
+    parser.add_argument(
+                '--overwrite',
+                help='If given, regenerates cells whose dataset already exists rather than skipping them.',
+                action='store_true',
+            )
+    parser.add_argument(
+                '--print_data',
+                help='If given, workers print the packer\'s data.',
+                action='store_true',
+            )
+    args = parser.parse_args()
+
+    for sd in args.sds:
+        if not 1 <= sd <= len(SK_ND):
+            raise Exception(f'sd must be in [1, {len(SK_ND)}] but is {sd}')
+    grid = {'seed': args.seeds, 'load': args.loads, 'X': args.X, 'sd': args.sds, 'lambda': args.lambdas}
+    cells = [dict(zip(grid.keys(), vals)) for vals in itertools.product(*grid.values())]
+    os.makedirs(args.path_to_save, exist_ok=True)
+    for cell in cells:
+        cell['save_dir'] = get_save_dir(args.path_to_save, cell)
+    tasks = [cell for cell in cells if args.overwrite or not is_task_complete(cell['save_dir'])]
+
+    print(f'~'*100)
+    print(f'Generating {len(tasks)} of {len(cells)} grid cells ({len(cells) - len(tasks)} already complete) with {args.num_workers if args.num_workers is not None else os.cpu_count()} workers. Saving to {os.path.abspath(args.path_to_save)}')
+    print(f'~'*100)
+    grid_start_t = time.time()
+    if len(tasks) > 0:
+        start_t = time.time()
+        network_setups, flow_size_dists = gen_setups({key: sorted(set(task[key] for task in tasks)) for key in ['X', 'sd', 'lambda']}, setups_dir=os.path.join(args.path_to_save, '.setups'), setup_seed=args.setup_seed)
+        print(f'Generated {len(network_setups)} network setups and {len(flow_size_dists)} flow size dists in {time.time() - start_t:.3f} s.')
+        for task in tasks:
+            task.update({'network_setup': network_setups[(task['X'], task['sd'])],
+                         'flow_size_dist': flow_size_dists[task['lambda']],
+                         'jensen_shannon_distance_threshold': args.jensen_shannon_distance_threshold,
+                         'min_last_demand_arrival_time': args.min_last_demand_arrival_time,
+                         'export_mat': args.export_mat,
+                         'print_data': args.print_data})
+        # run the largest networks first so that the pool is not left waiting on one large cell at the end
+        tasks = sorted(tasks, key=lambda task: task['X'], reverse=True)
+
+    num_errors = 0
+    with multiprocessing.Pool(processes=args.num_workers) as pool:
+        for task_idx, result in enumerate(pool.imap_unordered(run_task, tasks, chunksize=1)):
+            if result['error'] is not None:
+                num_errors += 1
+                print(f'Cell {task_idx+1} of {len(tasks)} {result["task"]} | ERROR: {result["error"]}')
+            else:
+                print(f'Cell {task_idx+1} of {len(tasks)} {result["task"]} | time: {result["time"]:.3f} s | Saved data to {result["save_dir"]}/')
+    print(f'~'*100)
+    print(f'Generated {len(tasks) - num_errors} of {len(tasks)} grid cells ({num_errors} errors) in {time.time() - grid_start_t:.3f} s.')
+    print(f'~'*100)
@@ -2,9 +2,11 @@ from trafpy.generator import Demand, DemandPlotter
 import trafpy.generator as tpg
 from trafpy.benchmarker import BenchmarkImporter
 from trafpy.utils import seed_stochastic_modules_globally, gen_unique_experiment_folder
+from trafpy_vectorised_packer.profiling import MemoryProfiler
 
 import time
 import copy
+import contextlib
 from scipy.io import savemat
 
 import matplotlib.pyplot as plt
@@ -28,6 +30,10 @@ def run(cfg: DictConfig):
     # 2. Transfer locally to e.g. /home/cwfparsonson/Downloads
     # 3. Run snakeviz /home/cwfparsonson/Downloads/<name>.prof to visualise
 
+    # HOW TO USE MEMORY PROFILER:
+    # 1. Set experiment.profile_memory=True to generate a file called memory_profile_<i>.json next to the time profile
+    # 2. See phases for the peak and retained memory of each packer phase (reset, pack_loop, shuffle, output_construction) and top_sites for the allocating lines which retained the most memory
+
     if 'seed' in cfg.experiment:
         seed_stochastic_modules_globally(default_seed=cfg.experiment.seed,
                                          numpy_module=np,
@@ -96,18 +102,23 @@ def run(cfg: DictConfig):
     if cfg.experiment.profile_time:
         profiler = cProfile.Profile()
         profiler.enable()
+    # packers constructed while the memory profiler is active record the memory of their phases in it
+    memory_profiler = MemoryProfiler() if cfg.experiment.get('profile_memory', False) else None
     
     start_t = time.time()
     
-    flow_centric_demand_data, packing_time, packing_jensen_shannon_distance = tpg.create_demand_data(eps=net.graph['endpoints'],
-                                                                                                     node_dist=node_dist,
-                                                                                                     flow_size_dist=flow_size_dist,
-                                                                                                     interarrival_time_dist=interarrival_time_dist,
-                                                                                                     network_load_config=network_load_config,
-                                                                                                     return_packing_time=True,
-                                                                                                     return_packing_jensen_shannon_distance=True,
-                                                                                                     **cfg.generator)
+    with memory_profiler.activate() if memory_profiler is not None else contextlib.nullcontext():
+        flow_centric_demand_data, packing_time, packing_jensen_shannon_distance = tpg.create_demand_data(eps=net.graph['endpoints'],
+                                                                                                         node_dist=node_dist,
+                                                                                                         flow_size_dist=flow_size_dist,
+                                                                                                         interarrival_time_dist=interarrival_time_dist,
+                                                                                                         network_load_config=network_load_config,
+                                                                                                         return_packing_time=True,
+                                                                                                         return_packing_jensen_shannon_distance=True,
+                                                                                                         **cfg.generator)
     print(f'Generated flow data in {time.time() - start_t:.3f} s.')
+    if memory_profiler is not None:
+        print(f'Memory profile: {memory_profiler}')
 
     print(f'Plotting figures...')
     start_t = time.time()
@@ -152,5 +163,13 @@ def run(cfg: DictConfig):
         stats.dump_stats(f'{save_dir}/{file_name}_{i}.prof')
         print(f'Saved time profile to {save_dir}/{file_name}_{i}.prof')
 
+    if memory_profiler is not None:
+        file_name = 'memory_profile'
+        i = 0
+        while os.path.exists(f'{save_dir}/{file_name}_{i}.json'):
+            i += 1
+        memory_profiler.save(f'{save_dir}/{file_name}_{i}.json')
+        print(f'Saved memory profile to {save_dir}/{file_name}_{i}.json')
+
 if __name__ == '__main__':
     run()
@@ -1,11 +1,14 @@
 from trafpy.utils import seed_stochastic_modules_globally, gen_unique_experiment_folder
 from trafpy.generator import Demand, DemandPlotter
 import trafpy.generator as tpg
+from trafpy_vectorised_packer.profiling import MemoryProfiler
+from trafpy_vectorised_packer import columnar
 
 import time
 import copy
+import contextlib
 import pathlib
-from scipy.io import savemat
+import shutil
 import sys
 import os
 
@@ -47,7 +50,7 @@ def run(cfg: DictConfig):
 
     # init path to save data
     path = cfg.experiment.path_to_save
-    save_dir = path+"/lambda{}_seed{}_load{}_N{}".format(cfg.flow_size_dist.params._lambda, cfg.experiment.seed, cfg.network.load, ns)
+    save_dir = path+"/lambda{}_seed{}_load{}_N{}_sd{}".format(cfg.flow_size_dist.params._lambda, cfg.experiment.seed, cfg.network.load, ns, cfg.node_dist.sd)
     cfg['experiment']['save_dir'] = save_dir
 
     # init weights and biases
@@ -95,22 +98,36 @@ def run(cfg: DictConfig):
                            'ep_link_capacity': net.graph['ep_link_capacity'],
                            'target_load_fraction': cfg.network.load}
     
-    flow_centric_demand_data = tpg.create_demand_data(eps=net.graph['endpoints'],
-                                                      node_dist=node_dist,
-                                                      flow_size_dist=flow_size_dist,
-                                                      interarrival_time_dist=interarrival_time_dist,
-                                                      network_load_config=network_load_config,
-                                                      jensen_shannon_distance_threshold=jensen_shannon_distance_threshold,
-                                                      min_num_demands=min_num_demands,
-                                                      min_last_demand_arrival_time=min_last_demand_arrival_time,
-                                                      check_dont_exceed_one_ep_load=True,
-                                                      auto_node_dist_correction=True,
-                                                      print_data=True,
-                                                      )
+    # packers constructed while the memory profiler is active record the memory of their phases in it
+    memory_profiler = MemoryProfiler() if cfg.experiment.get('profile_memory', False) else None
+    with memory_profiler.activate() if memory_profiler is not None else contextlib.nullcontext():
+        flow_centric_demand_data = tpg.create_demand_data(eps=net.graph['endpoints'],
+                                                          node_dist=node_dist,
+                                                          flow_size_dist=flow_size_dist,
+                                                          interarrival_time_dist=interarrival_time_dist,
+                                                          network_load_config=network_load_config,
+                                                          jensen_shannon_distance_threshold=jensen_shannon_distance_threshold,
+                                                          min_num_demands=min_num_demands,
+                                                          min_last_demand_arrival_time=min_last_demand_arrival_time,
+                                                          check_dont_exceed_one_ep_load=True,
+                                                          auto_node_dist_correction=True,
+                                                          print_data=True,
+                                                          )
+    if memory_profiler is not None:
+        memory_profiler.save(save_dir+'_memory_profile.json')
+        print(f'Saved memory profile to {save_dir}_memory_profile.json')
     
     demand = Demand(flow_centric_demand_data, net.graph['endpoints'])
-    savemat(save_dir+'.mat', flow_centric_demand_data)
-    print(f'Saved data to {save_dir}.mat')
+    # N.B. tpg.create_demand_data() returns the full demand dict, so this only changes the on-disk format, not the peak memory of generation
+    # write to a temporary dir and only rename to save_dir once complete, so that save_dir only ever holds a complete dataset
+    columnar.write_demand_data(save_dir+'.tmp', flow_centric_demand_data, overwrite=True, metadata=OmegaConf.to_container(cfg))
+    if os.path.exists(save_dir):
+        shutil.rmtree(save_dir)
+    os.replace(save_dir+'.tmp', save_dir)
+    print(f'Saved data to {save_dir}/')
+    if cfg.experiment.get('export_mat', False):
+        columnar.convert_to_mat(save_dir, save_dir+'.mat')
+        print(f'Exported data to {save_dir}.mat')
 
     end = time.time()
     print('Generated load {} in {} seconds.'.format(cfg.network.load, end-start))
@@ -0,0 +1,227 @@
+'''
+Local alternative to run_wandb_sweep.py which needs no tmux session, conda
+env activation or wandb sweep controller. Reads the program and parameter
+grid of the same wandb_sweep_config.yaml, expands it into runs and runs them
+on a pool of worker processes (sized to the number of cores by default), e.g.:
+
+    $ python run_local_sweep.py -c wandb_sweep_config.yaml -n 8
+
+Workers are started once and stay warm for the whole sweep: each imports the
+program (e.g. pulse_gen.py) and composes its hydra config with the run's
+parameters as overrides, then calls the program's run() directly rather than
+launching a new python process per run. Imports, compiled numba kernels, the
+packer's in-process pair structure cache and the networks generated by
+tpg.gen_arbitrary_network() (which only depend on its args, and are copied
+for each run) are therefore reused between the runs of a worker.
+
+The wandb logging of the programs is disabled (with a ~wandb override).
+Instead, each run's stdout/stderr is written to a log file and a record of
+each run (its overrides, status, error, time and save_dir) is appended to
+results.jsonl in the results dir. Runs which have already finished in the
+results dir are skipped, so an interrupted sweep can be resumed by re-running
+the same command.
+'''
+import yaml
+import argparse
+
+import multiprocessing
+import contextlib
+import copy
+import itertools
+import importlib
+import functools
+import traceback
+import hashlib
+import json
+import time
+import sys
+import os
+
+import numpy as np
+
+
+# hydra config name of each program (as passed to its @hydra.main)
+PROGRAM_CONFIG_NAMES = {'packer_speed_test.py': 'traffic_generation_default.yaml',
+                        'pulse_gen.py': 'traffic_generation_pulse.yaml'}
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# state of each (warm) worker process, set by _init_worker()
+_worker = {}
+
+
+def get_sweep_runs(sweep_config, num_runs=None, seed=0):
+    '''
+    Expands the parameters of a wandb sweep config into a list of runs, each
+    a dict of parameter -> value. Parameters may have a single value or a
+    list of values. With method grid, every combination of values is a run;
+    with method random, num_runs combinations are sampled.
+    '''
+    method = sweep_config.get('method', 'grid')
+    if method not in {'grid', 'random'}:
+        raise Exception(f'Unsupported sweep method {method}, must be one of grid, random')
+    params = {}
+    for param, param_config in sweep_config.get('parameters', {}).items():
+        if 'values' in param_config:
+            params[param] = list(param_config['values'])
+        elif 'value' in param_config:
+            params[param] = [param_config['value']]
+        else:
+            raise Exception(f'Unsupported config {param_config} of parameter {param}, must have value or values')
+
+    if method == 'grid':
+        return [dict(zip(params.keys(), vals)) for vals in itertools.product(*params.values())]
+    if num_runs is None:
+        raise Exception(f'Must give num_runs with sweep method random')
+    rng = np.random.default_rng(seed)
+    return [{param: vals[rng.integers(len(vals))] for param, vals in params.items()} for _ in range(num_runs)]
+
+
+def get_run_id(program, run_params):
+    return hashlib.sha256(json.dumps([program, run_params], sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_finished_run_ids(results_path):
+    finished_run_ids = set()
+    if os.path.exists(results_path):
+        with open(results_path, 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['status'] == 'finished':
+                    finished_run_ids.add(record['run_id'])
+    return finished_run_ids
+
+
+def _init_worker(program, config_name):
+    import matplotlib
+    matplotlib.use('Agg')
+    from hydra import initialize_config_dir
+    import trafpy.generator as tpg
+
+    # hydra stays initialised for all runs of the worker
+    initialize_config_dir(config_dir=os.path.join(SCRIPTS_DIR, 'configs'), version_base=None)
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    _worker['module'] = importlib.import_module(os.path.splitext(program)[0])
+    _worker['config_name'] = config_name
+
+    # networks only depend on the args they are generated from, so reuse them across runs. Each run gets its own copy so that a run which modifies its network (e.g. net.graph) does not change the network of later runs
+    gen_arbitrary_network = tpg.gen_arbitrary_network
+    networks = {}
+    @functools.wraps(gen_arbitrary_network)
+    def gen_cached_arbitrary_network(*args, **kwargs):
+        key = repr((args, sorted(kwargs.items())))
+        if key not in networks:
+            networks[key] = gen_arbitrary_network(*args, **kwargs)
+        return copy.deepcopy(networks[key])
+    tpg.gen_arbitrary_network = gen_cached_arbitrary_network
+
+
+def run_sweep_run(run):
+    '''
+    Runs the program with the run's parameters as hydra overrides in this
+    (warm) worker and returns a record of the run.
+    '''
+    from hydra import compose
+
+    start_t = time.time()
+    record = {'run_id': run['run_id'], 'params': run['params'], 'status': 'finished', 'error': None, 'log_path': run['log_path'], 'save_dir': None, 'pid': os.getpid()}
+    with open(run['log_path'], 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            cfg = compose(config_name=_worker['config_name'], overrides=[f'{param}={val}' for param, val in run['params'].items()] + ['~wandb'])
+            # call the undecorated run() since hydra.main would parse sys.argv and change the working dir
+            _worker['module'].run.__wrapped__(cfg)
+            record['save_dir'] = cfg.experiment.get('save_dir', None)
+        except Exception as e:
+            traceback.print_exc()
+            record['status'] = 'failed'
+            record['error'] = f'{type(e).__name__}: {e}'
+    record['time'] = time.time() - start_t
+    return record
+
+
+if __name__ == '__main__':
+    # init arg parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                '--wandb_sweep_config',
+                '-c',
+                help='Relative path to <wandb_sweep_config>.yaml file whose program and parameters to sweep.',
+                type=str,
+                default='wandb_sweep_config.yaml',
+            )
+    parser.add_argument(
+                '--num_workers',
+                '-n',
+                help='Number of worker processes. If None, uses the number of cores.',
+                type=int,
+                default=None,
+            )
+    parser.add_argument(
+                '--config_name',
+                help=f'Hydra config name of the program. If None, uses the config name of the program from {PROGRAM_CONFIG_NAMES}.',
+                type=str,
+                default=None,
+            )
+    parser.add_argument(
+                '--num_runs',
+                help='Number of runs to sample if the sweep method is random.',
+                type=int,
+                default=None,
+            )
+    parser.add_argument(
+                '--seed',
+                help='Seed with which runs are sampled if the sweep method is random.',
+                type=int,
+                default=0,
+            )
+    parser.add_argument(
+                '--results_dir',
+                '-r',
+                help='Dir in which to save results.jsonl and the log of each run.',
+                type=str,
+                default='local_sweep_results',
+            )
+    parser.add_argument(
+                '--rerun',
+                help='If given, reruns runs which have already finished in results_dir rather than skipping them.',
+                action='store_true',
+            )
+    args = parser.parse_args()
+
+    with open(args.wandb_sweep_config, 'r') as f:
+        sweep_config = yaml.safe_load(f)
+    program = sweep_config['program']
+    config_name = args.config_name if args.config_name is not None else PROGRAM_CONFIG_NAMES.get(program)
+    if config_name is None:
+        raise Exception(f'Unknown config name of program {program}, must give --config_name')
+
+    os.makedirs(os.path.join(args.results_dir, 'logs'), exist_ok=True)
+    results_path = os.path.join(args.results_dir, 'results.jsonl')
+    finished_run_ids = set() if args.rerun else load_finished_run_ids(results_path)
+    runs = []
+    for run_params in get_sweep_runs(sweep_config, num_runs=args.num_runs, seed=args.seed):
+        run_id = get_run_id(program, run_params)
+        if run_id not in finished_run_ids:
+            runs.append({'run_id': run_id, 'params': run_params, 'log_path': os.path.abspath(os.path.join(args.results_dir, 'logs', f'{run_id}.log'))})
+    num_workers = min(args.num_workers if args.num_workers is not None else os.cpu_count(), max(len(runs), 1))
+
+    print(f'~'*100)
+    print(f'Running {len(runs)} runs of {program} ({len(finished_run_ids)} already finished) with {num_workers} workers. Saving results to {os.path.abspath(results_path)}')
+    print(f'~'*100)
+    sweep_start_t = time.time()
+    num_failed = 0
+    with multiprocessing.Pool(processes=num_workers, initializer=_init_worker, initargs=(program, config_name)) as pool:
+        # the main process is the only writer of the results store
+        with open(results_path, 'a') as results_file:
+            for run_idx, record in enumerate(pool.imap_unordered(run_sweep_run, runs, chunksize=1)):
+                results_file.write(json.dumps(record) + '\n')
+                results_file.flush()
+                if record['status'] == 'failed':
+                    num_failed += 1
+                    print(f'Run {run_idx+1} of {len(runs)} {record["params"]} | ERROR: {record["error"]} | log: {record["log_path"]}')
+                else:
+                    print(f'Run {run_idx+1} of {len(runs)} {record["params"]} | time: {record["time"]:.3f} s | save_dir: {record["save_dir"]}')
+    print(f'~'*100)
+    print(f'Finished {len(runs) - num_failed} of {len(runs)} runs ({num_failed} failed) in {time.time() - sweep_start_t:.3f} s.')
+    print(f'~'*100)
@@ -0,0 +1,175 @@
+'''
+Scaling report for the packer. Packs a geometric grid of numbers of end
+points and flows (see trafpy_vectorised_packer/scaling.py), fits log-log
+scaling exponents of packing time and peak memory, predicts the cost of the
+given target jobs and saves the costs and fits to JSON. If a baseline report
+is given, exits with a non-zero status if any exponent has regressed by more
+than the tolerance, e.g.:
+
+    $ python scaling_report.py --save_path baseline_scaling.json
+    $ python scaling_report.py --save_path scaling.json --baseline baseline_scaling.json --predict 4096:83886080
+'''
+from trafpy_vectorised_packer import benchmarking, scaling
+
+import argparse
+import json
+import time
+import sys
+import os
+
+
+def get_geometric_grid(start, stop, factor):
+    grid = [start]
+    while grid[-1] * factor <= stop:
+        grid.append(int(grid[-1] * factor))
+    return grid
+
+
+if __name__ == '__main__':
+    # init arg parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+                '--packer',
+                '-p',
+                help=f'Packer to analyse, either a name ({list(benchmarking.PACKER_CLS_PATHS.keys())}) or the import path of a packer class.',
+                type=str,
+                default='vectorised',
+            )
+    parser.add_argument(
+                '--packer_kwargs',
+                help='JSON dict of extra kwargs (e.g. \'{"backend": "numba"}\') to construct the packer with.',
+                type=json.loads,
+                default={},
+            )
+    parser.add_argument(
+                '--num_eps_range',
+                help='Min and max number of end points of the grid.',
+                type=int,
+                nargs=2,
+                default=[8, 256],
+            )
+    parser.add_argument(
+                '--num_flows_range',
+                help='Min and max number of flows of the grid.',
+                type=int,
+                nargs=2,
+                default=[1000, 64000],
+            )
+    parser.add_argument(
+                '--grid_factor',
+                help='Factor between consecutive num_eps and num_flows of the grid.',
+                type=float,
+                default=2,
+            )
+    parser.add_argument(
+                '--flow_size_dist',
+                '-f',
+                help=f'Flow size dist, from {list(benchmarking.FLOW_SIZE_DISTS.keys())}.',
+                type=str,
+                default='weibull_lambda_4100',
+            )
+    parser.add_argument(
+                '--load',
+                '-l',
+                help='Target load fraction.',
+                type=float,
+                default=0.5,
+            )
+    parser.add_argument(
+                '--num_repeats',
+                '-r',
+                help='Number of timed repeats of each grid point (min time is used).',
+                type=int,
+                default=3,
+            )
+    parser.add_argument(
+                '--no_memory',
+                help='If given, does not measure peak memory.',
+                action='store_true',
+            )
+    parser.add_argument(
+                '--predict',
+                help='Target jobs to predict the packing time and peak memory of, as num_eps:num_flows.',
+                type=str,
+                nargs='*',
+                default=['1024:5242880', '2048:20971520', '4096:83886080'],
+            )
+    parser.add_argument(
+                '--save_path',
+                '-s',
+                help='Path to save JSON report to.',
+                type=str,
+                default='scaling_report.json',
+            )
+    parser.add_argument(
+                '--baseline',
+                '-b',
+                help='Path to JSON report of a previous run (e.g. of another commit) to check the fitted exponents against.',
+                type=str,
+                default=None,
+            )
+    parser.add_argument(
+                '--tolerance',
+                '-t',
+                help='Max increase of an exponent over its baseline before it is flagged as a regression.',
+                type=float,
+                default=0.1,
+            )
+    args = parser.parse_args()
+
+    grid = benchmarking.get_benchmark_cases(num_eps=get_geometric_grid(*args.num_eps_range, args.grid_factor),
+                                            num_flows=get_geometric_grid(*args.num_flows_range, args.grid_factor))
+    packer_cls = benchmarking.get_packer_cls(args.packer)
+
+    print(f'~'*100)
+    print(f'Measuring packing cost of {args.packer} at {len(grid)} grid points')
+    print(f'~'*100)
+    start_t = time.time()
+    costs = []
+    for point_idx, point in enumerate(grid):
+        try:
+            cost = scaling.measure_packing_cost(packer_cls,
+                                                num_repeats=args.num_repeats,
+                                                measure_memory=not args.no_memory,
+                                                flow_size_dist=args.flow_size_dist,
+                                                load=args.load,
+                                                **point,
+                                                **args.packer_kwargs)
+        except Exception as e:
+            print(f'Point {point_idx+1} of {len(grid)} {point} | ERROR: {type(e).__name__}: {e}')
+            continue
+        costs.append(cost)
+        print(f'Point {point_idx+1} of {len(grid)} {point} | time: {cost["time"]:.3f} s' + (f' | peak_memory: {cost["peak_memory"] / 1e6:.1f} MB' if 'peak_memory' in cost else ''))
+    print(f'Measured {len(costs)} grid points in {time.time() - start_t:.3f} s.')
+
+    metrics = ['time'] if args.no_memory else ['time', 'peak_memory']
+    fits = {metric: scaling.fit_scaling_exponents(costs, metric=metric) for metric in metrics}
+    print(f'~'*100)
+    for metric, fit in fits.items():
+        print(f'{metric} ~= {fit["coef"]:.3e} * N^{fit["num_eps_exponent"]:.3f} * F^{fit["num_flows_exponent"]:.3f} (r2: {fit["r2"]:.3f})')
+
+    predictions = []
+    for job in args.predict:
+        num_eps, num_flows = [int(val) for val in job.split(':')]
+        prediction = {'num_eps': num_eps, 'num_flows': num_flows}
+        prediction.update({metric: scaling.predict_cost(fit, num_eps, num_flows) for metric, fit in fits.items()})
+        predictions.append(prediction)
+        print(f'Predicted N={num_eps} F={num_flows} | time: {prediction["time"]:.1f} s' + (f' | peak_memory: {prediction["peak_memory"] / 1e9:.2f} GB' if 'peak_memory' in prediction else ''))
+
+    with open(args.save_path, 'w') as f:
+        json.dump({'environment': benchmarking.get_environment_info(), 'args': vars(args), 'costs': costs, 'fits': fits, 'predictions': predictions}, f, indent=4)
+    print(f'Saved scaling report to {os.path.abspath(args.save_path)}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = scaling.find_scaling_regressions(fits, baseline['fits'], tolerance=args.tolerance)
+        print(f'~'*100)
+        if len(regressions) > 0:
+            print(f'Found {len(regressions)} scaling regressions vs. baseline {args.baseline} (commit {baseline["environment"]["git_commit"]}):')
+            for regression in regressions:
+                print(f'\t{regression}')
+            print(f'~'*100)
+            sys.exit(1)
+        print(f'No scaling regressions vs. baseline {args.baseline} (commit {baseline["environment"]["git_commit"]}).')
+    print(f'~'*100)
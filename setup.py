@@ -4,4 +4,5 @@ setuptools.setup(name="trafpy_vectorised_packer",
                  version="1.0",
                  description="Speed-up of the flow packing algorithm proposed in the original TrafPy paper.",
                  packages=setuptools.find_packages(),
+                 extras_require={'numba': ['numba']},
                  python_requires='>=3.8')
@@ -0,0 +1,53 @@
+import numpy as np
+
+from trafpy_vectorised_packer.pair_cache import PairStructureCache
+
+
+def gen_node_dist(num_eps, seed=0):
+    node_dist = np.random.default_rng(seed).random((num_eps, num_eps))
+    np.fill_diagonal(node_dist, 0)
+    return node_dist / np.sum(node_dist)
+
+
+def get_entry_nbytes(num_eps, seed=0):
+    entry = PairStructureCache(max_nbytes=None).get([str(ep) for ep in range(num_eps)], gen_node_dist(num_eps, seed=seed))
+    return sum(arr.nbytes for arr in entry.values())
+
+
+def test_evicts_least_recently_used_entries_by_nbytes():
+    num_eps = 32
+    eps = [str(ep) for ep in range(num_eps)]
+    entry_nbytes = get_entry_nbytes(num_eps)
+    # room for 2 but not 3 entries
+    cache = PairStructureCache(max_size=16, max_nbytes=int(2.5 * entry_nbytes))
+
+    cache.get(eps, gen_node_dist(num_eps, seed=0))
+    cache.get(eps, gen_node_dist(num_eps, seed=1))
+    assert len(cache.entries) == 2 and cache.nbytes == 2 * entry_nbytes
+    # use seed 0 so that seed 1 is the least recently used
+    cache.get(eps, gen_node_dist(num_eps, seed=0))
+    cache.get(eps, gen_node_dist(num_eps, seed=2))
+    assert len(cache.entries) == 2 and cache.nbytes == 2 * entry_nbytes
+    assert cache.get_key(eps, gen_node_dist(num_eps, seed=1)) not in cache.entries
+    assert cache.get_key(eps, gen_node_dist(num_eps, seed=0)) in cache.entries
+
+
+def test_does_not_keep_entries_larger_than_max_nbytes():
+    num_eps = 32
+    eps = [str(ep) for ep in range(num_eps)]
+    cache = PairStructureCache(max_nbytes=get_entry_nbytes(num_eps) - 1)
+
+    entry = cache.get(eps, gen_node_dist(num_eps))
+    assert len(entry['pairs']) == num_eps * (num_eps - 1)
+    assert len(cache.entries) == 0 and cache.nbytes == 0
+    cache.get(eps, gen_node_dist(num_eps))
+    assert cache.misses == 2 and cache.hits == 0
+
+
+def test_clear_resets_nbytes():
+    num_eps = 16
+    cache = PairStructureCache()
+    cache.get([str(ep) for ep in range(num_eps)], gen_node_dist(num_eps))
+    assert cache.nbytes > 0
+    cache.clear()
+    assert len(cache.entries) == 0 and cache.nbytes == 0
@@ -0,0 +1,260 @@
+'''
+Offline packer benchmarking utilities. Packer inputs (node distribution,
+flow sizes and interarrival times) are generated directly with NumPy from a
+seed rather than with the trafpy BenchmarkImporter and network generators, so
+benchmarks need no network access, configs or plotting and are reproducible
+across commits.
+'''
+import numpy as np
+import importlib
+import itertools
+import contextlib
+import subprocess
+import platform
+import json
+import time
+import gc
+import os
+import sys
+
+
+# packers which can be referred to by name rather than by import path
+PACKER_CLS_PATHS = {'vectorised': 'trafpy_vectorised_packer.vectorised_flow_packer.VectorisedFlowPacker',
+                    'base': 'trafpy.generator.src.packers.flow_packer.FlowPacker'}
+
+# named flow size dists in the same form as the flow_size_dist config (see scripts/configs/)
+FLOW_SIZE_DISTS = {'weibull_lambda_2100': {'dist': 'weibull', 'params': {'_alpha': 4.7, '_lambda': 2100}, 'round_to_nearest': 1},
+                   'weibull_lambda_3100': {'dist': 'weibull', 'params': {'_alpha': 4.7, '_lambda': 3100}, 'round_to_nearest': 1},
+                   'weibull_lambda_4100': {'dist': 'weibull', 'params': {'_alpha': 4.7, '_lambda': 4100}, 'round_to_nearest': 1},
+                   'pareto': {'dist': 'pareto', 'params': {'_alpha': 1.5, '_mode': 1000}, 'round_to_nearest': 1},
+                   'lognormal': {'dist': 'lognormal', 'params': {'_mu': 7, '_sigma': 1.5}, 'round_to_nearest': 1}}
+
+
+def get_packer_cls(packer):
+    '''
+    Returns the packer class of a name in PACKER_CLS_PATHS or of an import
+    path (e.g. trafpy.generator.src.packers.flow_packer_v1.FlowPackerV1).
+    '''
+    packer_cls_path = PACKER_CLS_PATHS.get(packer, packer)
+    module_path, cls_name = packer_cls_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_path), cls_name)
+
+
+def gen_node_dist(num_eps, rng, skew_sigma=1):
+    '''
+    Returns a num_eps x num_eps node distribution matrix (zero diagonal,
+    summing to 1) of lognormally distributed src-dst pair probs, so that
+    larger skew_sigma gives more skewed 'hot' pairs. skew_sigma=0 gives a
+    uniform node distribution.
+    '''
+    node_dist = rng.lognormal(mean=0, sigma=skew_sigma, size=(num_eps, num_eps))
+    np.fill_diagonal(node_dist, 0)
+    return node_dist / np.sum(node_dist)
+
+
+def gen_flow_sizes(flow_size_dist, num_flows, rng):
+    '''
+    Samples num_flows flow sizes from a flow size dist, given as the name of
+    one of FLOW_SIZE_DISTS or as a dict of the same form. Supports weibull
+    (_alpha, _lambda), pareto (_alpha, _mode) and lognormal (_mu, _sigma)
+    dists. Sizes are rounded to round_to_nearest and are at least
+    round_to_nearest.
+    '''
+    if isinstance(flow_size_dist, str):
+        flow_size_dist = FLOW_SIZE_DISTS[flow_size_dist]
+    dist, params = flow_size_dist['dist'], flow_size_dist['params']
+    if dist == 'weibull':
+        flow_sizes = params['_lambda'] * rng.weibull(params['_alpha'], size=num_flows)
+    elif dist == 'pareto':
+        flow_sizes = params['_mode'] * (1 + rng.pareto(params['_alpha'], size=num_flows))
+    elif dist == 'lognormal':
+        flow_sizes = rng.lognormal(mean=params['_mu'], sigma=params['_sigma'], size=num_flows)
+    else:
+        raise Exception(f'Unrecognised flow size dist {dist}, must be one of weibull, pareto, lognormal')
+    round_to_nearest = flow_size_dist.get('round_to_nearest', 1)
+    return np.maximum(np.round(flow_sizes / round_to_nearest) * round_to_nearest, round_to_nearest)
+
+
+def gen_packer_inputs(num_eps,
+                      num_flows,
+                      flow_size_dist='weibull_lambda_4100',
+                      load=0.5,
+                      seed=0,
+                      ep_link_capacity=12500,
+                      node_dist_skew_sigma=1):
+    '''
+    Returns a dict of the eps, node_dist, flow_ids, flow_sizes,
+    flow_interarrival_times and network_load_config args of a flow packer.
+
+    Interarrival times are exponentially distributed with a mean chosen so
+    that the flows' total info over their duration is load times the
+    network rate capacity (num_eps * ep_link_capacity / 2, since each flow
+    uses a src and a dst end point port).
+    '''
+    rng = np.random.default_rng(seed)
+    flow_sizes = gen_flow_sizes(flow_size_dist, num_flows, rng)
+    network_rate_capacity = num_eps * ep_link_capacity / 2
+    mean_interarrival_time = np.mean(flow_sizes) / (load * network_rate_capacity)
+    return {'eps': [str(ep) for ep in range(num_eps)],
+            'node_dist': gen_node_dist(num_eps, rng, skew_sigma=node_dist_skew_sigma),
+            'flow_ids': np.array([str(flow_idx) for flow_idx in range(num_flows)]),
+            'flow_sizes': flow_sizes,
+            'flow_interarrival_times': rng.exponential(mean_interarrival_time, size=num_flows),
+            'network_load_config': {'network_rate_capacity': network_rate_capacity,
+                                    'ep_link_capacity': ep_link_capacity,
+                                    'target_load_fraction': load}}
+
+
+def run_packer(packer_cls, inputs, check_dont_exceed_one_ep_load=True, quiet=True, **packer_kwargs):
+    '''
+    Constructs a packer of packer_cls from inputs (as returned by
+    gen_packer_inputs()) and packs the flows. Flow sizes are copied since
+    packers may sort them in place.
+
+    Returns the packer, the construction time and the packing time.
+    '''
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        start_t = time.perf_counter()
+        packer = packer_cls(None,
+                            inputs['eps'],
+                            inputs['node_dist'],
+                            inputs['flow_ids'],
+                            inputs['flow_sizes'].copy(),
+                            inputs['flow_interarrival_times'],
+                            inputs['network_load_config'],
+                            check_dont_exceed_one_ep_load=check_dont_exceed_one_ep_load,
+                            **packer_kwargs)
+        init_time = time.perf_counter() - start_t
+        start_t = time.perf_counter()
+        packer.pack_the_flows()
+        pack_time = time.perf_counter() - start_t
+    return packer, init_time, pack_time
+
+
+def benchmark_packer(packer_cls, inputs, num_repeats=3, num_warmup=1, check_dont_exceed_one_ep_load=True, quiet=True, **packer_kwargs):
+    '''
+    Runs the packer num_warmup times (e.g. to load numba kernels and pair
+    caches, and warm up the allocator) and then num_repeats timed times,
+    with a fresh packer each time.
+
+    Returns a dict of the construction and packing times of each timed repeat,
+    the min and median packing time, the flows packed per second (of the min
+    packing time) and the Jensen Shannon distance achieved by the last repeat.
+    '''
+    for _ in range(num_warmup):
+        run_packer(packer_cls, inputs, check_dont_exceed_one_ep_load=check_dont_exceed_one_ep_load, quiet=quiet, **packer_kwargs)
+    init_times, pack_times = [], []
+    for _ in range(num_repeats):
+        gc.collect()
+        packer, init_time, pack_time = run_packer(packer_cls, inputs, check_dont_exceed_one_ep_load=check_dont_exceed_one_ep_load, quiet=quiet, **packer_kwargs)
+        init_times.append(init_time)
+        pack_times.append(pack_time)
+    return {'init_times': init_times,
+            'pack_times': pack_times,
+            'pack_time_min': min(pack_times),
+            'pack_time_median': float(np.median(pack_times)),
+            'flows_per_second': len(inputs['flow_ids']) / min(pack_times) if min(pack_times) > 0 else None,
+            'jensen_shannon_distance': float(getattr(packer, 'packing_jensen_shannon_distance', np.nan))}
+
+
+def benchmark_packer_replicates(packer_cls, replicate_inputs, num_repeats=3, num_warmup=1, check_dont_exceed_one_ep_load=True, quiet=True, **packer_kwargs):
+    '''
+    Times packing K replicate sets of flows (replicate_inputs, as returned by
+    gen_packer_inputs() with K seeds for the same num_eps, so with the same
+    number of end points but their own node dist) both with K separate
+    packers and with a single packer's pack_the_flow_replicates(). The
+    replicates are packed towards the node dist of the first replicate in
+    both cases.
+
+    Returns a dict of the min packing time of the K separate packers (summed
+    over the packers) and of pack_the_flow_replicates(), their ratio
+    (separate / replicates, so > 1 means packing the replicates together is
+    faster) and the mean Jensen Shannon distance achieved by each.
+    '''
+    replicate_inputs = [{**inputs, 'node_dist': replicate_inputs[0]['node_dist']} for inputs in replicate_inputs]
+    separate_pack_times, replicates_pack_times = [], []
+    for repeat_idx in range(num_warmup + num_repeats):
+        gc.collect()
+        separate_pack_time, separate_jensen_shannon_distances = 0, []
+        for inputs in replicate_inputs:
+            packer, _, pack_time = run_packer(packer_cls, inputs, check_dont_exceed_one_ep_load=check_dont_exceed_one_ep_load, quiet=quiet, **packer_kwargs)
+            separate_pack_time += pack_time
+            separate_jensen_shannon_distances.append(packer.packing_jensen_shannon_distance)
+
+        gc.collect()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            inputs = replicate_inputs[0]
+            packer = packer_cls(None,
+                                inputs['eps'],
+                                inputs['node_dist'],
+                                inputs['flow_ids'],
+                                inputs['flow_sizes'].copy(),
+                                inputs['flow_interarrival_times'],
+                                inputs['network_load_config'],
+                                check_dont_exceed_one_ep_load=check_dont_exceed_one_ep_load,
+                                **packer_kwargs)
+            start_t = time.perf_counter()
+            packer.pack_the_flow_replicates([inputs['flow_sizes'] for inputs in replicate_inputs],
+                                            replicate_flow_ids=[inputs['flow_ids'] for inputs in replicate_inputs],
+                                            replicate_flow_interarrival_times=[inputs['flow_interarrival_times'] for inputs in replicate_inputs])
+            replicates_pack_time = time.perf_counter() - start_t
+
+        if repeat_idx >= num_warmup:
+            separate_pack_times.append(separate_pack_time)
+            replicates_pack_times.append(replicates_pack_time)
+    return {'separate_pack_times': separate_pack_times,
+            'replicates_pack_times': replicates_pack_times,
+            'separate_pack_time_min': min(separate_pack_times),
+            'replicates_pack_time_min': min(replicates_pack_times),
+            'speedup': min(separate_pack_times) / min(replicates_pack_times) if min(replicates_pack_times) > 0 else None,
+            'separate_jensen_shannon_distance': float(np.mean(separate_jensen_shannon_distances)),
+            'replicates_jensen_shannon_distance': float(np.mean(packer.replicate_packing_jensen_shannon_distances))}
+
+
+def get_benchmark_cases(**grid):
+    '''
+    Returns a list of dicts of every combination of the values of each grid
+    arg, e.g. get_benchmark_cases(num_eps=[8, 16], load=[0.5]).
+    '''
+    return [dict(zip(grid.keys(), vals)) for vals in itertools.product(*grid.values())]
+
+
+def get_case_key(case):
+    return json.dumps(case, sort_keys=True)
+
+
+def get_environment_info():
+    '''
+    Returns a dict of the git commit, Python and NumPy versions and machine
+    which a benchmark was run on, so that results from different commits can
+    be compared.
+    '''
+    try:
+        git_commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        git_commit = None
+    return {'git_commit': git_commit,
+            'python_version': platform.python_version(),
+            'numpy_version': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def compare_benchmark_results(results, baseline_results, metric='pack_time_min'):
+    '''
+    Matches the cases of two lists of benchmark results (as saved by
+    scripts/benchmark_packer.py) and returns a list of (case, baseline,
+    current, ratio) of metric for each case in both, where ratio > 1 means
+    metric has increased since the baseline.
+    '''
+    baseline_case_to_result = {get_case_key(result['case']): result for result in baseline_results}
+    comparison = []
+    for result in results:
+        baseline_result = baseline_case_to_result.get(get_case_key(result['case']))
+        if baseline_result is None or result.get(metric) is None or baseline_result.get(metric) is None:
+            continue
+        ratio = result[metric] / baseline_result[metric] if baseline_result[metric] > 0 else np.inf
+        comparison.append((result['case'], baseline_result[metric], result[metric], ratio))
+    return comparison
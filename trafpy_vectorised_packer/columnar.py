@@ -0,0 +1,267 @@
+'''
+Columnar on-disk format for packed demand data, as an alternative to saving
+the whole flow-centric demand dict with scipy.io.savemat().
+
+A dataset is a directory holding one .npy file per column per chunk, plus a
+manifest.json recording the columns and the number of rows of each chunk:
+
+    <path>/manifest.json
+    <path>/flow_id.000000.npy
+    <path>/size.000000.npy
+    ...
+
+Chunks are written one at a time as flows are produced (so the full dataset
+never needs to be held in memory to be saved), and are read back with
+memory-mapped loads, so that reading a subset of columns and/or a range of
+rows only touches the files (and pages) which hold them:
+
+    with ColumnarDemandWriter(save_dir) as writer:
+        for packed_flows in packer.iter_pack(chunk_size=100000):
+            writer.write_packed_flows(packed_flows)
+
+    reader = ColumnarDemandReader(save_dir)
+    sizes = reader.read(columns=['size'], start=1000, stop=2000)['size']
+
+Only writers fed a chunk at a time (e.g. from iter_pack() as above) bound
+the memory used to save a dataset. write_demand_data(), which pulse_gen.py
+uses since tpg.create_demand_data() only returns once all flows have been
+generated, writes an already complete demand dict in chunks, so it only
+changes the on-disk format (and what needs to be read back), not the peak
+memory of generating the dataset.
+
+Strings (e.g. flow ids and end point labels) are stored as fixed-width
+unicode arrays, since object arrays cannot be memory-mapped.
+'''
+import numpy as np
+import json
+import os
+import shutil
+
+
+# flow-centric demand data keys (as returned by tpg.create_demand_data()) -> column names
+DEMAND_DATA_COLUMNS = {'flow_id': 'flow_id',
+                       'flow_size': 'size',
+                       'sn': 'src',
+                       'dn': 'dst',
+                       'event_time': 'event_time'}
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _to_column_array(values):
+    values = np.asarray(values)
+    if values.dtype == object:
+        # object arrays cannot be memory-mapped
+        values = values.astype(str)
+    return values
+
+
+def _write_json_atomic(obj, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class ColumnarDemandWriter:
+    def __init__(self,
+                 path,
+                 overwrite=False,
+                 metadata=None):
+        '''
+        Writes demand data to a columnar dataset directory chunk by chunk.
+
+        The manifest is rewritten (atomically) after each chunk, so a dataset
+        whose writer was interrupted can still be read up to its last
+        complete chunk. complete is only set in the manifest once the writer
+        is closed.
+
+        Args:
+            path (str): Dataset directory to write to.
+            overwrite (bool): If True, removes any existing dataset at path,
+                otherwise raises if path already exists.
+            metadata (dict): JSON-serialisable metadata (e.g. the generation
+                config) to record in the manifest.
+        '''
+        if os.path.exists(path):
+            if not overwrite:
+                raise Exception(f'Columnar dataset {path} already exists, set overwrite=True to overwrite it')
+            shutil.rmtree(path)
+        os.makedirs(path)
+        self.path = path
+        self.manifest = {'columns': None,
+                         'chunk_num_rows': [],
+                         'num_rows': 0,
+                         'metadata': metadata if metadata is not None else {},
+                         'complete': False}
+        self._write_manifest()
+
+    def _write_manifest(self):
+        _write_json_atomic(self.manifest, os.path.join(self.path, MANIFEST_NAME))
+
+    def write_chunk(self, columns):
+        '''
+        Writes a chunk of rows.
+
+        Args:
+            columns (dict): Mapping of column name -> array-like of the
+                chunk's values. Every chunk must have the same columns, and
+                every column of a chunk the same number of rows.
+        '''
+        if self.manifest['complete']:
+            raise Exception(f'Cannot write to closed columnar dataset {self.path}')
+        columns = {name: _to_column_array(values) for name, values in columns.items()}
+        num_rows = {name: len(values) for name, values in columns.items()}
+        if len(set(num_rows.values())) > 1:
+            raise Exception(f'Columns of a chunk must have the same number of rows but have {num_rows}')
+        if self.manifest['columns'] is None:
+            self.manifest['columns'] = list(columns.keys())
+        elif set(columns.keys()) != set(self.manifest['columns']):
+            raise Exception(f'Chunk columns {list(columns.keys())} do not match dataset columns {self.manifest["columns"]}')
+
+        chunk_idx = len(self.manifest['chunk_num_rows'])
+        for name, values in columns.items():
+            np.save(os.path.join(self.path, f'{name}.{chunk_idx:06d}.npy'), values, allow_pickle=False)
+        chunk_num_rows = next(iter(num_rows.values()), 0)
+        self.manifest['chunk_num_rows'].append(chunk_num_rows)
+        self.manifest['num_rows'] += chunk_num_rows
+        self._write_manifest()
+
+    def write_packed_flows(self, packed_flows, event_times=None):
+        '''
+        Writes a PackedFlows (e.g. a chunk yielded by
+        VectorisedFlowPacker.iter_pack()) as a chunk of flow_id, size, src and
+        dst (and event_time if given) columns.
+        '''
+        columns = {'flow_id': packed_flows.flow_ids,
+                   'size': packed_flows.sizes,
+                   'src': packed_flows.srcs,
+                   'dst': packed_flows.dsts}
+        if event_times is not None:
+            columns['event_time'] = event_times
+        self.write_chunk(columns)
+
+    def close(self):
+        self.manifest['complete'] = True
+        self._write_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # leave the dataset marked incomplete if writing raised
+        if exc_type is None:
+            self.close()
+
+
+def write_demand_data(path, demand_data, chunk_size=1000000, overwrite=False, metadata=None):
+    '''
+    Writes flow-centric demand data (as returned by tpg.create_demand_data())
+    to a columnar dataset in chunks of chunk_size flows. Keys in
+    DEMAND_DATA_COLUMNS are renamed to their column names; any other per-flow
+    keys (e.g. establish, index) are kept under their own names.
+    '''
+    num_flows = len(demand_data['flow_id'])
+    columns = {DEMAND_DATA_COLUMNS.get(key, key): values for key, values in demand_data.items() if np.ndim(values) > 0 and len(values) == num_flows}
+    with ColumnarDemandWriter(path, overwrite=overwrite, metadata=metadata) as writer:
+        for chunk_start in range(0, max(num_flows, 1), chunk_size):
+            writer.write_chunk({name: values[chunk_start:chunk_start+chunk_size] for name, values in columns.items()})
+
+
+class ColumnarDemandReader:
+    def __init__(self,
+                 path,
+                 allow_incomplete=False):
+        '''
+        Reads a columnar dataset written by ColumnarDemandWriter, with each
+        chunk file memory-mapped so that only the requested columns and rows
+        are read from disk.
+
+        Args:
+            path (str): Dataset directory.
+            allow_incomplete (bool): If True, reads datasets whose writer was
+                not closed (e.g. was interrupted) up to their last complete
+                chunk, otherwise raises.
+        '''
+        with open(os.path.join(path, MANIFEST_NAME), 'r') as f:
+            self.manifest = json.load(f)
+        if not self.manifest['complete'] and not allow_incomplete:
+            raise Exception(f'Columnar dataset {path} is incomplete (its writer was not closed), set allow_incomplete=True to read its complete chunks')
+        self.path = path
+        self.columns = self.manifest['columns'] if self.manifest['columns'] is not None else []
+        self.metadata = self.manifest['metadata']
+        self.chunk_num_rows = np.asarray(self.manifest['chunk_num_rows'], dtype=np.int64)
+        # row idx at which each chunk starts
+        self.chunk_starts = np.concatenate([[0], np.cumsum(self.chunk_num_rows)])
+
+    def __len__(self):
+        return int(self.chunk_starts[-1])
+
+    @property
+    def num_chunks(self):
+        return len(self.chunk_num_rows)
+
+    def _check_columns(self, columns):
+        if columns is None:
+            return self.columns
+        unknown_columns = [name for name in columns if name not in self.columns]
+        if len(unknown_columns) > 0:
+            raise Exception(f'Unknown columns {unknown_columns}, dataset has columns {self.columns}')
+        return columns
+
+    def load_chunk(self, chunk_idx, column):
+        '''
+        Returns a read-only memory-mapped array of a column of a chunk.
+        '''
+        return np.load(os.path.join(self.path, f'{column}.{chunk_idx:06d}.npy'), mmap_mode='r', allow_pickle=False)
+
+    def iter_chunks(self, columns=None):
+        '''
+        Yields a dict of column -> memory-mapped array per chunk.
+        '''
+        columns = self._check_columns(columns)
+        for chunk_idx in range(self.num_chunks):
+            yield {name: self.load_chunk(chunk_idx, name) for name in columns}
+
+    def read(self, columns=None, start=0, stop=None):
+        '''
+        Returns a dict of column -> array of rows [start, stop) of the given
+        columns (all columns if None). Only the chunks overlapping the range
+        are read. If the range lies within one chunk, the arrays are
+        memory-mapped views rather than in-memory copies.
+        '''
+        columns = self._check_columns(columns)
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        first_chunk_idx = int(np.searchsorted(self.chunk_starts, start, side='right')) - 1
+        last_chunk_idx = int(np.searchsorted(self.chunk_starts, stop, side='left')) - 1
+        chunk_idxs = range(first_chunk_idx, max(last_chunk_idx, first_chunk_idx) + 1) if stop > start else []
+
+        data = {}
+        for name in columns:
+            slices = [self.load_chunk(chunk_idx, name)[max(start - self.chunk_starts[chunk_idx], 0):stop - self.chunk_starts[chunk_idx]] for chunk_idx in chunk_idxs]
+            if len(slices) == 1:
+                data[name] = slices[0]
+            elif len(slices) > 1:
+                data[name] = np.concatenate(slices)
+            else:
+                data[name] = self.load_chunk(0, name)[:0] if self.num_chunks > 0 else np.empty(0)
+        return data
+
+    def to_demand_data(self, columns=None, start=0, stop=None):
+        '''
+        Returns rows [start, stop) as flow-centric demand data, i.e. keyed by
+        the tpg.create_demand_data() keys rather than the column names.
+        '''
+        column_to_key = {name: key for key, name in DEMAND_DATA_COLUMNS.items()}
+        return {column_to_key.get(name, name): values for name, values in self.read(columns=columns, start=start, stop=stop).items()}
+
+
+def convert_to_mat(path, mat_path, columns=None):
+    '''
+    Exports a columnar dataset to a .mat file of flow-centric demand data (as
+    previously saved by scipy.io.savemat(save_dir+'.mat', flow_centric_demand_data)).
+    N.B. This loads the exported columns into memory.
+    '''
+    from scipy.io import savemat
+    savemat(mat_path, ColumnarDemandReader(path).to_demand_data(columns=columns))
@@ -0,0 +1,198 @@
+'''
+Packing kernels which run the whole choose/check/pack loop of
+VectorisedFlowPacker over flat arrays. The numba compiled kernel removes the
+per-flow Python and NumPy call overhead. The NumPy kernel is used where a
+flat-array packing function is needed without numba (e.g. when packing
+shards in worker processes).
+
+numba is an optional dependency. Kernels are compiled with cache=True, so the
+first process to compile a kernel writes it to numba's on-disk cache (in
+__pycache__ next to this file, or in NUMBA_CACHE_DIR if set) and later
+processes (e.g. sweep workers) load it from there rather than recompiling.
+Call warmup_numba_pack_flows_kernel() once per process to pay the compile/load
+cost up front.
+'''
+import numpy as np
+import time
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def is_numba_available():
+    return numba is not None
+
+
+def _pack_flows_kernel(flow_sizes,
+                       pair_src_idxs,
+                       pair_dst_idxs,
+                       pair_target_total_info,
+                       pair_current_total_info,
+                       pair_current_distance_from_target_info,
+                       src_total_infos,
+                       dst_total_infos,
+                       ep_total_infos,
+                       src_max_infos,
+                       dst_max_infos,
+                       check_dont_exceed_one_ep_load,
+                       seed):
+    '''
+    Packs each flow (in order) into the pair with the max adjusted distance
+    from its target total info, breaking ties uniformly at random. Updates
+    the pair and end point info arrays in place.
+
+    Returns the idx of the pair each flow was packed into, which is -1 for
+    any flow which cannot be packed into any pair without exceeding the
+    src_max_infos and/or dst_max_infos of the pair's end points.
+    '''
+    np.random.seed(seed)
+    num_flows, num_pairs = len(flow_sizes), len(pair_src_idxs)
+    flow_pair_idxs = np.full(num_flows, -1, dtype=np.int64)
+    for flow_idx in range(num_flows):
+        flow_size = flow_sizes[flow_idx]
+
+        # find the candidate pair furthest from its target, choosing between ties by reservoir sampling
+        chosen_pair_idx, max_key, num_max_keys = -1, -np.inf, 0
+        for pair_idx in range(num_pairs):
+            if check_dont_exceed_one_ep_load:
+                # pair remaining capacity is the min remaining info capacity of its src-dst
+                src, dst = pair_src_idxs[pair_idx], pair_dst_idxs[pair_idx]
+                pair_remaining_capacity = min(src_max_infos[src] - src_total_infos[src], dst_max_infos[dst] - dst_total_infos[dst])
+                if pair_remaining_capacity - flow_size < 0:
+                    continue
+            key = pair_current_distance_from_target_info[pair_idx] + pair_target_total_info[pair_idx]
+            if num_max_keys == 0 or key > max_key:
+                chosen_pair_idx, max_key, num_max_keys = pair_idx, key, 1
+            elif key == max_key:
+                num_max_keys += 1
+                if np.random.randint(0, num_max_keys) == 0:
+                    chosen_pair_idx = pair_idx
+        if chosen_pair_idx == -1:
+            continue
+
+        # pack flow into the chosen pair
+        pair_current_total_info[chosen_pair_idx] += flow_size
+        pair_current_distance_from_target_info[chosen_pair_idx] -= flow_size
+        chosen_src, chosen_dst = pair_src_idxs[chosen_pair_idx], pair_dst_idxs[chosen_pair_idx]
+        ep_total_infos[chosen_src] += flow_size
+        ep_total_infos[chosen_dst] += flow_size
+        src_total_infos[chosen_src] += flow_size
+        dst_total_infos[chosen_dst] += flow_size
+        flow_pair_idxs[flow_idx] = chosen_pair_idx
+
+    return flow_pair_idxs
+
+
+def pack_flows_numpy(flow_sizes,
+                     pair_src_idxs,
+                     pair_dst_idxs,
+                     pair_target_total_info,
+                     pair_current_total_info,
+                     pair_current_distance_from_target_info,
+                     src_total_infos,
+                     dst_total_infos,
+                     ep_total_infos,
+                     src_max_infos,
+                     dst_max_infos,
+                     check_dont_exceed_one_ep_load,
+                     seed):
+    '''
+    NumPy equivalent of the numba packing kernel, which scans the pairs with
+    vectorised NumPy calls for each flow.
+    '''
+    rng = np.random.default_rng(seed)
+    pair_idxs = np.arange(len(pair_src_idxs))
+    flow_pair_idxs = np.full(len(flow_sizes), -1, dtype=np.int64)
+    for flow_idx, flow_size in enumerate(flow_sizes):
+        adjusted_pair_distances = pair_current_distance_from_target_info + pair_target_total_info
+        if check_dont_exceed_one_ep_load:
+            pair_remaining_capacity = np.minimum(src_max_infos[pair_src_idxs] - src_total_infos[pair_src_idxs], dst_max_infos[pair_dst_idxs] - dst_total_infos[pair_dst_idxs])
+            candidate_pair_idxs = np.flatnonzero(pair_remaining_capacity - flow_size >= 0)
+            if len(candidate_pair_idxs) == 0:
+                continue
+            adjusted_pair_distances = adjusted_pair_distances[candidate_pair_idxs]
+        else:
+            candidate_pair_idxs = pair_idxs
+        max_indices = np.flatnonzero(adjusted_pair_distances == np.amax(adjusted_pair_distances))
+        chosen_pair_idx = candidate_pair_idxs[rng.choice(max_indices)]
+
+        # pack flow into the chosen pair
+        pair_current_total_info[chosen_pair_idx] += flow_size
+        pair_current_distance_from_target_info[chosen_pair_idx] -= flow_size
+        chosen_src, chosen_dst = pair_src_idxs[chosen_pair_idx], pair_dst_idxs[chosen_pair_idx]
+        ep_total_infos[chosen_src] += flow_size
+        ep_total_infos[chosen_dst] += flow_size
+        src_total_infos[chosen_src] += flow_size
+        dst_total_infos[chosen_dst] += flow_size
+        flow_pair_idxs[flow_idx] = chosen_pair_idx
+
+    return flow_pair_idxs
+
+
+_numba_pack_flows_kernel = None
+
+
+def get_numba_pack_flows_kernel():
+    '''
+    Returns the numba compiled packing kernel, creating its dispatcher once
+    per process. Compilation (or loading from numba's on-disk cache) happens
+    the first time the kernel is called.
+    '''
+    global _numba_pack_flows_kernel
+    if numba is None:
+        raise Exception('numba is not installed, cannot use numba packing kernel')
+    if _numba_pack_flows_kernel is None:
+        _numba_pack_flows_kernel = numba.njit(cache=True)(_pack_flows_kernel)
+    return _numba_pack_flows_kernel
+
+
+def warmup_numba_pack_flows_kernel():
+    '''
+    Compiles the numba packing kernel for the array types used by
+    VectorisedFlowPacker (or loads it from numba's on-disk cache) by running
+    it on a tiny problem. Returns the time taken in seconds, which is ~0 if
+    the kernel has already been compiled or loaded in this process.
+    '''
+    kernel = get_numba_pack_flows_kernel()
+    start_t = time.time()
+    kernel(np.ones(1, dtype=np.float64),
+           np.zeros(1, dtype=np.int64),
+           np.ones(1, dtype=np.int64),
+           np.ones(1, dtype=np.float64),
+           np.zeros(1, dtype=np.float64),
+           np.ones(1, dtype=np.float64),
+           np.zeros(2, dtype=np.float64),
+           np.zeros(2, dtype=np.float64),
+           np.zeros(2, dtype=np.float64),
+           np.ones(2, dtype=np.float64),
+           np.ones(2, dtype=np.float64),
+           True,
+           0)
+    return time.time() - start_t
+
+
+def get_pack_flows_kernel(backend):
+    '''
+    Returns the packing kernel for backend 'numpy' or 'numba'.
+    '''
+    if backend == 'numba':
+        return get_numba_pack_flows_kernel()
+    elif backend == 'numpy':
+        return pack_flows_numpy
+    else:
+        raise Exception(f'Unrecognised backend {backend}, must be one of numpy, numba')
+
+
+def get_numba_pack_flows_kernel_cache_info():
+    '''
+    Returns a dict with the numba packing kernel's cache dir, the number of
+    times it was loaded from numba's on-disk cache in this process
+    (cache_hits), and the number of times it had to be compiled (cache_misses).
+    '''
+    kernel = get_numba_pack_flows_kernel()
+    stats = kernel.stats
+    return {'cache_path': stats.cache_path,
+            'cache_hits': sum(stats.cache_hits.values()),
+            'cache_misses': sum(stats.cache_misses.values())}
@@ -0,0 +1,105 @@
+'''
+Chunked (out of core) operations on flow arrays which may be larger than
+memory, e.g. np.memmap-backed flow sizes and interarrival times of long
+traces. Each operation only holds chunk_size elements in memory at a time,
+so the memory it uses does not depend on the length of the arrays.
+'''
+import numpy as np
+import tempfile
+import shutil
+import os
+
+
+def is_sorted_descending(values, chunk_size=2**22):
+    '''
+    Returns True if values are in descending order, checking chunk by chunk
+    (with each chunk overlapping the next by one element) rather than
+    comparing all elements at once.
+    '''
+    for chunk_start in range(0, max(len(values) - 1, 0), chunk_size):
+        chunk = values[chunk_start:chunk_start+chunk_size+1]
+        if not np.all(chunk[:-1] >= chunk[1:]):
+            return False
+    return True
+
+
+def get_event_time_span(interarrival_times, chunk_size=2**22):
+    '''
+    Returns max(event_times) - min(event_times) of the event times generated
+    from interarrival times (where the first event is at time 0 and each
+    following event arrives its predecessor's interarrival time later), as a
+    streaming reduction over chunks of the interarrival times rather than
+    by generating the event times.
+    '''
+    # the last interarrival time does not generate an event
+    num_events = len(interarrival_times)
+    if num_events == 0:
+        return 0
+    offset, max_event_time, min_event_time = 0., 0., 0.
+    for chunk_start in range(0, num_events - 1, chunk_size):
+        event_times = offset + np.cumsum(interarrival_times[chunk_start:min(chunk_start+chunk_size, num_events-1)], dtype=np.float64)
+        max_event_time, min_event_time = max(max_event_time, np.amax(event_times)), min(min_event_time, np.amin(event_times))
+        offset = event_times[-1]
+    return max_event_time - min_event_time
+
+
+def external_sort_descending(values, out_path, chunk_size=2**22, tmp_dir=None):
+    '''
+    Sorts values into descending order with an external merge sort and
+    returns the sorted values as an np.memmap backed by a .npy file at
+    out_path.
+
+    Each chunk of chunk_size values is sorted in memory and written to disk
+    as a sorted run. The runs are then merged a block at a time: each run
+    buffers its next chunk_size / num_runs values, and all buffered values >=
+    the largest of the smallest buffered value of each (not fully buffered)
+    run can be output, since no unbuffered value is greater than it. At least
+    one whole buffer is output per block, so the merge is O(num_values *
+    log(chunk_size)) with only ~chunk_size values in memory at a time.
+
+    Args:
+        values (numpy.ndarray): Values (e.g. an np.memmap) to sort. Not modified.
+        out_path (str): Path of .npy file to write sorted values to.
+        chunk_size (int): Number of values to hold in memory at a time.
+        tmp_dir (str): Directory in which to write the sorted runs (deleted
+            once merged). If None, uses the directory of out_path.
+    '''
+    num_values = len(values)
+    sorted_values = np.lib.format.open_memmap(out_path, mode='w+', dtype=values.dtype, shape=(num_values,))
+    if num_values <= chunk_size:
+        sorted_values[:] = np.sort(values)[::-1]
+        sorted_values.flush()
+        return sorted_values
+
+    # sort each chunk into a run on disk
+    runs_dir = tempfile.mkdtemp(prefix='sort_runs_', dir=tmp_dir if tmp_dir is not None else os.path.dirname(os.path.abspath(out_path)))
+    runs = []
+    try:
+        for chunk_start in range(0, num_values, chunk_size):
+            run_path = os.path.join(runs_dir, f'run_{len(runs)}.npy')
+            np.save(run_path, np.sort(values[chunk_start:chunk_start+chunk_size])[::-1])
+            runs.append(np.load(run_path, mmap_mode='r'))
+
+        # merge runs a block at a time
+        buffer_size = max(chunk_size // len(runs), 1)
+        run_positions = np.zeros(len(runs), dtype=np.int64)
+        out_position = 0
+        while out_position < num_values:
+            buffers = [run[run_position:run_position+buffer_size] for run, run_position in zip(runs, run_positions)]
+            partially_buffered = [len(buffer) > 0 and run_position + len(buffer) < len(run) for run, run_position, buffer in zip(runs, run_positions, buffers)]
+            if any(partially_buffered):
+                threshold = max(buffer[-1] for buffer, is_partial in zip(buffers, partially_buffered) if is_partial)
+                # number of values >= threshold at the start of each (descending) buffer
+                num_taken = [int(np.searchsorted(-buffer, -threshold, side='right')) for buffer in buffers]
+            else:
+                num_taken = [len(buffer) for buffer in buffers]
+            block = np.sort(np.concatenate([buffer[:num] for buffer, num in zip(buffers, num_taken)]))[::-1]
+            sorted_values[out_position:out_position+len(block)] = block
+            out_position += len(block)
+            run_positions += num_taken
+        sorted_values.flush()
+    finally:
+        del runs
+        shutil.rmtree(runs_dir, ignore_errors=True)
+
+    return sorted_values
@@ -0,0 +1,156 @@
+import numpy as np
+import tempfile
+import os
+from collections.abc import Mapping, ItemsView, ValuesView
+
+
+class PackedFlows(Mapping):
+    def __init__(self,
+                 flow_ids,
+                 sizes,
+                 src_idxs,
+                 dst_idxs,
+                 eps):
+        '''
+        Packed flows stored as contiguous arrays (one entry per flow) rather
+        than as a dict of per-flow dicts.
+
+        Also acts as a lazy read-only mapping of flow_id -> {'size': ..., 'src': ...,
+        'dst': ...} for code which expects the packed flows dict returned by
+        FlowPacker.pack_the_flows(). Per-flow dicts are only created when
+        accessed.
+
+        Args:
+            flow_ids (numpy.ndarray): Id of each flow.
+            sizes (numpy.ndarray): Size of each flow.
+            src_idxs (numpy.ndarray): Index (into eps) of each flow's src end point.
+            dst_idxs (numpy.ndarray): Index (into eps) of each flow's dst end point.
+            eps (list): End point labels.
+        '''
+        self.flow_ids = flow_ids
+        self.sizes = sizes
+        self.src_idxs = src_idxs
+        self.dst_idxs = dst_idxs
+        self.eps = np.asarray(eps)
+
+        # mapping of flow id -> flow idx only built if flows are looked up by id
+        self._flow_id_to_idx = None
+
+    @property
+    def srcs(self):
+        return self.eps[self.src_idxs]
+
+    @property
+    def dsts(self):
+        return self.eps[self.dst_idxs]
+
+    def _get_flow(self, idx):
+        return {'size': self.sizes[idx],
+                'src': self.eps[self.src_idxs[idx]].item(),
+                'dst': self.eps[self.dst_idxs[idx]].item()}
+
+    def __getitem__(self, flow_id):
+        if self._flow_id_to_idx is None:
+            self._flow_id_to_idx = {flow_id: idx for idx, flow_id in enumerate(self.flow_ids)}
+        return self._get_flow(self._flow_id_to_idx[flow_id])
+
+    def __iter__(self):
+        return iter(self.flow_ids)
+
+    def __len__(self):
+        return len(self.flow_ids)
+
+    def items(self):
+        return _PackedFlowsItemsView(self)
+
+    def values(self):
+        return _PackedFlowsValuesView(self)
+
+    def permute(self, permutation, out_dir=None, chunk_size=2**22):
+        '''
+        Returns a new PackedFlows with the flows re-ordered by the permutation
+        index array.
+
+        If out_dir is given, the permuted arrays are written chunk_size flows
+        at a time to np.memmap-backed .npy files in a new directory in
+        out_dir rather than held in memory (e.g. for packed flows of traces
+        larger than memory).
+        '''
+        arrays = {'flow_ids': np.asarray(self.flow_ids), 'sizes': self.sizes, 'src_idxs': self.src_idxs, 'dst_idxs': self.dst_idxs}
+        if out_dir is None:
+            permuted_arrays = {name: array[permutation] for name, array in arrays.items()}
+        else:
+            permuted_dir = tempfile.mkdtemp(prefix='permuted_flows_', dir=out_dir)
+            permuted_arrays = {}
+            for name, array in arrays.items():
+                permuted_arrays[name] = np.lib.format.open_memmap(os.path.join(permuted_dir, f'{name}.npy'), mode='w+', dtype=array.dtype, shape=(len(permutation),))
+                for chunk_start in range(0, len(permutation), chunk_size):
+                    np.take(array, permutation[chunk_start:chunk_start+chunk_size], out=permuted_arrays[name][chunk_start:chunk_start+chunk_size])
+                permuted_arrays[name].flush()
+        return PackedFlows(eps=self.eps, **permuted_arrays)
+
+    def to_dict(self):
+        '''
+        Returns the packed flows as a dict of flow_id -> {'size': ..., 'src': ..., 'dst': ...}.
+        '''
+        return dict(self.items())
+
+
+class _PackedFlowsItemsView(ItemsView):
+    def __iter__(self):
+        # iterate over flow idxs directly rather than looking up each flow by id
+        for idx, flow_id in enumerate(self._mapping.flow_ids):
+            yield flow_id, self._mapping._get_flow(idx)
+
+
+class _PackedFlowsValuesView(ValuesView):
+    def __iter__(self):
+        for idx in range(len(self._mapping)):
+            yield self._mapping._get_flow(idx)
+
+
+class PackedSizeClasses:
+    def __init__(self,
+                 sizes,
+                 src_idxs,
+                 dst_idxs,
+                 counts,
+                 eps):
+        '''
+        Flows packed by size class, where each entry records that counts[i]
+        flows of size sizes[i] were packed into the src-dst pair
+        (src_idxs[i], dst_idxs[i]). Entries are ordered by descending size,
+        matching the order in which the packer sorts flows.
+
+        Args:
+            sizes (numpy.ndarray): Flow size of each entry.
+            src_idxs (numpy.ndarray): Index (into eps) of each entry's src end point.
+            dst_idxs (numpy.ndarray): Index (into eps) of each entry's dst end point.
+            counts (numpy.ndarray): Number of flows of each entry.
+            eps (list): End point labels.
+        '''
+        self.sizes = sizes
+        self.src_idxs = src_idxs
+        self.dst_idxs = dst_idxs
+        self.counts = counts
+        self.eps = np.asarray(eps)
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def num_flows(self):
+        return int(np.sum(self.counts))
+
+    def expand(self, flow_ids):
+        '''
+        Expands the size classes into flow-level src-dst assignments, where
+        flow_ids are ordered by descending flow size.
+        '''
+        if len(flow_ids) != self.num_flows:
+            raise Exception(f'Number of flow_ids ({len(flow_ids)}) does not match number of packed flows ({self.num_flows})')
+        return PackedFlows(flow_ids=flow_ids,
+                           sizes=np.repeat(self.sizes, self.counts),
+                           src_idxs=np.repeat(self.src_idxs, self.counts),
+                           dst_idxs=np.repeat(self.dst_idxs, self.counts),
+                           eps=self.eps)
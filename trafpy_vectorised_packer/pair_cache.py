@@ -0,0 +1,140 @@
+'''
+Cache of the src-dst pair structures which VectorisedFlowPacker derives from
+its end points and node distribution (the pair src-dst end point indices and
+the node distribution prob of each pair). These only depend on the end
+points and node distribution, so sweeps which pack the same network and node
+distribution many times (e.g. for every seed and load) only need to derive
+them once. Sparse entries only hold the pairs with nonzero node distribution
+prob, along with CSR adjacency arrays mapping each end point to the pairs it
+is the src or dst of.
+
+Entries are keyed by a hash of the contents of the end points and node
+distribution, and are held in an in-memory LRU cache shared by all packers
+in the same process. Since entries hold O(N^2) arrays (~100 MB of all pairs
+at N=2048), the in-memory cache is bounded by the total nbytes of its
+entries as well as by its number of entries. If a cache_dir is given,
+entries are also saved to (and loaded from) .npz files in cache_dir so that
+they can be reused across processes (and after being evicted from memory).
+Cached arrays are read-only since they are shared.
+'''
+import numpy as np
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+
+class PairStructureCache:
+    def __init__(self,
+                 max_size=16,
+                 max_nbytes=2**28):
+        '''
+        Args:
+            max_size (int): Max number of entries to keep in memory, after
+                which the least recently used entry is evicted.
+            max_nbytes (int): Max total nbytes of the arrays of the entries
+                to keep in memory, after which least recently used entries
+                are evicted. An entry larger than max_nbytes is returned but
+                not kept. If None, entries are only bounded by max_size.
+        '''
+        self.max_size = max_size
+        self.max_nbytes = max_nbytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+
+    def get_key(self, eps, node_dist, sparse=False):
+        node_dist = np.ascontiguousarray(node_dist, dtype=np.float64)
+        key = hashlib.sha256()
+        key.update(b'sparse' if sparse else b'dense')
+        key.update('\0'.join(str(ep) for ep in eps).encode())
+        key.update(str(node_dist.shape).encode())
+        # hash the node dist buffer directly rather than via a bytes copy
+        key.update(memoryview(node_dist).cast('B'))
+        return key.hexdigest()
+
+    def _compute(self, eps, node_dist, sparse=False):
+        node_dist = np.asarray(node_dist, dtype=float)
+        if sparse:
+            # only keep src-dst pairs with nonzero node dist prob (in the same src-major order as all pairs)
+            pair_src_idxs, pair_dst_idxs = np.nonzero((node_dist > 0) & ~np.eye(len(eps), dtype=bool))
+        else:
+            # get each possible src-dst pair as a (num_pairs, 2) array of src-dst end point indices (same as node_dists.get_pair_prob_dict_of_node_dist_matrix(..., all_combinations=True) but without building a json string key per pair) and its node dist prob
+            pair_src_idxs, pair_dst_idxs = np.nonzero(~np.eye(len(eps), dtype=bool))
+        entry = {'eps': np.asarray(eps),
+                 'pairs': np.stack([pair_src_idxs, pair_dst_idxs], axis=1),
+                 'pair_probs': node_dist[pair_src_idxs, pair_dst_idxs]}
+
+        if sparse:
+            # pairs are in src-major order, so the pairs of src end point i are pairs src_to_pair_indptr[i]:src_to_pair_indptr[i+1]. The pairs of dst end point i are dst_to_pair_idxs[dst_to_pair_indptr[i]:dst_to_pair_indptr[i+1]]
+            entry['src_to_pair_indptr'] = np.concatenate([[0], np.cumsum(np.bincount(pair_src_idxs, minlength=len(eps)))])
+            entry['dst_to_pair_indptr'] = np.concatenate([[0], np.cumsum(np.bincount(pair_dst_idxs, minlength=len(eps)))])
+            entry['dst_to_pair_idxs'] = np.argsort(pair_dst_idxs, kind='stable')
+
+        return entry
+
+    def _load(self, path):
+        with np.load(path, allow_pickle=False) as f:
+            return {name: f[name] for name in f.files}
+
+    def _save(self, path, entry):
+        # write to a temporary file and rename so that concurrent processes never read a partially written entry
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.npz.tmp', delete=False) as f:
+            np.savez(f, **entry)
+        os.replace(f.name, path)
+
+    def get(self, eps, node_dist, cache_dir=None, sparse=False):
+        '''
+        Returns a dict of the pair structures of the end points and node dist
+        (eps, pairs and pair_probs, plus src_to_pair_indptr,
+        dst_to_pair_indptr and dst_to_pair_idxs if sparse), computing them if
+        they are not already cached.
+
+        Args:
+            eps (list): End point labels.
+            node_dist (numpy.ndarray): Node distribution matrix.
+            cache_dir (str): If given, also looks for and saves the entry in
+                this dir.
+            sparse (bool): If True, only pairs with nonzero node dist prob
+                are kept.
+        '''
+        key = self.get_key(eps, node_dist, sparse=sparse)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        path = os.path.join(cache_dir, f'pair_structures_{key}.npz') if cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            self.disk_hits += 1
+            entry = self._load(path)
+        else:
+            self.misses += 1
+            entry = self._compute(eps, node_dist, sparse=sparse)
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                self._save(path, entry)
+
+        for arr in entry.values():
+            arr.setflags(write=False)
+        self.entries[key] = entry
+        self.nbytes += self._get_entry_nbytes(entry)
+        while len(self.entries) > self.max_size or (self.max_nbytes is not None and self.nbytes > self.max_nbytes):
+            self.nbytes -= self._get_entry_nbytes(self.entries.popitem(last=False)[1])
+
+        return entry
+
+    def _get_entry_nbytes(self, entry):
+        return sum(arr.nbytes for arr in entry.values())
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+# cache shared by all packers in this process
+pair_structure_cache = PairStructureCache()
+
+
+def get_pair_structures(eps, node_dist, cache_dir=None, sparse=False):
+    return pair_structure_cache.get(eps, node_dist, cache_dir=cache_dir, sparse=sparse)
@@ -0,0 +1,141 @@
+import numpy as np
+import heapq
+
+
+class SegmentTreePairSelector:
+    def __init__(self,
+                 pair_keys,
+                 pair_remaining_capacity=None,
+                 dtype=np.float64,
+                 rng=None):
+        '''
+        Selects the src-dst pair with the highest key (the pair's adjusted
+        distance from its target total info) in O(log P) time using an indexed
+        max segment tree over the P pairs, rather than re-scanning every pair
+        for every flow.
+
+        Each tree node stores the max key in its subtree and the number of
+        leaves which achieve that max, so that ties can be broken uniformly at
+        random by descending the tree once (matching a random choice over the
+        argwhere of the max in the masked scan).
+
+        If pair_remaining_capacity is given, a pair is only a candidate for a
+        flow if its remaining capacity minus the flow size is >= 0. Infeasible
+        pairs are lazily 'parked' (removed from the tree) when they reach the
+        top of the tree, and are only re-inserted once a flow small enough
+        to fit into them arrives. Since remaining capacities only ever
+        decrease, a parked pair's capacity when it was parked is an upper
+        bound on its current capacity, so parked pairs are kept in a heap
+        keyed by that bound.
+
+        Args:
+            pair_keys (numpy.ndarray): Initial key of each pair.
+            pair_remaining_capacity (numpy.ndarray): Remaining info capacity of
+                each pair, in pair idx order when flattened. Must be updated in
+                place by the packer. If None, pair capacities are not checked.
+            dtype (numpy.dtype): Dtype of the keys held in the tree. If an
+                integer dtype, the min value of the dtype is used as the key of
+                empty and parked leaves.
+            rng (numpy.random.Generator): Random number generator used to
+                break ties. If None, a new unseeded generator is used.
+        '''
+        self.num_pairs = len(pair_keys)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # index pair capacities via a flat iterator so that non-contiguous views (e.g. the off-diagonal elements of a src-dst capacity matrix) can be read in place
+        self.pair_remaining_capacity = pair_remaining_capacity.flat if pair_remaining_capacity is not None else None
+
+        # leaves are the pairs, padded to a power of 2 with empty (-inf) leaves
+        self.empty_key = -np.inf if np.issubdtype(dtype, np.floating) else np.iinfo(dtype).min
+        self.num_leaves = 1 << max(int(self.num_pairs - 1).bit_length(), 0)
+        self.tree_max = np.full(2 * self.num_leaves, self.empty_key, dtype=dtype)
+        self.tree_count = np.zeros(2 * self.num_leaves, dtype=np.int64)
+        self.pair_keys = np.array(pair_keys, dtype=dtype)
+        self.tree_max[self.num_leaves:self.num_leaves+self.num_pairs] = self.pair_keys
+        self.tree_count[self.num_leaves:self.num_leaves+self.num_pairs] = 1
+
+        # build tree bottom-up one level at a time
+        level_start = self.num_leaves // 2
+        while level_start >= 1:
+            left_max, right_max = self.tree_max[2*level_start:4*level_start:2], self.tree_max[2*level_start+1:4*level_start:2]
+            left_count, right_count = self.tree_count[2*level_start:4*level_start:2], self.tree_count[2*level_start+1:4*level_start:2]
+            level_max = np.maximum(left_max, right_max)
+            self.tree_max[level_start:2*level_start] = level_max
+            self.tree_count[level_start:2*level_start] = np.where(left_max == level_max, left_count, 0) + np.where(right_max == level_max, right_count, 0)
+            level_start //= 2
+
+        # init heap of (-remaining capacity when parked, pair idx) of pairs which have been removed from the tree because they did not have enough capacity for a flow
+        self.parked_pairs = []
+        self.num_parked_pairs = 0 # total number of times a pair has been parked
+
+    def _set_leaf(self, pair_idx, key, count):
+        tree_max, tree_count = self.tree_max, self.tree_count
+        node = pair_idx + self.num_leaves
+        tree_max[node], tree_count[node] = key, count
+        node >>= 1
+        while node:
+            left, right = 2 * node, 2 * node + 1
+            left_max, right_max = tree_max[left], tree_max[right]
+            if left_max > right_max:
+                node_max, node_count = left_max, tree_count[left]
+            elif right_max > left_max:
+                node_max, node_count = right_max, tree_count[right]
+            else:
+                node_max, node_count = left_max, tree_count[left] + tree_count[right]
+            if tree_max[node] == node_max and tree_count[node] == node_count:
+                # no change propagates any further up the tree
+                break
+            tree_max[node], tree_count[node] = node_max, node_count
+            node >>= 1
+
+    def _sample_max_pair(self):
+        # descend the tree choosing uniformly at random between the leaves which achieve the max key
+        tree_max, tree_count = self.tree_max, self.tree_count
+        node, rank = 1, self.rng.integers(tree_count[1])
+        while node < self.num_leaves:
+            left = 2 * node
+            left_count = tree_count[left] if tree_max[left] == tree_max[node] else 0
+            if rank < left_count:
+                node = left
+            else:
+                rank -= left_count
+                node = left + 1
+        return node - self.num_leaves
+
+    def _park_pair(self, pair_idx):
+        self._set_leaf(pair_idx, self.empty_key, 0)
+        self.num_parked_pairs += 1
+        heapq.heappush(self.parked_pairs, (-self.pair_remaining_capacity[pair_idx], pair_idx))
+
+    def _unpark_pairs(self, flow_size):
+        # re-insert any parked pairs which may now be able to fit a flow of this size
+        while len(self.parked_pairs) > 0 and -self.parked_pairs[0][0] - flow_size >= 0:
+            _, pair_idx = heapq.heappop(self.parked_pairs)
+            if self.pair_remaining_capacity[pair_idx] - flow_size >= 0:
+                self._set_leaf(pair_idx, self.pair_keys[pair_idx], 1)
+            else:
+                # capacity has decreased since was parked, re-park with tighter bound
+                heapq.heappush(self.parked_pairs, (-self.pair_remaining_capacity[pair_idx], pair_idx))
+
+    def choose(self, flow_size):
+        '''
+        Returns the idx of the pair with the highest key which can fit a flow
+        of flow_size, or None if no pair can fit the flow.
+        '''
+        if self.pair_remaining_capacity is not None:
+            self._unpark_pairs(flow_size)
+        while self.tree_count[1] > 0:
+            pair_idx = self._sample_max_pair()
+            if self.pair_remaining_capacity is None or self.pair_remaining_capacity[pair_idx] - flow_size >= 0:
+                return pair_idx
+            # pair would exceed its src and/or dst max load, remove from candidates
+            self._park_pair(pair_idx)
+        return None
+
+    def update(self, pair_idx, key):
+        '''
+        Updates the key of a pair after a flow has been packed into it.
+        '''
+        self.pair_keys[pair_idx] = key
+        if self.tree_count[pair_idx + self.num_leaves] > 0:
+            # pair is not currently parked
+            self._set_leaf(pair_idx, key, 1)
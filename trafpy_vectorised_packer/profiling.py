@@ -0,0 +1,168 @@
+'''
+Opt-in memory profiling of packing phases with tracemalloc (which also
+traces NumPy array allocations).
+
+A MemoryProfiler records, for each named phase, the peak memory allocated
+above the memory allocated when the phase started, the memory retained once
+the phase ends, and the allocating sites (file:line) which retained the most
+memory during the phase. Packers record their phases (reset, pack_loop,
+shuffle, output_construction) in the profiler passed to them or, if none is
+passed, in the active profiler (see activate()), so that packers constructed
+deep inside e.g. tpg.create_demand_data() can be profiled without changing
+how they are constructed:
+
+    memory_profiler = MemoryProfiler()
+    with memory_profiler.activate():
+        flow_centric_demand_data = tpg.create_demand_data(...)
+    memory_profiler.save(f'{save_dir}/memory_profile.json')
+
+If no profiler is active, packers only pay an `is not None` check per phase.
+'''
+import tracemalloc
+import contextlib
+import json
+import time
+
+
+# profiler which packers record their phases in if not given one
+_active_memory_profiler = None
+
+
+def get_active_memory_profiler():
+    return _active_memory_profiler
+
+
+class MemoryProfiler:
+    def __init__(self,
+                 num_frames=1,
+                 num_top_sites=20):
+        '''
+        Args:
+            num_frames (int): Number of stack frames tracemalloc records per
+                allocation. 1 gives the allocating line, more gives its
+                callers (at a higher tracing cost).
+            num_top_sites (int): Number of allocating sites (by retained
+                memory) to record per phase and overall.
+        '''
+        self.num_frames = num_frames
+        self.num_top_sites = num_top_sites
+        self.phases = {}
+        self.top_sites = []
+        self.peak_memory = 0
+        self.retained_memory = 0
+
+        # stack of dicts of the phases which are currently open
+        self._open_phases = []
+        self._started_tracing = False
+        self._start_memory = 0
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.num_frames)
+            self._started_tracing = True
+        self._start_memory = tracemalloc.get_traced_memory()[0]
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self._reset_peak()
+
+    def stop(self):
+        # close any phases left open (e.g. by an exception raised during packing)
+        while len(self._open_phases) > 0:
+            self.stop_phase(self._open_phases[-1]['name'])
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        self.peak_memory = max(self.peak_memory, peak_memory - self._start_memory)
+        self.retained_memory = current_memory - self._start_memory
+        self.top_sites = self._get_top_sites(self._start_snapshot)
+        self._start_snapshot = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def activate(self):
+        '''
+        Context manager which starts profiling and makes this the active
+        profiler which packers record their phases in, then stops profiling
+        on exit.
+        '''
+        global _active_memory_profiler
+        prev_active_memory_profiler = _active_memory_profiler
+        _active_memory_profiler = self
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+            _active_memory_profiler = prev_active_memory_profiler
+
+    def _reset_peak(self):
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def _update_open_phase_peaks(self):
+        # the traced peak is reset whenever a phase starts, so propagate it to every open phase before it is reset
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        for phase in self._open_phases:
+            phase['peak_memory'] = max(phase['peak_memory'], peak_memory)
+
+    def _get_top_sites(self, start_snapshot):
+        stats = tracemalloc.take_snapshot().compare_to(start_snapshot, 'lineno')
+        stats = sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:self.num_top_sites]
+        return [{'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                 'retained_memory': stat.size_diff,
+                 'retained_count': stat.count_diff} for stat in stats if stat.size_diff > 0]
+
+    def start_phase(self, name):
+        self._update_open_phase_peaks()
+        current_memory = tracemalloc.get_traced_memory()[0]
+        self._open_phases.append({'name': name,
+                                  'start_memory': current_memory,
+                                  'peak_memory': current_memory,
+                                  'start_time': time.perf_counter(),
+                                  # top sites are only recorded for a phase's first call, so only walk the heap then
+                                  'start_snapshot': tracemalloc.take_snapshot() if name not in self.phases and not any(phase['name'] == name for phase in self._open_phases) else None})
+        self._reset_peak()
+
+    def stop_phase(self, name):
+        if len(self._open_phases) == 0 or self._open_phases[-1]['name'] != name:
+            raise Exception(f'Cannot stop phase {name} since it is not the most recently started open phase')
+        self._update_open_phase_peaks()
+        phase = self._open_phases.pop()
+        current_memory = tracemalloc.get_traced_memory()[0]
+
+        # phases may be recorded more than once (e.g. once per iter_pack() chunk), in which case the max peak and total retained memory are kept
+        record = self.phases.setdefault(name, {'peak_memory': 0, 'retained_memory': 0, 'time': 0., 'calls': 0, 'top_sites': []})
+        record['peak_memory'] = max(record['peak_memory'], phase['peak_memory'] - phase['start_memory'])
+        record['retained_memory'] += current_memory - phase['start_memory']
+        record['time'] += time.perf_counter() - phase['start_time']
+        record['calls'] += 1
+        if phase['start_snapshot'] is not None:
+            record['top_sites'] = self._get_top_sites(phase['start_snapshot'])
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.start_phase(name)
+        try:
+            yield
+        finally:
+            self.stop_phase(name)
+
+    def to_dict(self):
+        '''
+        Returns the profile as a dict of peak_memory and retained_memory (in
+        bytes, relative to when profiling started), top_sites and phases,
+        where each phase records its max peak_memory over its calls, total
+        retained_memory, total time (which includes the cost of taking
+        snapshots), number of calls and the top_sites of its first call.
+        '''
+        return {'peak_memory': self.peak_memory,
+                'retained_memory': self.retained_memory,
+                'top_sites': self.top_sites,
+                'phases': self.phases}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def __repr__(self):
+        phases = ' | '.join(f'{name}: peak {phase["peak_memory"] / 1e6:.1f} MB, retained {phase["retained_memory"] / 1e6:.1f} MB' for name, phase in self.phases.items())
+        return f'MemoryProfiler(peak_memory: {self.peak_memory / 1e6:.1f} MB | retained_memory: {self.retained_memory / 1e6:.1f} MB | {phases})'
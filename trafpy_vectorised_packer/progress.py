@@ -0,0 +1,196 @@
+'''
+Packing progress reporting. VectorisedFlowPacker calls each of its progress
+callbacks with a PackingProgress every progress_callback_freq packed flows
+(or sooner if progress_callback_interval seconds have passed), rather than
+doing any per-flow progress bookkeeping, and skips progress reporting
+entirely if it has no callbacks.
+
+Progress bars, log lines and wandb logs are callbacks (adapters) on top of
+this interface, and any other callable taking a PackingProgress can be used.
+'''
+import logging
+import time
+from tqdm import tqdm
+
+
+class PackingProgress:
+    # progress metrics, in the order they are logged
+    KEYS = ('num_packed_flows',
+            'num_flows',
+            'info_packed',
+            'elapsed_time',
+            'flows_per_second',
+            'max_pair_deviation',
+            'jensen_shannon_distance',
+            'jensen_shannon_distance_lower_bound')
+
+    def __init__(self,
+                 num_packed_flows,
+                 num_flows,
+                 info_packed,
+                 elapsed_time,
+                 num_flows_since_start,
+                 get_max_pair_deviation,
+                 get_jensen_shannon_distance,
+                 get_jensen_shannon_distance_lower_bound):
+        '''
+        Progress of a packer at a progress update.
+
+        The metrics which cost O(num_pairs) to compute (max_pair_deviation,
+        jensen_shannon_distance and jensen_shannon_distance_lower_bound) are
+        only computed (once) if accessed, so callbacks which only read the
+        flow counts (e.g. progress bars) do not pay for them. Since they are
+        computed from the packer's current state, read them (or to_dict())
+        inside the callback rather than after packing has moved on.
+
+        Also supports dict-style access (e.g. progress['num_packed_flows']).
+
+        Args:
+            num_packed_flows (int): Number of flows packed so far.
+            num_flows (int): Number of flows to pack.
+            info_packed (float): Total size of the flows packed so far.
+            elapsed_time (float): Seconds since the current packing call
+                (e.g. pack_the_flows()) started.
+            num_flows_since_start (int): Number of flows packed since the
+                current packing call started.
+            get_max_pair_deviation (callable): Returns the max absolute
+                difference between a pair's share of the info packed so far
+                and its target share.
+            get_jensen_shannon_distance (callable): Returns the Jensen Shannon
+                distance of the flows packed so far from the target node dist.
+            get_jensen_shannon_distance_lower_bound (callable): Returns a lower
+                bound on the Jensen Shannon distance that will be achieved once
+                all flows are packed.
+        '''
+        self.num_packed_flows = num_packed_flows
+        self.num_flows = num_flows
+        self.info_packed = info_packed
+        self.elapsed_time = elapsed_time
+        self.flows_per_second = num_flows_since_start / elapsed_time if elapsed_time > 0 else 0.
+        self._getters = {'max_pair_deviation': get_max_pair_deviation,
+                         'jensen_shannon_distance': get_jensen_shannon_distance,
+                         'jensen_shannon_distance_lower_bound': get_jensen_shannon_distance_lower_bound}
+        self._computed = {}
+
+    def _get(self, key):
+        if key not in self._computed:
+            self._computed[key] = float(self._getters[key]())
+        return self._computed[key]
+
+    @property
+    def max_pair_deviation(self):
+        return self._get('max_pair_deviation')
+
+    @property
+    def jensen_shannon_distance(self):
+        return self._get('jensen_shannon_distance')
+
+    @property
+    def jensen_shannon_distance_lower_bound(self):
+        return self._get('jensen_shannon_distance_lower_bound')
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self, keys=None):
+        return {key: getattr(self, key) for key in (keys if keys is not None else self.KEYS)}
+
+
+class TqdmProgressCallback:
+    def __init__(self,
+                 desc='Packing flows',
+                 leave=False,
+                 disable=None,
+                 **tqdm_kwargs):
+        '''
+        Progress callback which shows a tqdm progress bar of the flows packed,
+        opened at the first progress update and closed once all flows are
+        packed. If disable is None, the bar is disabled when not writing to
+        a terminal (e.g. in headless sweep workers).
+        '''
+        self.tqdm_kwargs = {'desc': desc, 'leave': leave, 'disable': disable, 'smoothing': 0, **tqdm_kwargs}
+        self.pbar = None
+        self.num_packed_flows = 0
+
+    def __call__(self, progress):
+        if self.pbar is None:
+            # start from any flows already packed (e.g. by a previous pack_the_flows() call before pack_more_flows())
+            self.pbar = tqdm(total=progress.num_flows, initial=self.num_packed_flows, **self.tqdm_kwargs)
+        self.pbar.total = progress.num_flows
+        self.pbar.update(progress.num_packed_flows - self.num_packed_flows)
+        self.num_packed_flows = progress.num_packed_flows
+        if progress.num_packed_flows >= progress.num_flows:
+            self.close()
+
+    def close(self):
+        if self.pbar is not None:
+            self.pbar.close()
+            self.pbar = None
+
+
+class LoggingProgressCallback:
+    def __init__(self,
+                 logger=None,
+                 level=logging.INFO,
+                 log_jensen_shannon_distance=False):
+        '''
+        Progress callback which logs a line per progress update.
+
+        Args:
+            logger (logging.Logger): Logger to log to. If None, uses this
+                module's logger.
+            level (int): Logging level of the progress lines.
+            log_jensen_shannon_distance (bool): If True, also logs the Jensen
+                Shannon distance of the flows packed so far, which costs
+                O(num_pairs) per progress update.
+        '''
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.level = level
+        self.log_jensen_shannon_distance = log_jensen_shannon_distance
+
+    def __call__(self, progress):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        line = f'Packed {progress.num_packed_flows} of {progress.num_flows} flows ({100 * progress.num_packed_flows / max(progress.num_flows, 1):.1f}%) | info_packed: {progress.info_packed:.4g} | flows_per_second: {progress.flows_per_second:.1f} | max_pair_deviation: {progress.max_pair_deviation:.4g} | jensen_shannon_distance_lower_bound: {progress.jensen_shannon_distance_lower_bound:.4g}'
+        if self.log_jensen_shannon_distance:
+            line += f' | jensen_shannon_distance: {progress.jensen_shannon_distance:.4g}'
+        self.logger.log(self.level, line)
+
+
+class WandbProgressCallback:
+    def __init__(self,
+                 run=None,
+                 prefix='packing/',
+                 keys=None,
+                 min_interval=0):
+        '''
+        Progress callback which logs the progress metrics to wandb.
+
+        Args:
+            run (wandb.sdk.wandb_run.Run): Run to log to. If None, logs to the
+                current wandb run.
+            prefix (str): Prefix of the logged keys.
+            keys (list): Progress metrics to log. If None, logs all of
+                PackingProgress.KEYS.
+            min_interval (float): Min seconds between logs (on top of the
+                packer's progress throttling), to limit the wandb log rate.
+        '''
+        self.run = run
+        self.prefix = prefix
+        self.keys = keys
+        self.min_interval = min_interval
+        self.last_log_t = None
+
+    def __call__(self, progress):
+        t = time.time()
+        if self.last_log_t is not None and t - self.last_log_t < self.min_interval and progress.num_packed_flows < progress.num_flows:
+            return
+        self.last_log_t = t
+        if self.run is None:
+            import wandb
+            run = wandb
+        else:
+            run = self.run
+        run.log({f'{self.prefix}{key}': val for key, val in progress.to_dict(keys=self.keys).items()})
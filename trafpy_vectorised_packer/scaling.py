@@ -0,0 +1,129 @@
+'''
+Empirical scaling analysis of packing cost. Packs a geometric grid of
+numbers of end points (N) and flows (F), fits the log-log model
+
+    log(cost) = log(a) + b * log(N) + c * log(F)
+
+(i.e. cost = a * N^b * F^c) to the packing time and peak memory, and uses
+the fitted exponents to predict the cost of larger jobs (e.g. 4096 end point
+generation jobs) and to flag scaling regressions against a stored baseline
+fit.
+'''
+from trafpy_vectorised_packer import benchmarking
+from trafpy_vectorised_packer import pair_cache
+
+import numpy as np
+import tracemalloc
+import gc
+
+
+def measure_packing_cost(packer_cls, num_eps, num_flows, num_repeats=3, measure_memory=True, seed=0, **kwargs):
+    '''
+    Returns a dict of the min packing time (construction + packing) over
+    num_repeats runs, and (if measure_memory) the peak memory allocated
+    during construction + packing of a separate run. Memory is measured with
+    tracemalloc (which also traces NumPy array allocations) in its own run
+    since tracing slows down allocation and so would inflate the packing time.
+    The memory run is done first and with the pair structure cache cleared, so
+    that its peak includes the O(N^2) pair structures (which a warm cache
+    would otherwise leave out). If tracemalloc is already tracing (e.g. inside
+    a profiling.MemoryProfiler), tracing is left on and the peak is measured
+    relative to the memory already traced, but the traced peak is reset.
+
+    Args:
+        kwargs: Passed to benchmarking.gen_packer_inputs() if one of its args
+            (flow_size_dist, load, ep_link_capacity, node_dist_skew_sigma),
+            otherwise to the packer.
+    '''
+    if num_repeats < 1:
+        raise Exception(f'num_repeats must be >= 1 but is {num_repeats}')
+    input_kwargs = {key: kwargs.pop(key) for key in ['flow_size_dist', 'load', 'ep_link_capacity', 'node_dist_skew_sigma'] if key in kwargs}
+    inputs = benchmarking.gen_packer_inputs(num_eps=num_eps, num_flows=num_flows, seed=seed, **input_kwargs)
+    cost = {'num_eps': num_eps, 'num_flows': num_flows}
+
+    if measure_memory:
+        pair_cache.pair_structure_cache.clear()
+        gc.collect()
+        # only start (and so stop) tracing if not already tracing (e.g. inside a profiling.MemoryProfiler), otherwise measure relative to the memory already traced
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        try:
+            packer = benchmarking.run_packer(packer_cls, inputs, **kwargs)[0]
+            cost['peak_memory'] = tracemalloc.get_traced_memory()[1] - start_memory
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+        del packer
+
+    times = []
+    for _ in range(num_repeats):
+        gc.collect()
+        _, init_time, pack_time = benchmarking.run_packer(packer_cls, inputs, **kwargs)
+        times.append(init_time + pack_time)
+    cost['time'] = min(times)
+
+    return cost
+
+
+def fit_scaling_exponents(costs, metric='time'):
+    '''
+    Fits cost = a * N^b * F^c to the metric of a list of cost dicts (as
+    returned by measure_packing_cost()) by least squares in log space.
+
+    Returns a dict of the coefficient a, the num_eps exponent b, the
+    num_flows exponent c and the r2 of the fit in log space. If the costs
+    only vary in one of N or F, the other's exponent is fixed at 0.
+    '''
+    costs = [cost for cost in costs if cost.get(metric) is not None and cost[metric] > 0]
+    if len(costs) < 2:
+        raise Exception(f'Need at least 2 costs with a positive {metric} to fit scaling exponents but have {len(costs)}')
+    log_num_eps = np.log([cost['num_eps'] for cost in costs])
+    log_num_flows = np.log([cost['num_flows'] for cost in costs])
+    log_cost = np.log([cost[metric] for cost in costs])
+
+    # only fit exponents of variables which vary over the grid
+    fit_num_eps, fit_num_flows = np.ptp(log_num_eps) > 0, np.ptp(log_num_flows) > 0
+    design = np.stack([np.ones(len(costs))] + ([log_num_eps] if fit_num_eps else []) + ([log_num_flows] if fit_num_flows else []), axis=1)
+    params = list(np.linalg.lstsq(design, log_cost, rcond=None)[0])
+    log_coef = params.pop(0)
+    num_eps_exponent = params.pop(0) if fit_num_eps else 0.
+    num_flows_exponent = params.pop(0) if fit_num_flows else 0.
+
+    residuals = log_cost - (log_coef + num_eps_exponent * log_num_eps + num_flows_exponent * log_num_flows)
+    total = np.sum((log_cost - np.mean(log_cost)) ** 2)
+    r2 = 1 - np.sum(residuals ** 2) / total if total > 0 else 1.
+    return {'coef': float(np.exp(log_coef)),
+            'num_eps_exponent': float(num_eps_exponent),
+            'num_flows_exponent': float(num_flows_exponent),
+            'r2': float(r2)}
+
+
+def predict_cost(fit, num_eps, num_flows):
+    '''
+    Returns the cost a * N^b * F^c predicted by a fit from
+    fit_scaling_exponents().
+    '''
+    return fit['coef'] * num_eps ** fit['num_eps_exponent'] * num_flows ** fit['num_flows_exponent']
+
+
+def find_scaling_regressions(fits, baseline_fits, tolerance=0.1):
+    '''
+    Compares dicts of metric -> fit against a baseline of the same form and
+    returns a list of messages describing each exponent which has increased
+    by more than tolerance over its baseline, along with whether the
+    increase has made the cost super-linear (exponent > 1) in that variable.
+    '''
+    regressions = []
+    for metric, fit in fits.items():
+        if metric not in baseline_fits:
+            continue
+        for exponent in ['num_eps_exponent', 'num_flows_exponent']:
+            increase = fit[exponent] - baseline_fits[metric][exponent]
+            if increase > tolerance:
+                super_linear = ' (now super-linear)' if fit[exponent] > 1 >= baseline_fits[metric][exponent] else ''
+                regressions.append(f'{metric} {exponent} increased from {baseline_fits[metric][exponent]:.3f} to {fit[exponent]:.3f} (+{increase:.3f} > tolerance {tolerance}){super_linear}')
+    return regressions
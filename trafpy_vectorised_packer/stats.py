@@ -0,0 +1,86 @@
+'''
+Per-phase packing stats recorded by VectorisedFlowPacker when constructed
+with collect_stats=True. When collect_stats is False the packer holds no
+stats object and each instrumented phase costs a single `is not None` check,
+so stats can be left on or off in production sweeps.
+'''
+import json
+import time
+
+
+class PackingStats:
+    # phases of packing which are timed
+    PHASES = ('reset', # deriving pair structures and initialising the pair and end point trackers
+              'pack_loop', # packing all flows of a pack_the_flows() call, iter_pack() chunk or size class pack (whatever the pair_selector, backend and sharding)
+              'candidate_masking', # masking out pairs which cannot fit a flow (per-flow masked scan only)
+              'argmax_tie_break', # choosing the pair furthest from its target, breaking ties at random (per-flow masked scan and segment tree only)
+              'capacity_update', # updating the pair and end point info trackers and pair remaining capacities after packing a flow (per-flow packing only)
+              'shuffle', # shuffling the packed flows back into a random order (and building the packed flows dict if not returning packed flow arrays)
+              'jensen_shannon_distance') # computing the Jensen Shannon distance of the achieved pair dist from the target
+
+    def __init__(self):
+        '''
+        Wall time (from time.perf_counter()) and number of calls of each
+        packing phase in PHASES, along with counters of the flows packed and
+        of infeasible candidate pairs. Accumulates over every packing call of
+        the packer it belongs to (e.g. pack_the_flows() followed by
+        pack_more_flows()).
+
+        num_infeasible_candidates is the number of (flow, pair) candidates
+        rejected because the pair could not fit the flow without exceeding
+        its src and/or dst max load. With the masked scan this is counted for
+        every pair for every flow, whereas the segment tree only counts the
+        pairs it finds to be infeasible when they reach the top of the tree
+        (see SegmentTreePairSelector).
+        '''
+        self.phase_times = {phase: 0. for phase in self.PHASES}
+        self.phase_calls = {phase: 0 for phase in self.PHASES}
+        self.num_flows_packed = 0
+        self.num_infeasible_candidates = 0
+        self.packing_time = 0.
+
+    def time_phase(self, phase, start_t):
+        '''
+        Records a call of phase which started at start_t (from
+        time.perf_counter()). Returns the current time so that consecutive
+        phases can be timed with one clock read between them.
+        '''
+        t = time.perf_counter()
+        self.phase_times[phase] += t - start_t
+        self.phase_calls[phase] += 1
+        return t
+
+    @property
+    def flows_per_second(self):
+        return self.num_flows_packed / self.packing_time if self.packing_time > 0 else 0.
+
+    def to_dict(self):
+        return {'phase_times': dict(self.phase_times),
+                'phase_calls': dict(self.phase_calls),
+                'num_flows_packed': self.num_flows_packed,
+                'num_infeasible_candidates': self.num_infeasible_candidates,
+                'packing_time': self.packing_time,
+                'flows_per_second': self.flows_per_second}
+
+    @classmethod
+    def from_dict(cls, stats_dict):
+        stats = cls()
+        stats.phase_times.update(stats_dict['phase_times'])
+        stats.phase_calls.update(stats_dict['phase_calls'])
+        stats.num_flows_packed = stats_dict['num_flows_packed']
+        stats.num_infeasible_candidates = stats_dict['num_infeasible_candidates']
+        stats.packing_time = stats_dict['packing_time']
+        return stats
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def __repr__(self):
+        phases = ' | '.join(f'{phase}: {self.phase_times[phase]:.3f} s ({self.phase_calls[phase]} calls)' for phase in self.PHASES)
+        return f'PackingStats(num_flows_packed: {self.num_flows_packed} | flows_per_second: {self.flows_per_second:.1f} | num_infeasible_candidates: {self.num_infeasible_candidates} | {phases})'
@@ -2,14 +2,22 @@ from trafpy.generator.src.packers.flow_packer import FlowPacker
 from trafpy.generator.src import tools
 from trafpy.generator.src.dists import val_dists, node_dists, plot_dists
 
+from trafpy_vectorised_packer.pair_selectors import SegmentTreePairSelector
+from trafpy_vectorised_packer.packed_flows import PackedFlows, PackedSizeClasses
+from trafpy_vectorised_packer import kernels
+from trafpy_vectorised_packer import pair_cache
+from trafpy_vectorised_packer.stats import PackingStats
+from trafpy_vectorised_packer import profiling
+from trafpy_vectorised_packer.progress import PackingProgress, TqdmProgressCallback
+from trafpy_vectorised_packer import out_of_core
+
 import numpy as np
 import time
-from collections import defaultdict # use for initialising arbitrary length nested dict
-import json
 import copy
-import random
 import math
 import multiprocessing
+import tempfile
+import os
 from tqdm import tqdm # progress bar
 from tqdm import trange
 from tqdm.contrib.concurrent import process_map
@@ -20,6 +28,10 @@ import matplotlib.pyplot as plt
 from typing import Union
 
 
+class JensenShannonDistanceThresholdExceeded(Exception):
+    pass
+
+
 class VectorisedFlowPacker(FlowPacker):
     def __init__(self,
                  generator,
@@ -31,12 +43,237 @@ class VectorisedFlowPacker(FlowPacker):
                  network_load_config,
                  auto_node_dist_correction=False,
                  check_dont_exceed_one_ep_load=True,
-                 print_data=False):
+                 print_data=False,
+                 pair_selector='masked_scan',
+                 return_packed_flow_arrays=False,
+                 pack_size_classes=False,
+                 backend='numpy',
+                 racks_dict=None,
+                 num_workers=None,
+                 progress_callback=None,
+                 progress_callback_freq=1000,
+                 progress_callback_interval=None,
+                 progress_bar=True,
+                 jensen_shannon_distance_threshold=None,
+                 pair_cache_dir=None,
+                 state_dtype='float64',
+                 state_info_unit=1,
+                 sparse_pairs=False,
+                 rng=None,
+                 collect_stats=False,
+                 memory_profiler=None,
+                 out_of_core_dir=None,
+                 out_of_core_chunk_size=2**22):
+        '''
+        Args:
+            pair_selector (str): How to choose the src-dst pair to pack each
+                flow into. 'masked_scan' masks and scans all pairs for each
+                flow (O(P) per flow). 'segment_tree' uses a
+                SegmentTreePairSelector (O(log P) per flow), which makes the
+                same choices as 'masked_scan' (up to random tie-breaking) and
+                is faster for large numbers of end points.
+            return_packed_flow_arrays (bool): If True, pack_the_flows() returns
+                a PackedFlows object holding contiguous flow_ids, sizes,
+                src_idxs and dst_idxs arrays (which can also be read as a
+                read-only packed flows dict) rather than building a dict of
+                per-flow dicts.
+            pack_size_classes (bool): If True, flows of equal size (e.g. from
+                flow size dists with round_to_nearest) are packed together as
+                a size class rather than one at a time. See
+                pack_the_size_classes().
+            backend (str): 'numpy' packs each flow with NumPy calls from a
+                Python loop. 'numba' runs the whole per-flow choose/check/pack
+                loop as a single compiled kernel (see kernels.py), making the
+                same choices as 'numpy' with pair_selector='masked_scan' (up to
+                random tie-breaking). Falls back to 'numpy' with a warning if
+                numba is not installed.
+            racks_dict (dict): Mapping of rack to the end points in that rack
+                (e.g. the network's rack_to_ep_dict). If given, the pair space
+                is split into rack-pair shards and each shard is packed
+                (with backend) in a separate process, with its share of
+                flows set by its share of the target load and its share of
+                each end point's capacity set by that end point's share of
+                target load in the shard. Any flows which do not fit into
+                their shard are then packed into the global pair space.
+            num_workers (int): Max number of processes to pack shards in if
+                racks_dict is given. If None, uses the number of CPUs.
+            progress_callback (callable): Callable (or list of callables)
+                called at each progress update with a PackingProgress (see
+                progress.py) of num_packed_flows, num_flows, info_packed,
+                elapsed_time, flows_per_second, max_pair_deviation,
+                jensen_shannon_distance (of the flows packed so far from the
+                target node dist) and jensen_shannon_distance_lower_bound (a
+                lower bound on the distance that will be achieved once all
+                flows are packed, see _update_packing_progress()). Progress
+                updates happen every progress_callback_freq packed flows, or
+                sooner if progress_callback_interval seconds have passed, and
+                once each time a batch of flows has finished packing. If there
+                are no callbacks (and no jensen_shannon_distance_threshold),
+                no progress bookkeeping is done while packing. See progress.py
+                for progress bar, logging and wandb callbacks.
+            progress_callback_freq (int): Number of packed flows between
+                progress updates.
+            progress_callback_interval (float): If given, max seconds between
+                progress updates. Only checked between flows (or between
+                kernel calls of progress_callback_freq flows with backend
+                numba, or between shards with racks_dict).
+            progress_bar (bool): If True, a TqdmProgressCallback progress bar
+                (which is disabled when not writing to a terminal) is added to
+                the progress callbacks.
+            jensen_shannon_distance_threshold (float): If given, packing is
+                aborted by raising JensenShannonDistanceThresholdExceeded as
+                soon as a progress update finds that the Jensen Shannon
+                distance achieved once all flows are packed is guaranteed
+                to be above this threshold.
+            pair_cache_dir (str): The pair structures derived from eps and
+                node_dist are always cached in memory and shared by packers
+                in the same process (see pair_cache.py). If given, they are
+                also cached on disk in this dir so that they can be reused
+                across processes.
+            state_dtype (str): Dtype of the per-pair state (target, current and
+                distance from target info and remaining capacity, and target
+                load rate if float32). 'float32' halves the per-pair working
+                set. 'int32' or
+                'int64' store info as integer multiples of state_info_unit
+                (e.g. bytes, or the round_to_nearest of the flow size dist).
+                Per-end point state is O(num_eps) so is always float64, which
+                keeps the end point max load checks exact. Only compatible
+                with backend numpy, pack_size_classes False and racks_dict
+                None. Error bounds on placement decisions relative to float64:
+                    - Remaining capacities are rounded down and flow sizes up
+                    when checking whether a flow fits into a pair, so packing
+                    never exceeds an end point's max load. A pair can only be
+                    wrongly rejected if its remaining capacity exceeds the flow
+                    size by less than one rounding step (2^-24 relative to
+                    max_total_port_info for float32, state_info_unit for int).
+                    - float32: each flow packed into a pair adds a rounding
+                    error of at most 2^-24 relative to the pair's target total
+                    info to its key, so after k flows a pair's key is within
+                    k * 2^-24 * 2 * (pair target total info) of its float64 key.
+                    Choices can only differ between pairs whose float64 keys
+                    are within the sum of their bounds (i.e. near-ties).
+                    - int: targets are rounded to the nearest state_info_unit
+                    (error <= state_info_unit / 2 per pair) and flow sizes to
+                    the nearest state_info_unit (exact if flow sizes are
+                    multiples of state_info_unit), with no accumulated error,
+                    so choices are exact for the rounded targets. Raises if
+                    the info values could overflow the int dtype.
+            state_info_unit (float): Info per integer unit of state if
+                state_dtype is an int dtype.
+            sparse_pairs (bool): If True, only src-dst pairs with nonzero
+                node dist prob are held and packed into (rather than all
+                num_eps * (num_eps - 1) pairs), and pair remaining capacities
+                are held as a flat array updated through CSR end point to pair
+                adjacency arrays rather than as a num_eps x num_eps matrix, so
+                choosing pairs and updating capacities scales with the number
+                of nonzero prob pairs. Unlike with all pairs, no flow is ever
+                packed into a zero prob pair (which would otherwise happen
+                once the adjusted distances of all nonzero prob pairs which
+                can fit a flow fall to <= 0).
+            rng (numpy.random.Generator): Random number generator used for all
+                of the packer's random choices (breaking ties between pairs,
+                allocating flows to shards and shuffling the packed flows).
+                Pass independent generators (e.g. spawned from one
+                numpy.random.SeedSequence) to parallel workers to give each
+                worker its own reproducible stream. If None, a generator
+                seeded from numpy's global random state is used, so
+                np.random.seed() still makes packing reproducible.
+            collect_stats (bool): If True, the wall time and number of calls of
+                each packing phase, the number of flows packed, flows per
+                second and number of infeasible candidate pairs are recorded
+                in a PackingStats object (see stats.py) held in self.stats,
+                which can be serialised with to_dict() or save(). If False,
+                self.stats is None.
+            memory_profiler (MemoryProfiler): If given, the peak and retained
+                memory of the reset, pack_loop, shuffle and
+                output_construction phases are recorded in this profiler (see
+                profiling.py). If None, they are recorded in the active
+                profiler if there is one.
+            out_of_core_dir (str): If given, arrays of more than
+                out_of_core_chunk_size flows which the packer would otherwise
+                create in memory (a sorted copy of read-only or memmap flow
+                sizes, the packed flow arrays and the shuffled packed flows)
+                are instead created as np.memmap-backed .npy files in a new
+                directory in out_of_core_dir, and flow sizes are sorted with
+                an external merge sort (see out_of_core.py). Together with
+                memmap flow inputs, this makes the packer's memory depend on
+                the pair state rather than on the number of flows (up to the
+                shuffle permutation, which is held in memory, and the packed
+                flows dict if return_packed_flow_arrays is False). The files
+                are not deleted by the packer.
+            out_of_core_chunk_size (int): Number of flows to hold in memory at
+                a time when reducing, sorting or writing flow arrays.
+
+        node_dist and the flow arrays are not copied (node_dist is only copied
+        if auto_node_dist_correction is True, since the correction may modify
+        it), so they can be read-only views (e.g. of shared memory or
+        memmaps) shared between packers. The packer never writes to node_dist.
+        flow_sizes is sorted in place before packing if it is a writeable
+        in-memory array; if it is read-only or a memmap, a sorted copy is
+        packed instead and the input is left untouched. The flow arrays are
+        only read a chunk at a time (e.g. to find the duration), so they can
+        be np.memmaps of traces larger than memory.
+        '''
+        if pair_selector not in {'masked_scan', 'segment_tree'}:
+            raise Exception(f'Unrecognised pair_selector {pair_selector}, must be one of masked_scan, segment_tree')
+        self.pair_selector = pair_selector
+        self.return_packed_flow_arrays = return_packed_flow_arrays
+        self.pack_size_classes = pack_size_classes
+        if backend not in {'numpy', 'numba'}:
+            raise Exception(f'Unrecognised backend {backend}, must be one of numpy, numba')
+        if backend == 'numba' and not kernels.is_numba_available():
+            warnings.warn('numba is not installed, falling back to numpy backend')
+            backend = 'numpy'
+        if backend == 'numba' and (pair_selector != 'masked_scan' or pack_size_classes):
+            raise Exception(f'backend numba is only compatible with pair_selector masked_scan and pack_size_classes False')
+        self.backend = backend
+        if racks_dict is not None and (pair_selector != 'masked_scan' or pack_size_classes):
+            raise Exception(f'racks_dict is only compatible with pair_selector masked_scan and pack_size_classes False')
+        self.racks_dict = racks_dict
+        self.num_workers = num_workers
+        if progress_callback_freq < 1:
+            raise Exception(f'progress_callback_freq must be >= 1 but is {progress_callback_freq}')
+        if progress_callback is None:
+            self.progress_callbacks = []
+        elif callable(progress_callback):
+            self.progress_callbacks = [progress_callback]
+        else:
+            self.progress_callbacks = list(progress_callback)
+        self.progress_bar = progress_bar
+        if progress_bar:
+            self.progress_callbacks.append(TqdmProgressCallback())
+        self.progress_callback_freq = progress_callback_freq
+        self.progress_callback_interval = progress_callback_interval
+        self.jensen_shannon_distance_threshold = jensen_shannon_distance_threshold
+        self.track_packing_progress = len(self.progress_callbacks) > 0 or jensen_shannon_distance_threshold is not None
+        # the pair info overshoot (from which the Jensen Shannon distance lower bound is found) only needs to be updated per packed flow if checking the threshold at every progress update, otherwise is recomputed if a progress callback reads the bound
+        self.track_pair_info_overshoot = jensen_shannon_distance_threshold is not None
+        self.pair_cache_dir = pair_cache_dir
+        if state_dtype not in {'float64', 'float32', 'int32', 'int64'}:
+            raise Exception(f'Unrecognised state_dtype {state_dtype}, must be one of float64, float32, int32, int64')
+        if state_dtype != 'float64' and (self.backend != 'numpy' or pack_size_classes or racks_dict is not None):
+            raise Exception(f'state_dtype {state_dtype} is only compatible with backend numpy, pack_size_classes False and racks_dict None')
+        self.state_dtype = np.dtype(state_dtype)
+        self.compact_state = self.state_dtype != np.float64
+        self.state_dtype_is_int = np.issubdtype(self.state_dtype, np.integer)
+        self.state_info_unit = state_info_unit if self.state_dtype_is_int else 1
+        self.sparse_pairs = sparse_pairs
+        self.rng = rng if rng is not None else np.random.default_rng(np.random.randint(2**31 - 1))
+        self.stats = PackingStats() if collect_stats else None
+        self.memory_profiler = memory_profiler if memory_profiler is not None else profiling.get_active_memory_profiler()
+        self.out_of_core_dir = out_of_core_dir
+        self.out_of_core_chunk_size = out_of_core_chunk_size
+        # directory of this packer's out of core arrays, only created once the first is written
+        self.out_of_core_array_dir = None
+        if self.backend == 'numba':
+            # compile kernel (or load from numba cache) before packing so that is not included in packing time. N.B. Only takes time the first time is called in a process
+            self.numba_kernel_warmup_time = kernels.warmup_numba_pack_flows_kernel()
+
         FlowPacker.__init__(
                     self,
                     generator=generator,
                     eps=eps,
-                    node_dist=copy.deepcopy(node_dist),
+                    node_dist=copy.deepcopy(node_dist) if auto_node_dist_correction else node_dist,
                     flow_ids=flow_ids,
                     flow_sizes=flow_sizes,
                     flow_interarrival_times=flow_interarrival_times,
@@ -47,67 +284,90 @@ class VectorisedFlowPacker(FlowPacker):
                 )
 
     def reset(self):
-        # init dict in which flows will be packed into src-dst pairs
-        self.packed_flows = {}
+        if self.stats is not None:
+            reset_start_t = time.perf_counter()
+        if self.memory_profiler is not None:
+            self.memory_profiler.start_phase('reset')
 
-        # want to pack largest flows first -> re-organise flows into descending order (will shuffle later so maintain random flow sizes of arrivals)
-        self.flow_sizes[::-1].sort()
-
-        # init packed flows with src-dst pairs to be determined
-        for idx in range(len(self.flow_ids)):
-            self.packed_flows[self.flow_ids[idx]] = {'size': self.flow_sizes[idx],
-                                                     'src': None,
-                                                     'dst': None}
-
-        # get each possible src-dst pair and calc their corresponding target load rate
-        self.pair_prob_dict = node_dists.get_pair_prob_dict_of_node_dist_matrix(self.node_dist, self.eps, all_combinations=True) # N.B. These values sum to 0.5 -> need to allocate twice (src-dst and dst-src)
-        self.pairs = np.asarray(list(self.pair_prob_dict.keys()))
-        self.pair_probs = np.asarray(list(self.pair_prob_dict.values()))
+        # packed flows will be built from the packed flow arrays once all flows have been packed into src-dst pairs
+        self.packed_flows = None
+
+        # view (rather than copy) flow sizes as an array, keeping memmaps as memmaps so that are not sorted in place
+        self.flow_sizes = np.asanyarray(self.flow_sizes)
+
+        # get the (read-only) pair structures of these end points and node dist, which are only derived once per process (or once across processes if pair_cache_dir is given) for a given network and node dist
+        pair_structures = pair_cache.get_pair_structures(self.eps, self.node_dist, cache_dir=self.pair_cache_dir, sparse=self.sparse_pairs)
+
+        # map each end point label to a dense int index once so that all pair bookkeeping can be done on integer arrays rather than on json string pair keys. End point labels are only translated back when the packed flows are output
+        self.num_eps = len(self.eps)
+        self.idx_to_ep = pair_structures['eps']
+        self.ep_to_idx = {ep: idx for idx, ep in enumerate(self.eps)}
+
+        # get each possible src-dst pair as a (num_pairs, 2) array of src-dst end point indices and calc their corresponding target load rate
+        self.pairs = pair_structures['pairs']
+        self.pair_src_idxs, self.pair_dst_idxs = self.pairs[:, 0], self.pairs[:, 1]
+        self.pair_idxs = np.arange(len(self.pairs))
+        self.pair_probs = pair_structures['pair_probs'] # N.B. These values sum to 0.5 -> need to allocate twice (src-dst and dst-src)
         # if np.sum(self.pair_probs) == 1:
         if np.sum(self.pair_probs) + self.machine_eps >= 1:
             # need load fracs to sum to 0.5 since allocate twice (src-dst and dst-src)
-            self.pair_probs /= 2
-        self.pair_target_load_rate = self.pair_probs * self.load_rate
+            self.pair_probs = self.pair_probs / 2
+        # int targets are rounded from float64 products so that they are within state_info_unit / 2 of the float64 targets
+        self.pair_target_load_rate = (self.pair_probs * self.load_rate).astype(np.float32 if self.state_dtype == np.float32 else np.float64)
 
         # calc target total info to pack into each src-dst pair throughout simulation
-        flow_event_times = tools.gen_event_times(self.flow_interarrival_times)
-        self.duration = max(flow_event_times) - min(flow_event_times)
-        if self.duration == 0:
-            # set to some number to prevent infinities
-            self.duration = 1e6
-        self.pair_target_total_info = self.pair_target_load_rate * self.duration
+        self.duration = self._get_duration(self.flow_interarrival_times)
+        self._check_state_dtype_range(self.duration, np.sum(self.flow_sizes))
+        self.pair_target_total_info = self._to_state_info(self.pair_target_load_rate * self.duration)
 
         # init current total info packed into each src-dst pair and current distance from target info
-        self.pair_current_total_info = np.zeros(len(self.pair_prob_dict))
+        self.pair_current_total_info = np.zeros(len(self.pairs), dtype=self.state_dtype)
         self.pair_current_distance_from_target_info = self.pair_target_total_info - self.pair_current_total_info
 
         # calc max total info during simulation per end point and initialise end point total info tracker
         self.max_total_ep_info = self.network_load_config['ep_link_capacity'] * self.duration
         self.max_total_port_info = self.max_total_ep_info / 2 # each end point is split into a src and dst
-        self.ep_total_infos = {ep: 0 for ep in self.eps}
+        self.ep_total_infos = np.zeros(self.num_eps)
 
         # calc max info can put on src and dst ports
-        self.src_total_infos = {ep: 0 for ep in self.eps}
-        self.dst_total_infos = {ep: 0 for ep in self.eps}
-
-        # init mapping of src and dst node ports to each possible pair
-        self.src_port_to_pairs = defaultdict(set)
-        self.dst_port_to_pairs = defaultdict(set)
-        # init mapping of each pair to its string equivalent once at start so do not have to keep making computationally expensive json.loads() for each flow for each pair for each pass
-        self.pair_to_json_loads = {}
-        # init mapping of each pair to its remaining info capacity (the min remaining info capacity of its src-dst)
-        self.pair_to_remaining_capacity = []
-        # init mapping of each pair to its idx for accessing numpy arrays
-        self.pair_to_idx = {}
-        for pair_idx, pair in enumerate(self.pairs):
-            json_loads_pair = json.loads(pair)
-            src, dst = json_loads_pair[0], json_loads_pair[1]
-            self.src_port_to_pairs[src].add(pair)
-            self.dst_port_to_pairs[dst].add(pair)
-            self.pair_to_json_loads[pair] = json_loads_pair
-            self.pair_to_remaining_capacity.append(self.max_total_port_info)
-            self.pair_to_idx[pair] = pair_idx
-        self.pair_to_remaining_capacity = np.array(self.pair_to_remaining_capacity)
+        self.src_total_infos = np.zeros(self.num_eps)
+        self.dst_total_infos = np.zeros(self.num_eps)
+
+        if self.sparse_pairs:
+            # init remaining info capacity of each pair (the min remaining info capacity of its src-dst) as a flat array in pair idx order, along with the CSR adjacency of each end point to the pairs it is the src or dst of
+            self.pair_remaining_capacity_matrix = None
+            self.pair_to_remaining_capacity = np.empty(len(self.pairs), dtype=self.state_dtype)
+            self.src_to_pair_indptr = pair_structures['src_to_pair_indptr']
+            self.dst_to_pair_indptr = pair_structures['dst_to_pair_indptr']
+            self.dst_to_pair_idxs = pair_structures['dst_to_pair_idxs']
+        else:
+            # init matrix of the remaining info capacity of each src (row) - dst (col) pair (the min remaining info capacity of its src-dst)
+            self.pair_remaining_capacity_matrix = np.empty((self.num_eps, self.num_eps), dtype=self.state_dtype)
+            # init mapping of each pair idx to its remaining info capacity as a (num_eps-1, num_eps) view onto the off-diagonal elements of the matrix, which when flattened are in the same order as self.pairs
+            self.pair_to_remaining_capacity = self._get_off_diagonal_view(self.pair_remaining_capacity_matrix)
+        self._update_pair_remaining_capacity()
+
+        # init tracker of the packed info of each pair beyond its share of the total info of all flows to pack, from which the final Jensen Shannon distance can be bounded during packing
+        self.total_flow_info = np.sum(self.flow_sizes)
+        if self.track_packing_progress:
+            self.pair_target_final_info = self._get_target_pair_dist() * self.total_flow_info / self.state_info_unit
+        self.pair_info_overshoot = 0
+        self.num_flows_to_pack = len(self.flow_ids)
+        self.num_packed_flows = 0
+        self.num_packed_flows_at_last_progress_update = 0
+        self._start_packing_progress()
+
+        if self.pair_selector == 'segment_tree':
+            # init priority structure from which to choose the pair furthest from its target for each flow
+            self.segment_tree_pair_selector = SegmentTreePairSelector(pair_keys=self.pair_current_distance_from_target_info + self.pair_target_total_info,
+                                                                      pair_remaining_capacity=self.pair_to_remaining_capacity if self.check_dont_exceed_one_ep_load else None,
+                                                                      dtype=self.state_dtype,
+                                                                      rng=self.rng)
+
+        if self.stats is not None:
+            self.stats.time_phase('reset', reset_start_t)
+        if self.memory_profiler is not None:
+            self.memory_profiler.stop_phase('reset')
 
         if self.print_data:
             print('Duration: {}'.format(self.duration))
@@ -117,17 +377,64 @@ class VectorisedFlowPacker(FlowPacker):
             print('Max total ep info: {}'.format(self.max_total_ep_info))
             print('Sum of all flow sizes: {}'.format(np.sum(self.flow_sizes)))
 
-    def _get_masked_data(self, data, mask):
-        masked_data = np.ma.masked_array(data, mask)
-        return masked_data[masked_data.mask].data
+    def _check_state_dtype_range(self, duration, total_flow_info):
+        if self.state_dtype_is_int:
+            # largest info held in int state is the max of the end point capacity, the max pair key (twice the max pair target) and the packed info of a pair (at most all flows)
+            max_state_info = max(self.network_load_config['ep_link_capacity'] * duration / 2, 2 * np.amax(self.pair_target_load_rate) * duration, total_flow_info) / self.state_info_unit
+            if max_state_info >= np.iinfo(self.state_dtype).max:
+                raise Exception(f'Info values of up to {max_state_info} state info units would overflow state_dtype {self.state_dtype}, increase state_info_unit (currently {self.state_info_unit}) or use a larger state_dtype')
+
+    def _to_state_info(self, info):
+        # convert an array of info to the state dtype
+        if self.state_dtype_is_int:
+            return np.rint(np.divide(info, self.state_info_unit)).astype(self.state_dtype)
+        return np.asarray(info).astype(self.state_dtype, copy=False)
+
+    def _to_state_capacity(self, capacity):
+        # convert an array of remaining capacities to the state dtype, rounding down so that a pair is never a candidate for a flow which would exceed its src and/or dst max load
+        if self.state_dtype_is_int:
+            return np.floor(np.divide(capacity, self.state_info_unit)).astype(self.state_dtype)
+        state_capacity = capacity.astype(self.state_dtype)
+        return np.where(state_capacity > capacity, np.nextafter(state_capacity, -np.inf), state_capacity)
+
+    def _to_state_flow_size(self, flow_size, round_up=False):
+        # convert a flow size to the state dtype, rounding up if checking whether the flow fits into a pair's remaining capacity
+        if self.state_dtype_is_int:
+            return self.state_dtype.type(math.ceil(flow_size / self.state_info_unit) if round_up else round(flow_size / self.state_info_unit))
+        state_flow_size = self.state_dtype.type(flow_size)
+        if round_up and state_flow_size < flow_size:
+            state_flow_size = np.nextafter(state_flow_size, self.state_dtype.type(np.inf))
+        return state_flow_size
+
+    def _update_pair_remaining_capacity(self):
+        # update src-dst info of all pairs
+        if self.sparse_pairs:
+            pair_remaining_capacity = np.minimum(self.max_total_port_info - self.src_total_infos[self.pair_src_idxs], self.max_total_port_info - self.dst_total_infos[self.pair_dst_idxs])
+            self.pair_to_remaining_capacity[:] = self._to_state_capacity(pair_remaining_capacity) if self.compact_state else pair_remaining_capacity
+        elif self.compact_state:
+            self.pair_remaining_capacity_matrix[:] = self._to_state_capacity(np.minimum((self.max_total_port_info - self.src_total_infos)[:, None], (self.max_total_port_info - self.dst_total_infos)[None, :]))
+        else:
+            np.minimum((self.max_total_port_info - self.src_total_infos)[:, None], (self.max_total_port_info - self.dst_total_infos)[None, :], out=self.pair_remaining_capacity_matrix)
+
+    def _get_duration(self, flow_interarrival_times):
+        # reduce over chunks of the interarrival times rather than generating all event times
+        duration = out_of_core.get_event_time_span(flow_interarrival_times, chunk_size=self.out_of_core_chunk_size)
+        if duration == 0:
+            # set to some number to prevent infinities
+            duration = 1e6
+        return duration
 
-    def _check_if_flow_pair_within_max_load(self, flow, pair):
+    def _get_off_diagonal_view(self, matrix):
+        # dropping the first element of a flattened NxN matrix leaves the diagonal elements at the end of each row of length N+1
+        num_eps = matrix.shape[0]
+        return matrix.reshape(-1)[1:].reshape(num_eps - 1, num_eps + 1)[:, :-1]
+
+    def _check_if_flow_pair_within_max_load(self, flow_size, pair_idx):
         within_load = False
-        json_loads_pair = self.pair_to_json_loads[pair]
-        src, dst = json_loads_pair[0], json_loads_pair[1]
+        src, dst = self.pair_src_idxs[pair_idx], self.pair_dst_idxs[pair_idx]
         if self.check_dont_exceed_one_ep_load:
             # ensure wont exceed 1.0 end point load by allocating this flow to pair
-            if self.src_total_infos[src] + self.packed_flows[flow]['size'] > self.max_total_port_info or self.dst_total_infos[dst] + self.packed_flows[flow]['size'] > self.max_total_port_info:
+            if self.src_total_infos[src] + flow_size > self.max_total_port_info or self.dst_total_infos[dst] + flow_size > self.max_total_port_info:
                 # would exceed at least 1 of this pair's end point's maximum load by adding this flow, move to next pair
                 pass
             else:
@@ -137,57 +444,517 @@ class VectorisedFlowPacker(FlowPacker):
             within_load = True
         return within_load
         
-    def _pack_flow_into_chosen_pair(self, flow, chosen_pair):
-        # pack flow into this pair
-        self.pair_current_total_info[self.pair_to_idx[chosen_pair]] = self.pair_current_total_info[self.pair_to_idx[chosen_pair]] + (self.packed_flows[flow]['size'])
-        self.pair_current_distance_from_target_info[self.pair_to_idx[chosen_pair]] = self.pair_current_distance_from_target_info[self.pair_to_idx[chosen_pair]] - (self.packed_flows[flow]['size'])
+    def _pack_flow_into_chosen_pair(self, flow_size, chosen_pair_idx):
+        state_flow_size = self._to_state_flow_size(flow_size) if self.compact_state else flow_size
+
+        if self.track_pair_info_overshoot:
+            # only the chosen pair's overshoot can change
+            self.pair_info_overshoot += max(self.pair_current_total_info[chosen_pair_idx] + state_flow_size - self.pair_target_final_info[chosen_pair_idx], 0) - max(self.pair_current_total_info[chosen_pair_idx] - self.pair_target_final_info[chosen_pair_idx], 0)
 
-        # updated packed flows dict
-        json_loads_pair = self.pair_to_json_loads[chosen_pair]
-        chosen_src, chosen_dst = json_loads_pair[0], json_loads_pair[1]
-        self.packed_flows[flow]['src'], self.packed_flows[flow]['dst'] = chosen_src, chosen_dst 
+        # pack flow into this pair
+        self.pair_current_total_info[chosen_pair_idx] = self.pair_current_total_info[chosen_pair_idx] + state_flow_size
+        self.pair_current_distance_from_target_info[chosen_pair_idx] = self.pair_current_distance_from_target_info[chosen_pair_idx] - state_flow_size
+        if self.pair_selector == 'segment_tree':
+            self.segment_tree_pair_selector.update(chosen_pair_idx, self.pair_current_distance_from_target_info[chosen_pair_idx] + self.pair_target_total_info[chosen_pair_idx])
 
         # update end point and src-dst port info of chosen pair
-        self.ep_total_infos[chosen_src] += self.packed_flows[flow]['size']
-        self.ep_total_infos[chosen_dst] += self.packed_flows[flow]['size']
-        self.src_total_infos[chosen_src] += self.packed_flows[flow]['size']
-        self.dst_total_infos[chosen_dst] += self.packed_flows[flow]['size']
+        chosen_src, chosen_dst = self.pair_src_idxs[chosen_pair_idx], self.pair_dst_idxs[chosen_pair_idx]
+        self.ep_total_infos[chosen_src] += flow_size
+        self.ep_total_infos[chosen_dst] += flow_size
+        self.src_total_infos[chosen_src] += flow_size
+        self.dst_total_infos[chosen_dst] += flow_size
 
         # update src-dst info of any other pairs associated with this chosen pair's src and dst
-        for pair in self.src_port_to_pairs[chosen_src]:
-            json_loads_pair = self.pair_to_json_loads[pair]
-            dst = json_loads_pair[1]
-            self.pair_to_remaining_capacity[self.pair_to_idx[pair]] = min(self.max_total_port_info - self.src_total_infos[chosen_src], self.max_total_port_info - self.dst_total_infos[dst])
-        for pair in self.dst_port_to_pairs[chosen_dst]:
-            json_loads_pair = self.pair_to_json_loads[pair]
-            src = json_loads_pair[0]
-            self.pair_to_remaining_capacity[self.pair_to_idx[pair]] = min(self.max_total_port_info - self.src_total_infos[src], self.max_total_port_info - self.dst_total_infos[chosen_dst])
+        if self.sparse_pairs:
+            # pairs of the chosen src are a contiguous run of pairs since pairs are in src-major order, pairs of the chosen dst are looked up through the CSR dst to pair adjacency
+            src_pair_idxs = slice(self.src_to_pair_indptr[chosen_src], self.src_to_pair_indptr[chosen_src+1])
+            dst_pair_idxs = self.dst_to_pair_idxs[self.dst_to_pair_indptr[chosen_dst]:self.dst_to_pair_indptr[chosen_dst+1]]
+            src_pair_remaining_capacity = np.minimum(self.max_total_port_info - self.src_total_infos[chosen_src], self.max_total_port_info - self.dst_total_infos[self.pair_dst_idxs[src_pair_idxs]])
+            dst_pair_remaining_capacity = np.minimum(self.max_total_port_info - self.src_total_infos[self.pair_src_idxs[dst_pair_idxs]], self.max_total_port_info - self.dst_total_infos[chosen_dst])
+            self.pair_to_remaining_capacity[src_pair_idxs] = self._to_state_capacity(src_pair_remaining_capacity) if self.compact_state else src_pair_remaining_capacity
+            self.pair_to_remaining_capacity[dst_pair_idxs] = self._to_state_capacity(dst_pair_remaining_capacity) if self.compact_state else dst_pair_remaining_capacity
+        elif self.compact_state:
+            # broadcast over the chosen src's row and chosen dst's column of the remaining capacity matrix
+            self.pair_remaining_capacity_matrix[chosen_src] = self._to_state_capacity(np.minimum(self.max_total_port_info - self.src_total_infos[chosen_src], self.max_total_port_info - self.dst_total_infos))
+            self.pair_remaining_capacity_matrix[:, chosen_dst] = self._to_state_capacity(np.minimum(self.max_total_port_info - self.src_total_infos, self.max_total_port_info - self.dst_total_infos[chosen_dst]))
+        else:
+            # broadcast over the chosen src's row and chosen dst's column of the remaining capacity matrix
+            np.minimum(self.max_total_port_info - self.src_total_infos[chosen_src], self.max_total_port_info - self.dst_total_infos, out=self.pair_remaining_capacity_matrix[chosen_src])
+            self.pair_remaining_capacity_matrix[:, chosen_dst] = np.minimum(self.max_total_port_info - self.src_total_infos, self.max_total_port_info - self.dst_total_infos[chosen_dst])
 
     def _shuffle_packed_flows(self):
-        shuffled_packed_flows = {}
-        shuffled_keys = list(self.packed_flows.keys())
-        random.shuffle(shuffled_keys)
-        for shuffled_key in shuffled_keys:
-            shuffled_packed_flows[shuffled_key] = self.packed_flows[shuffled_key]
-        return shuffled_packed_flows
+        # apply a single permutation to the packed flow arrays rather than shuffling the flow ids and re-inserting each flow into a new dict
+        if self._use_out_of_core(len(self.packed_flows)):
+            return self.packed_flows.permute(self.rng.permutation(len(self.packed_flows)), out_dir=self._get_out_of_core_array_dir(), chunk_size=self.out_of_core_chunk_size)
+        return self.packed_flows.permute(self.rng.permutation(len(self.packed_flows)))
+
+    def _choose_pair(self, flow_size, flow_id=None):
+        # size to check against (rounded down) remaining pair capacities
+        capacity_flow_size = self._to_state_flow_size(flow_size, round_up=True) if self.compact_state else flow_size
+
+        if self.stats is not None:
+            start_t = time.perf_counter()
+
+        if self.pair_selector == 'segment_tree':
+            if self.stats is not None:
+                num_parked_pairs = self.segment_tree_pair_selector.num_parked_pairs
+            chosen_pair_idx = self.segment_tree_pair_selector.choose(capacity_flow_size)
+            if chosen_pair_idx is None:
+                raise Exception(f'ERROR: Flow {flow_id} with size {flow_size} cannot be packed into any pair without exceeding max_total_port_info ({self.max_total_port_info})')
+            if self.stats is not None:
+                self.stats.time_phase('argmax_tie_break', start_t)
+                self.stats.num_infeasible_candidates += self.segment_tree_pair_selector.num_parked_pairs - num_parked_pairs
+            return chosen_pair_idx
 
-    def _choose_pair(self, flow):
         if self.check_dont_exceed_one_ep_load:
             # mask out pairs whose src and/or dst would exceed 1.0 load rate were they to be allocated this flow
-            pairs_mask = np.where(self.pair_to_remaining_capacity - self.packed_flows[flow]['size'] < 0, 0, 1)
-            candidate_pairs = self._get_masked_data(data=self.pairs, mask=pairs_mask)
+            pairs_mask = (self.pair_to_remaining_capacity >= capacity_flow_size).reshape(-1)
+            candidate_pair_idxs = np.flatnonzero(pairs_mask)
+            if self.stats is not None:
+                start_t = self.stats.time_phase('candidate_masking', start_t)
+                self.stats.num_infeasible_candidates += len(self.pairs) - len(candidate_pair_idxs)
+            if len(candidate_pair_idxs) == 0:
+                raise Exception(f'ERROR: Flow {flow_id} with size {flow_size} cannot be packed into any pair without exceeding max_total_port_info ({self.max_total_port_info})')
             # get the candidate pair distances adjusted for their total target information, as this will determine packing priority to accurately reproduce the distribution. Need to shift this by the target total info to retain the target dist shape rather than converge to uniform as soon as reach target on a given end point
-            adjusted_candidate_pair_distances = self._get_masked_data(data=self.pair_current_distance_from_target_info + self.pair_target_total_info, mask=pairs_mask)
+            adjusted_candidate_pair_distances = (self.pair_current_distance_from_target_info + self.pair_target_total_info)[pairs_mask]
         else:
             # no need to worry about exceeding 1.0 load rate
-            candidate_pairs = self.pairs
+            candidate_pair_idxs = self.pair_idxs
             adjusted_candidate_pair_distances = self.pair_current_distance_from_target_info + self.pair_target_total_info
 
         # find the indices of the valid pairs which are furthest from their target load and therefore should have a flow packed into them
         max_indices = np.argwhere(adjusted_candidate_pair_distances == np.amax(adjusted_candidate_pair_distances)).flatten()
 
         # randomly select a pair to avoid fade phenomenon in the resultant node dist
-        return candidate_pairs[np.random.choice(max_indices)]
+        chosen_pair_idx = candidate_pair_idxs[self.rng.choice(max_indices)]
+        if self.stats is not None:
+            self.stats.time_phase('argmax_tie_break', start_t)
+        return chosen_pair_idx
+
+    def _get_size_class_pair_counts(self, flow_size, num_flows):
+        # get the max number of flows of this size each pair can take without exceeding its src and/or dst max load
+        if self.check_dont_exceed_one_ep_load:
+            pair_remaining_capacity = self.pair_to_remaining_capacity.reshape(-1)
+            max_pair_counts = np.floor(pair_remaining_capacity / flow_size)
+            max_pair_counts -= max_pair_counts * flow_size > pair_remaining_capacity
+        else:
+            max_pair_counts = np.full(len(self.pairs), np.inf)
+
+        if np.sum(max_pair_counts) <= num_flows:
+            # can fill every pair up to its capacity
+            pair_counts = max_pair_counts.astype(np.int64)
+        else:
+            # packing flows of equal size one at a time into the pair with the max adjusted distance is equivalent to taking the num_flows largest values of {key - j*flow_size for j in range(max_pair_count)} across all pairs -> find the threshold key above which num_flows values are taken by bisection
+            pair_keys = self.pair_current_distance_from_target_info + self.pair_target_total_info
+            def get_pair_counts(threshold):
+                return np.clip(np.floor((pair_keys - threshold) / flow_size) + 1, 0, max_pair_counts)
+            hi = np.amax(pair_keys) + flow_size
+            lo = np.amin(pair_keys[max_pair_counts > 0]) - (num_flows * flow_size)
+            for _ in range(100):
+                mid = (lo + hi) / 2
+                if mid == lo or mid == hi:
+                    break
+                if np.sum(get_pair_counts(mid)) >= num_flows:
+                    lo = mid
+                else:
+                    hi = mid
+            pair_counts = get_pair_counts(hi).astype(np.int64)
+
+            # the remaining flows go to values between the two thresholds, which are tied up to float precision -> randomly select between them
+            boundary_pair_counts = get_pair_counts(lo).astype(np.int64) - pair_counts
+            boundary_pair_idxs = np.repeat(self.pair_idxs, boundary_pair_counts)
+            pair_counts += np.bincount(self.rng.choice(boundary_pair_idxs, size=num_flows-np.sum(pair_counts), replace=False), minlength=len(self.pairs))
+
+        if self.check_dont_exceed_one_ep_load:
+            # pair counts do not account for pairs sharing a src or dst end point -> find any end points which would exceed their max load
+            src_max_counts, dst_max_counts = np.floor((self.max_total_port_info - self.src_total_infos) / flow_size), np.floor((self.max_total_port_info - self.dst_total_infos) / flow_size)
+            src_max_counts -= self.src_total_infos + (src_max_counts * flow_size) > self.max_total_port_info
+            dst_max_counts -= self.dst_total_infos + (dst_max_counts * flow_size) > self.max_total_port_info
+            src_counts, dst_counts = np.bincount(self.pair_src_idxs, weights=pair_counts, minlength=self.num_eps), np.bincount(self.pair_dst_idxs, weights=pair_counts, minlength=self.num_eps)
+            is_constrained_pair = ((src_counts > src_max_counts)[self.pair_src_idxs] | (dst_counts > dst_max_counts)[self.pair_dst_idxs]) & (pair_counts > 0)
+            if np.any(is_constrained_pair):
+                # pairs of end points which are not over their max load keep their counts
+                constrained_pair_idxs = np.flatnonzero(is_constrained_pair)
+                unconstrained_pair_counts = np.where(is_constrained_pair, 0, pair_counts)
+                src_remaining_counts = (src_max_counts - np.bincount(self.pair_src_idxs, weights=unconstrained_pair_counts, minlength=self.num_eps)).astype(np.int64).tolist()
+                dst_remaining_counts = (dst_max_counts - np.bincount(self.pair_dst_idxs, weights=unconstrained_pair_counts, minlength=self.num_eps)).astype(np.int64).tolist()
+
+                # fill the remaining capacity of the over loaded end points in order of the pairs furthest from their target (randomly breaking ties)
+                constrained_pair_keys = self.pair_current_distance_from_target_info[constrained_pair_idxs] + self.pair_target_total_info[constrained_pair_idxs]
+                constrained_pair_idxs = constrained_pair_idxs[np.lexsort((self.rng.random(len(constrained_pair_idxs)), -constrained_pair_keys))]
+                for pair_idx, src, dst, count in zip(constrained_pair_idxs.tolist(), self.pair_src_idxs[constrained_pair_idxs].tolist(), self.pair_dst_idxs[constrained_pair_idxs].tolist(), pair_counts[constrained_pair_idxs].tolist()):
+                    count = min(count, src_remaining_counts[src], dst_remaining_counts[dst])
+                    unconstrained_pair_counts[pair_idx] = count
+                    src_remaining_counts[src] -= count
+                    dst_remaining_counts[dst] -= count
+                pair_counts = unconstrained_pair_counts
+
+        return pair_counts
+
+    def _pack_size_class_into_pairs(self, flow_size, pair_counts):
+        pair_infos = pair_counts * flow_size
+
+        # pack flows into pairs
+        self.pair_current_total_info += pair_infos
+        self.pair_current_distance_from_target_info -= pair_infos
+        if self.pair_selector == 'segment_tree':
+            for pair_idx in np.flatnonzero(pair_counts):
+                self.segment_tree_pair_selector.update(pair_idx, self.pair_current_distance_from_target_info[pair_idx] + self.pair_target_total_info[pair_idx])
+
+        # update end point and src-dst port info of chosen pairs
+        src_infos, dst_infos = np.bincount(self.pair_src_idxs, weights=pair_infos, minlength=self.num_eps), np.bincount(self.pair_dst_idxs, weights=pair_infos, minlength=self.num_eps)
+        self.ep_total_infos += src_infos + dst_infos
+        self.src_total_infos += src_infos
+        self.dst_total_infos += dst_infos
+
+        # update src-dst info of all pairs
+        self._update_pair_remaining_capacity()
+
+        if self.track_pair_info_overshoot:
+            self._recompute_pair_info_overshoot()
+
+    def _pack_flow_sizes_with_numba_kernel(self, flow_sizes, flow_ids):
+        flow_pair_idxs = kernels.get_numba_pack_flows_kernel()(np.ascontiguousarray(flow_sizes, dtype=np.float64),
+                                                               np.ascontiguousarray(self.pair_src_idxs),
+                                                               np.ascontiguousarray(self.pair_dst_idxs),
+                                                               self.pair_target_total_info,
+                                                               self.pair_current_total_info,
+                                                               self.pair_current_distance_from_target_info,
+                                                               self.src_total_infos,
+                                                               self.dst_total_infos,
+                                                               self.ep_total_infos,
+                                                               np.full(self.num_eps, self.max_total_port_info),
+                                                               np.full(self.num_eps, self.max_total_port_info),
+                                                               bool(self.check_dont_exceed_one_ep_load),
+                                                               self.rng.integers(2**31 - 1))
+
+        # update src-dst info of all pairs
+        self._update_pair_remaining_capacity()
+
+        unpacked_flow_idxs = np.flatnonzero(flow_pair_idxs == -1)
+        if len(unpacked_flow_idxs) > 0:
+            raise Exception(f'ERROR: Flow {flow_ids[unpacked_flow_idxs[0]]} with size {flow_sizes[unpacked_flow_idxs[0]]} cannot be packed into any pair without exceeding max_total_port_info ({self.max_total_port_info})')
+
+        return flow_pair_idxs
+
+    def _get_rack_shards(self):
+        # map each end point to the idx of its rack
+        ep_to_rack_idx = np.full(self.num_eps, -1, dtype=np.int64)
+        for rack_idx, rack_eps in enumerate(self.racks_dict.values()):
+            ep_to_rack_idx[[self.ep_to_idx[ep] for ep in rack_eps]] = rack_idx
+        if np.any(ep_to_rack_idx == -1):
+            raise Exception(f'End point(s) {self.idx_to_ep[ep_to_rack_idx == -1].tolist()} are not in any rack of racks_dict')
+        num_racks = len(self.racks_dict)
+
+        # split pair space into rack-pair blocks, each of which is a shard (only keep blocks with pairs to pack)
+        pair_shard_idxs = (ep_to_rack_idx[self.pair_src_idxs] * num_racks) + ep_to_rack_idx[self.pair_dst_idxs]
+        shards, shard_pair_idxs = np.unique(pair_shard_idxs, return_inverse=True)
+        pair_order = np.argsort(shard_pair_idxs, kind='stable')
+        shard_to_pair_idxs = np.split(pair_order, np.cumsum(np.bincount(shard_pair_idxs, minlength=len(shards)))[:-1])
+
+        return shard_pair_idxs, shard_to_pair_idxs
+
+    def _pack_flow_sizes_sharded_by_rack(self, flow_sizes, flow_ids):
+        shard_pair_idxs, shard_to_pair_idxs = self._get_rack_shards()
+        num_shards = len(shard_to_pair_idxs)
+
+        # allocate flows to shards by each shard's share of the target load. Flows are assigned in a random order to contiguous segments of the cumulative flow info, with each shard's segment proportional to its target share, so each shard gets a random sample of flow sizes
+        shard_target_total_info = np.bincount(shard_pair_idxs, weights=self.pair_target_total_info, minlength=num_shards)
+        shard_info_bounds = np.cumsum(shard_target_total_info / np.sum(shard_target_total_info)) * np.sum(flow_sizes)
+        flow_order = self.rng.permutation(len(flow_sizes))
+        flow_info_midpoints = np.cumsum(flow_sizes[flow_order]) - (flow_sizes[flow_order] / 2)
+        flow_shard_idxs = np.empty(len(flow_sizes), dtype=np.int64)
+        flow_shard_idxs[flow_order] = np.minimum(np.searchsorted(shard_info_bounds, flow_info_midpoints, side='right'), num_shards - 1)
+
+        # split each end point's remaining src and dst port info capacity between the shards it is in by its share of target info in each shard
+        shard_src_max_infos, shard_dst_max_infos = np.zeros((num_shards, self.num_eps)), np.zeros((num_shards, self.num_eps))
+        np.add.at(shard_src_max_infos, (shard_pair_idxs, self.pair_src_idxs), self.pair_target_total_info)
+        np.add.at(shard_dst_max_infos, (shard_pair_idxs, self.pair_dst_idxs), self.pair_target_total_info)
+        shard_src_max_infos = (self.max_total_port_info - self.src_total_infos) * (shard_src_max_infos / np.maximum(np.sum(shard_src_max_infos, axis=0), self.machine_eps))
+        shard_dst_max_infos = (self.max_total_port_info - self.dst_total_infos) * (shard_dst_max_infos / np.maximum(np.sum(shard_dst_max_infos, axis=0), self.machine_eps))
+
+        # pack each shard in a separate process
+        shard_to_flow_idxs = [np.flatnonzero(flow_shard_idxs == shard_idx) for shard_idx in range(num_shards)]
+        shards = [{'backend': self.backend,
+                   'flow_sizes': np.ascontiguousarray(flow_sizes[shard_to_flow_idxs[shard_idx]], dtype=np.float64),
+                   'pair_src_idxs': self.pair_src_idxs[shard_to_pair_idxs[shard_idx]],
+                   'pair_dst_idxs': self.pair_dst_idxs[shard_to_pair_idxs[shard_idx]],
+                   'pair_target_total_info': self.pair_target_total_info[shard_to_pair_idxs[shard_idx]],
+                   'pair_current_total_info': self.pair_current_total_info[shard_to_pair_idxs[shard_idx]],
+                   'pair_current_distance_from_target_info': self.pair_current_distance_from_target_info[shard_to_pair_idxs[shard_idx]],
+                   'src_max_infos': shard_src_max_infos[shard_idx],
+                   'dst_max_infos': shard_dst_max_infos[shard_idx],
+                   'num_eps': self.num_eps,
+                   'check_dont_exceed_one_ep_load': bool(self.check_dont_exceed_one_ep_load),
+                   'seed': self.rng.integers(2**31 - 1)}
+                  for shard_idx in range(num_shards)]
+        packed_shards = process_map(_pack_shard, shards, max_workers=self.num_workers, chunksize=1, desc='Packing shards', leave=False, disable=not self.print_data)
+
+        # merge the packed shards
+        flow_pair_idxs = np.full(len(flow_sizes), -1, dtype=np.int64)
+        for shard_idx, packed_shard in enumerate(packed_shards):
+            pair_idxs, flow_idxs = shard_to_pair_idxs[shard_idx], shard_to_flow_idxs[shard_idx]
+            self.pair_current_total_info[pair_idxs] = packed_shard['pair_current_total_info']
+            self.pair_current_distance_from_target_info[pair_idxs] = packed_shard['pair_current_distance_from_target_info']
+            self.src_total_infos += packed_shard['src_total_infos']
+            self.dst_total_infos += packed_shard['dst_total_infos']
+            self.ep_total_infos += packed_shard['ep_total_infos']
+            is_packed = packed_shard['flow_pair_idxs'] != -1
+            flow_pair_idxs[flow_idxs[is_packed]] = pair_idxs[packed_shard['flow_pair_idxs'][is_packed]]
+
+        # reconcile end point capacity across shards by packing any flows which did not fit into their shard's share of end point capacity into the global pair space
+        self._update_pair_remaining_capacity()
+        if self.track_pair_info_overshoot:
+            self._recompute_pair_info_overshoot()
+        for flow_idx in np.flatnonzero(flow_pair_idxs == -1):
+            flow_pair_idxs[flow_idx] = self._choose_pair(flow_sizes[flow_idx], flow_id=flow_ids[flow_idx])
+            self._pack_flow_into_chosen_pair(flow_sizes[flow_idx], flow_pair_idxs[flow_idx])
+
+        return flow_pair_idxs
+
+    def _pack_flow_size_classes(self, flow_sizes, flow_ids):
+        # find runs of equal size in the (descending) flow sizes
+        run_starts = np.concatenate([[0], np.flatnonzero(np.diff(flow_sizes)) + 1])
+        run_counts = np.diff(np.concatenate([run_starts, [len(flow_sizes)]]))
+
+        sizes, pair_idxs, counts = [], [], []
+        for run_start, run_count in zip(run_starts, run_counts):
+            flow_size = flow_sizes[run_start]
+            run_pair_counts = np.zeros(len(self.pairs), dtype=np.int64)
+            num_packed = 0
+            while num_packed < run_count:
+                pair_counts = self._get_size_class_pair_counts(flow_size, run_count - num_packed)
+                if np.sum(pair_counts) == 0:
+                    # pack a single flow of this run into a pair
+                    pair_counts = np.bincount([self._choose_pair(flow_size, flow_id=flow_ids[run_start + num_packed])], minlength=len(self.pairs))
+                self._pack_size_class_into_pairs(flow_size, pair_counts)
+                run_pair_counts += pair_counts
+                num_packed += int(np.sum(pair_counts))
+                if self.track_packing_progress:
+                    self._update_packing_progress(self.num_packed_flows + int(run_start) + num_packed)
+
+            # record the pairs this run was packed into
+            run_pair_idxs = np.flatnonzero(run_pair_counts)
+            sizes.append(np.full(len(run_pair_idxs), flow_size))
+            pair_idxs.append(run_pair_idxs)
+            counts.append(run_pair_counts[run_pair_idxs])
+
+        return np.concatenate(sizes), np.concatenate(pair_idxs), np.concatenate(counts)
+
+    def _use_out_of_core(self, num_flows):
+        return self.out_of_core_dir is not None and num_flows > self.out_of_core_chunk_size
+
+    def _get_out_of_core_array_dir(self):
+        if self.out_of_core_array_dir is None:
+            self.out_of_core_array_dir = tempfile.mkdtemp(prefix='vectorised_flow_packer_', dir=self.out_of_core_dir)
+        return self.out_of_core_array_dir
+
+    def _get_out_of_core_path(self, name):
+        # arrays may be written more than once (e.g. once per pack_more_flows() call) so give each file a unique name
+        fd, path = tempfile.mkstemp(prefix=f'{name}_', suffix='.npy', dir=self._get_out_of_core_array_dir())
+        os.close(fd)
+        return path
+
+    def _empty_flow_array(self, num_flows, dtype, name):
+        if self._use_out_of_core(num_flows):
+            return np.lib.format.open_memmap(self._get_out_of_core_path(name), mode='w+', dtype=dtype, shape=(num_flows,))
+        return np.empty(num_flows, dtype=dtype)
+
+    def _take_flow_array(self, array, flow_pair_idxs, name):
+        # equivalent to array[flow_pair_idxs], but written chunk by chunk to an out of core array if there are many flows
+        if not self._use_out_of_core(len(flow_pair_idxs)):
+            return array[flow_pair_idxs]
+        flow_array = self._empty_flow_array(len(flow_pair_idxs), array.dtype, name)
+        for chunk_start in range(0, len(flow_pair_idxs), self.out_of_core_chunk_size):
+            np.take(array, flow_pair_idxs[chunk_start:chunk_start+self.out_of_core_chunk_size], out=flow_array[chunk_start:chunk_start+self.out_of_core_chunk_size])
+        return flow_array
+
+    def _sort_flows_by_size(self):
+        # want to pack largest flows first -> re-organise flows into descending order (will shuffle later so maintain random flow sizes of arrivals)
+        if out_of_core.is_sorted_descending(self.flow_sizes, chunk_size=self.out_of_core_chunk_size):
+            # already in descending order (e.g. sorted by caller or by a previous pack) so no need to sort or copy
+            return
+        if self.flow_sizes.flags.writeable and not isinstance(self.flow_sizes, np.memmap):
+            self.flow_sizes[::-1].sort()
+        elif self._use_out_of_core(len(self.flow_sizes)):
+            # flow sizes are a read-only or file-backed view which may not fit in memory, sort into a new file-backed array
+            self.flow_sizes = out_of_core.external_sort_descending(self.flow_sizes, self._get_out_of_core_path('flow_sizes'), chunk_size=self.out_of_core_chunk_size)
+        else:
+            # flow sizes are a read-only (e.g. shared memory) or file-backed view, copy on write rather than modifying the caller's data
+            self.flow_sizes = np.sort(self.flow_sizes)[::-1]
+
+    def pack_the_size_classes(self):
+        '''
+        Packs the flows by size class rather than one flow at a time.
+
+        The (descending) flow sizes are grouped into runs of equal size, and
+        each run is packed in a single step by computing how many flows of
+        that size each pair should take under the same furthest-from-target
+        rule used to pack individual flows. This is equivalent to packing the
+        flows of the run one at a time (up to random tie-breaking) unless
+        packing the run would exceed the max load of an end point shared by
+        several pairs, in which case the counts of that end point's pairs are
+        scaled down and the rest of the run is re-allocated in further steps.
+        If a step cannot pack any flows, a single flow is packed with
+        the per-flow rule so that packing always progresses.
+
+        Returns a PackedSizeClasses of (size, pair, count) entries, which can be
+        expanded into flow-level src-dst pairs with PackedSizeClasses.expand().
+        '''
+        self._sort_flows_by_size()
+        self._start_packing_progress()
+        if self.stats is not None:
+            start_t = time.perf_counter()
+        sizes, pair_idxs, counts = self._pack_flow_size_classes(self.flow_sizes, self.flow_ids)
+        self.num_packed_flows += len(self.flow_sizes)
+        if self.stats is not None:
+            self.stats.time_phase('pack_loop', start_t)
+            self.stats.num_flows_packed += len(self.flow_sizes)
+
+        self.packed_size_classes = PackedSizeClasses(sizes=sizes,
+                                                     src_idxs=self.pair_src_idxs[pair_idxs],
+                                                     dst_idxs=self.pair_dst_idxs[pair_idxs],
+                                                     counts=counts,
+                                                     eps=self.idx_to_ep)
+
+        return self.packed_size_classes
+
+    def _pack_flow_sizes(self, flow_sizes, flow_ids):
+        # packs the (descending) flow sizes into src-dst pairs, updating the pair and end point info trackers, and returns the idx of the pair each flow was packed into
+        if self.stats is not None:
+            pack_loop_start_t = time.perf_counter()
+
+        if self.pack_size_classes:
+            # pack runs of equal size flows together then expand into flow-level pairs
+            _, pair_idxs, counts = self._pack_flow_size_classes(flow_sizes, flow_ids)
+            flow_pair_idxs = np.repeat(pair_idxs, counts)
+        elif self.racks_dict is not None:
+            # pack rack-pair shards of the pair space in parallel
+            flow_pair_idxs = self._pack_flow_sizes_sharded_by_rack(flow_sizes, flow_ids)
+        elif self.backend == 'numba':
+            # run the whole per-flow packing loop as a single compiled kernel (with one kernel call per progress update if tracking packing progress)
+            kernel_chunk_size = self.progress_callback_freq if self.track_packing_progress else max(len(flow_sizes), 1)
+            flow_pair_idxs = self._empty_flow_array(len(flow_sizes), np.int64, 'flow_pair_idxs')
+            for chunk_start in range(0, len(flow_sizes), kernel_chunk_size):
+                chunk_end = min(chunk_start + kernel_chunk_size, len(flow_sizes))
+                flow_pair_idxs[chunk_start:chunk_end] = self._pack_flow_sizes_with_numba_kernel(flow_sizes[chunk_start:chunk_end], flow_ids[chunk_start:chunk_end])
+                if self.track_pair_info_overshoot:
+                    self._recompute_pair_info_overshoot()
+                if self.track_packing_progress:
+                    self._update_packing_progress(self.num_packed_flows + chunk_end)
+        else:
+            # pack each flow into a src-dst pair
+            flow_pair_idxs = self._empty_flow_array(len(flow_sizes), np.int64, 'flow_pair_idxs')
+            # only call into the progress update every progress_callback_freq flows (or every flow if also throttling by time), since the last progress update was forced at the end of the previous call
+            progress_check_freq = 1 if self.progress_callback_interval is not None else self.progress_callback_freq
+            for flow_idx, flow_size in enumerate(flow_sizes):
+
+                # choose a src-dst pair to pack this flow into
+                chosen_pair_idx = self._choose_pair(flow_size, flow_id=flow_ids[flow_idx])
+
+                if self.check_dont_exceed_one_ep_load:
+                    if not self._check_if_flow_pair_within_max_load(flow_size, chosen_pair_idx):
+                        chosen_src, chosen_dst = self.pair_src_idxs[chosen_pair_idx], self.pair_dst_idxs[chosen_pair_idx]
+                        raise Exception(f'ERROR: Flow {flow_ids[flow_idx]} with size {flow_size} has been allocated to chosen_pair {[self.idx_to_ep[chosen_src], self.idx_to_ep[chosen_dst]]} which has src total info ({self.src_total_infos[chosen_src]}) and/or dst total info ({self.dst_total_infos[chosen_dst]}) + flow size > max_total_port_info ({self.max_total_port_info}) (pair_current_distance_from_target_info: {self.pair_current_distance_from_target_info[chosen_pair_idx]} | pair_to_remaining_capacity: {self.pair_to_remaining_capacity.flat[chosen_pair_idx]})')
+
+                # pack flow into the chosen src-dst pair
+                if self.stats is not None:
+                    start_t = time.perf_counter()
+                self._pack_flow_into_chosen_pair(flow_size, chosen_pair_idx)
+                flow_pair_idxs[flow_idx] = chosen_pair_idx
+                if self.stats is not None:
+                    self.stats.time_phase('capacity_update', start_t)
+                if self.track_packing_progress and (flow_idx + 1) % progress_check_freq == 0:
+                    self._update_packing_progress(self.num_packed_flows + flow_idx + 1)
+
+        self.num_packed_flows += len(flow_sizes)
+        if self.track_packing_progress:
+            self._update_packing_progress(self.num_packed_flows, force=True)
+
+        if self.stats is not None:
+            self.stats.time_phase('pack_loop', pack_loop_start_t)
+            self.stats.num_flows_packed += len(flow_sizes)
+
+        return flow_pair_idxs
+
+    def _get_target_pair_dist(self):
+        if np.sum(self.pair_probs) - self.machine_eps <= 0.5:
+            return self.pair_probs * 2 # sum to 1.0 (previously summed to 0.5 since allocated twice for src-dst and dst-src)
+        else:
+            return self.pair_probs
+
+    def _compute_packing_jensen_shannon_distance(self):
+        if self.stats is not None:
+            start_t = time.perf_counter()
+        achieved_pair_load = self.pair_current_total_info / self.duration
+        achieved_pair_dist = achieved_pair_load / np.sum(achieved_pair_load)
+        jensen_shannon_distance = tools.compute_jensen_shannon_distance(self._get_target_pair_dist(), achieved_pair_dist)
+        if self.stats is not None:
+            self.stats.time_phase('jensen_shannon_distance', start_t)
+        return jensen_shannon_distance
+
+    def _recompute_pair_info_overshoot(self):
+        self.pair_info_overshoot = np.sum(np.maximum(self.pair_current_total_info - self.pair_target_final_info, 0))
+
+    def _get_jensen_shannon_distance_lower_bound(self):
+        '''
+        Since a pair's packed info only ever increases, any info packed into
+        a pair beyond its target share of the total info of all flows
+        (pair_info_overshoot, which is updated in O(1) per packed flow if
+        checking the Jensen Shannon distance threshold) will still be there
+        once all flows are packed. Normalised by the total flow info this is
+        a lower bound on the total variation distance d of the final achieved
+        pair dist from the target pair dist, and by Pinsker's inequality the
+        Jensen Shannon distance is >= d / sqrt(2).
+        '''
+        if not self.track_pair_info_overshoot:
+            self._recompute_pair_info_overshoot()
+        return self.pair_info_overshoot * self.state_info_unit / self.total_flow_info / math.sqrt(2)
+
+    def _compute_max_pair_deviation(self):
+        # max absolute difference between a pair's share of the info packed so far and its target share
+        pair_current_total_info = self.pair_current_total_info.astype(np.float64)
+        total_info = np.sum(pair_current_total_info)
+        achieved_pair_dist = pair_current_total_info / total_info if total_info > 0 else pair_current_total_info
+        return np.amax(np.abs(achieved_pair_dist - self._get_target_pair_dist()), initial=0)
+
+    def _start_packing_progress(self):
+        # flows per second of progress updates are measured from the start of the current packing call
+        self.packing_progress_start_t = time.perf_counter()
+        self.last_progress_update_t = self.packing_progress_start_t
+        self.num_packed_flows_at_packing_progress_start = self.num_packed_flows
+
+    def _update_packing_progress(self, num_packed_flows, force=False):
+        '''
+        Calls the progress callbacks and checks the Jensen Shannon distance
+        threshold if at least progress_callback_freq flows have been packed
+        (or if progress_callback_interval seconds have passed, or if force)
+        since the last progress update and any flows have been packed.
+        '''
+        num_flows_since_last_update = num_packed_flows - self.num_packed_flows_at_last_progress_update
+        if num_flows_since_last_update == 0:
+            return
+        if not force and num_flows_since_last_update < self.progress_callback_freq and (self.progress_callback_interval is None or time.perf_counter() - self.last_progress_update_t < self.progress_callback_interval):
+            return
+        self.num_packed_flows_at_last_progress_update = num_packed_flows
+        self.last_progress_update_t = time.perf_counter()
+
+        if len(self.progress_callbacks) > 0:
+            progress = PackingProgress(num_packed_flows=num_packed_flows,
+                                       num_flows=self.num_flows_to_pack,
+                                       info_packed=float(np.sum(self.src_total_infos)),
+                                       elapsed_time=self.last_progress_update_t - self.packing_progress_start_t,
+                                       num_flows_since_start=num_packed_flows - self.num_packed_flows_at_packing_progress_start,
+                                       get_max_pair_deviation=self._compute_max_pair_deviation,
+                                       get_jensen_shannon_distance=self._compute_packing_jensen_shannon_distance,
+                                       get_jensen_shannon_distance_lower_bound=self._get_jensen_shannon_distance_lower_bound)
+            for progress_callback in self.progress_callbacks:
+                progress_callback(progress)
+
+        if self.jensen_shannon_distance_threshold is not None:
+            jensen_shannon_distance_lower_bound = self._get_jensen_shannon_distance_lower_bound()
+            if jensen_shannon_distance_lower_bound > self.jensen_shannon_distance_threshold:
+                raise JensenShannonDistanceThresholdExceeded(f'Aborted packing after {num_packed_flows} of {self.num_flows_to_pack} flows since final Jensen Shannon distance will be >= {jensen_shannon_distance_lower_bound} > jensen_shannon_distance_threshold ({self.jensen_shannon_distance_threshold})')
 
     def pack_the_flows(self):
         '''
@@ -209,44 +976,350 @@ class VectorisedFlowPacker(FlowPacker):
         to be valid. You can set auto_node_dist_correction=False to stop this behaviour.
 
         '''
-        pbar = tqdm(total=len(self.packed_flows.keys()), 
-                    desc='Packing flows',
+        packing_start_t = time.time()
+        self._start_packing_progress()
+
+        if self.memory_profiler is not None:
+            self.memory_profiler.start_phase('pack_loop')
+        self._sort_flows_by_size()
+        flow_pair_idxs = self._pack_flow_sizes(self.flow_sizes, self.flow_ids)
+        if self.memory_profiler is not None:
+            self.memory_profiler.stop_phase('pack_loop')
+            self.memory_profiler.start_phase('output_construction')
+        self.packed_flow_src_idxs, self.packed_flow_dst_idxs = self._take_flow_array(self.pair_src_idxs, flow_pair_idxs, 'packed_flow_src_idxs'), self._take_flow_array(self.pair_dst_idxs, flow_pair_idxs, 'packed_flow_dst_idxs')
+
+        # end point labels are only translated back from the packed end point indices when packed flows are read
+        self.packed_flows = PackedFlows(flow_ids=self.flow_ids,
+                                        sizes=self.flow_sizes,
+                                        src_idxs=self.packed_flow_src_idxs,
+                                        dst_idxs=self.packed_flow_dst_idxs,
+                                        eps=self.idx_to_ep)
+        if self.memory_profiler is not None:
+            self.memory_profiler.stop_phase('output_construction')
+
+        # shuffle flow order to maintain randomness for arrival time in simulation (since sorted flows by size above)
+        if self.stats is not None:
+            start_t = time.perf_counter()
+        if self.memory_profiler is not None:
+            self.memory_profiler.start_phase('shuffle')
+        shuffled_packed_flows = self._shuffle_packed_flows()
+        if self.memory_profiler is not None:
+            self.memory_profiler.stop_phase('shuffle')
+        if not self.return_packed_flow_arrays:
+            # only build the per-flow dicts once, in shuffled order
+            if self.memory_profiler is not None:
+                self.memory_profiler.start_phase('output_construction')
+            self.packed_flows = shuffled_packed_flows = shuffled_packed_flows.to_dict()
+            if self.memory_profiler is not None:
+                self.memory_profiler.stop_phase('output_construction')
+        if self.stats is not None:
+            self.stats.time_phase('shuffle', start_t)
+
+        # compute tracker metrics
+        self.packing_time = time.time() - packing_start_t
+        if self.stats is not None:
+            self.stats.packing_time += self.packing_time
+        self.packing_jensen_shannon_distance = self._compute_packing_jensen_shannon_distance()
+
+        print(f'Packed {len(self.packed_flows)} flows in {self.packing_time:.3f} s | Node distribution Jensen Shannon distance from target achieved: {self.packing_jensen_shannon_distance}')
+
+        return shuffled_packed_flows
+
+    def _rescale_to_duration(self, duration):
+        # targets and end point capacities scale with duration, whereas packed info is kept
+        self.duration = duration
+        self.pair_target_total_info = self._to_state_info(self.pair_target_load_rate * self.duration)
+        np.subtract(self.pair_target_total_info, self.pair_current_total_info, out=self.pair_current_distance_from_target_info)
+        self.max_total_ep_info = self.network_load_config['ep_link_capacity'] * self.duration
+        self.max_total_port_info = self.max_total_ep_info / 2 # each end point is split into a src and dst
+        self._update_pair_remaining_capacity()
+
+        if self.pair_selector == 'segment_tree':
+            # pair keys and capacities have all changed (and parked pairs may now have capacity) so rebuild
+            self.segment_tree_pair_selector = SegmentTreePairSelector(pair_keys=self.pair_current_distance_from_target_info + self.pair_target_total_info,
+                                                                      pair_remaining_capacity=self.pair_to_remaining_capacity if self.check_dont_exceed_one_ep_load else None,
+                                                                      dtype=self.state_dtype,
+                                                                      rng=self.rng)
+
+    def pack_more_flows(self, flow_ids, flow_sizes, flow_interarrival_times):
+        '''
+        Warm-start packing of a new batch of flows which arrive after the
+        flows already packed (e.g. the next window of a rolling-horizon
+        trace), without resetting or re-packing the flows already packed.
+
+        The duration is extended by the time from the arrival of the last
+        already packed flow to the arrival of the last new flow, and the pair
+        target total infos and end point capacities are rescaled to the new
+        duration. The packed info of each pair and end point is kept, so the
+        new flows are packed towards the target node distribution of the
+        whole trace so far, and packing_jensen_shannon_distance is that of
+        the whole trace so far. Costs O(num_pairs) plus packing the new flows.
+
+        The packer's flow_ids, flow_sizes and flow_interarrival_times are
+        replaced by the new batch.
+
+        Args:
+            flow_ids (list): Ids of the new flows.
+            flow_sizes (numpy.ndarray): Sizes of the new flows.
+            flow_interarrival_times (numpy.ndarray): Interarrival times of the
+                new flows.
+
+        Returns the packed new flows in the same form as pack_the_flows().
+        '''
+        if len(flow_ids) != len(flow_sizes) or len(flow_ids) != len(flow_interarrival_times):
+            raise Exception(f'Must have one flow id, size and interarrival time per flow but have {len(flow_ids)} flow ids, {len(flow_sizes)} flow sizes and {len(flow_interarrival_times)} interarrival times')
+        duration = self.duration + self.flow_interarrival_times[-1] + np.sum(flow_interarrival_times[:-1])
+        self.flow_ids, self.flow_sizes, self.flow_interarrival_times = flow_ids, np.asanyarray(flow_sizes), flow_interarrival_times
+        self._check_state_dtype_range(duration, self.total_flow_info + np.sum(self.flow_sizes))
+        self._rescale_to_duration(duration)
+
+        # update trackers of the total info of all flows to pack
+        self.total_flow_info += np.sum(self.flow_sizes)
+        self.num_flows_to_pack += len(self.flow_ids)
+        if self.track_packing_progress:
+            self.pair_target_final_info = self._get_target_pair_dist() * self.total_flow_info / self.state_info_unit
+        if self.track_pair_info_overshoot:
+            self._recompute_pair_info_overshoot()
+
+        if self.print_data:
+            print('Duration: {}'.format(self.duration))
+            print('Pair target total info sum: {}'.format(np.sum(self.pair_target_total_info)))
+            print('Max total ep info: {}'.format(self.max_total_ep_info))
+            print('Sum of new flow sizes: {}'.format(np.sum(self.flow_sizes)))
+
+        return self.pack_the_flows()
+
+    def iter_pack(self, chunk_size=100000):
+        '''
+        Generator version of pack_the_flows() which packs the flows chunk_size
+        flows at a time (in their given order) and yields each packed chunk
+        as a PackedFlows as soon as it has been packed (e.g. so that it can be
+        written to disk), so that only one chunk of packed flows is held in
+        memory at a time. The pair and end point info trackers are carried
+        across chunks, so each chunk is packed towards the target node
+        distribution given the chunks already packed.
+
+        Flows are sorted into descending size and shuffled back into a
+        random order within each chunk rather than across all flows, so the
+        achieved node distribution may be slightly further from the target
+        than with pack_the_flows() if chunk_size is small. Does not change the
+        order of self.flow_sizes.
+
+        packing_time and packing_jensen_shannon_distance are set once the
+        last chunk has been yielded.
+
+        Args:
+            chunk_size (int): Number of flows to pack and yield at a time.
+        '''
+        if chunk_size < 1:
+            raise Exception(f'chunk_size must be >= 1 but is {chunk_size}')
+        self.packing_time = 0
+        self._start_packing_progress()
+
+        for chunk_start in range(0, len(self.flow_ids), chunk_size):
+            chunk_packing_start_t = time.time()
+
+            # want to pack largest flows of chunk first
+            chunk_flow_sizes = np.sort(self.flow_sizes[chunk_start:chunk_start+chunk_size])[::-1]
+            chunk_flow_ids = np.asarray(self.flow_ids[chunk_start:chunk_start+chunk_size])
+            if self.memory_profiler is not None:
+                self.memory_profiler.start_phase('pack_loop')
+            flow_pair_idxs = self._pack_flow_sizes(chunk_flow_sizes, chunk_flow_ids)
+            if self.memory_profiler is not None:
+                self.memory_profiler.stop_phase('pack_loop')
+
+            # shuffle chunk's flow order to maintain randomness for arrival time in simulation
+            if self.stats is not None:
+                start_t = time.perf_counter()
+            if self.memory_profiler is not None:
+                self.memory_profiler.start_phase('shuffle')
+            packed_flows = PackedFlows(flow_ids=chunk_flow_ids,
+                                       sizes=chunk_flow_sizes,
+                                       src_idxs=self.pair_src_idxs[flow_pair_idxs],
+                                       dst_idxs=self.pair_dst_idxs[flow_pair_idxs],
+                                       eps=self.idx_to_ep).permute(self.rng.permutation(len(chunk_flow_ids)))
+            if self.memory_profiler is not None:
+                self.memory_profiler.stop_phase('shuffle')
+            if self.stats is not None:
+                self.stats.time_phase('shuffle', start_t)
+            self.packing_time += time.time() - chunk_packing_start_t
+
+            yield packed_flows
+
+        # compute tracker metrics
+        if self.stats is not None:
+            self.stats.packing_time += self.packing_time
+        self.packing_jensen_shannon_distance = self._compute_packing_jensen_shannon_distance()
+
+        print(f'Packed {len(self.flow_ids)} flows in {self.packing_time:.3f} s | Node distribution Jensen Shannon distance from target achieved: {self.packing_jensen_shannon_distance}')
+
+    def pack_the_flow_replicates(self,
+                                 replicate_flow_sizes,
+                                 replicate_flow_ids=None,
+                                 replicate_flow_interarrival_times=None):
+        '''
+        Packs K replicate sets of flows (e.g. generated with different seeds
+        for the same network and node distribution) in a single pass rather
+        than with K separate packers. The pair and end point info trackers
+        are held as (K, num_pairs) and (K, num_eps) arrays, and each step packs
+        the next largest flow of every replicate with one vectorised masked
+        argmax and update across all replicates, which amortises the per-flow
+        Python and NumPy call overhead over the K replicates.
+
+        Each replicate is packed with the same furthest-from-target rule as
+        pack_the_flows() with pair_selector='masked_scan' (irrespective of
+        pair_selector and backend) and is independent of the other replicates.
+        Does not change the packer's own pair and end point info trackers.
+
+        Args:
+            replicate_flow_sizes (list): K arrays of flow sizes.
+            replicate_flow_ids (list): K arrays of the flow ids corresponding
+                to replicate_flow_sizes. If None, every replicate uses the
+                packer's flow_ids.
+            replicate_flow_interarrival_times (list): K arrays of flow
+                interarrival times from which the duration of each replicate
+                is calculated. If None, every replicate uses the packer's
+                duration.
+
+        Returns a list of the K replicates' packed flows, each in the same
+        form as returned by pack_the_flows(). The Jensen Shannon distance
+        achieved by each replicate is stored in
+        replicate_packing_jensen_shannon_distances.
+        '''
+        num_replicates = len(replicate_flow_sizes)
+        if replicate_flow_ids is None:
+            replicate_flow_ids = [self.flow_ids for _ in range(num_replicates)]
+        if replicate_flow_interarrival_times is None:
+            replicate_durations = np.full(num_replicates, self.duration)
+        else:
+            replicate_durations = np.array([self._get_duration(flow_interarrival_times) for flow_interarrival_times in replicate_flow_interarrival_times])
+        replicate_num_flows = np.array([len(flow_sizes) for flow_sizes in replicate_flow_sizes], dtype=np.int64)
+        for replicate_idx, flow_ids in enumerate(replicate_flow_ids):
+            if len(flow_ids) != replicate_num_flows[replicate_idx]:
+                raise Exception(f'Replicate {replicate_idx} has {len(flow_ids)} flow ids but {replicate_num_flows[replicate_idx]} flow sizes')
+
+        pbar = tqdm(total=np.sum(replicate_num_flows), 
+                    desc='Packing flow replicates',
                     leave=False,
-                    smoothing=0)
+                    smoothing=0,
+                    disable=not self.progress_bar)
         packing_start_t = time.time()
 
-        # pack each flow into a src-dst pair
-        for flow in self.packed_flows.keys():
+        # want to pack largest flows first -> pad the descending flow sizes of each replicate into a (K, max num flows) array
+        flow_sizes = np.zeros((num_replicates, np.amax(replicate_num_flows, initial=0)))
+        for replicate_idx, _flow_sizes in enumerate(replicate_flow_sizes):
+            flow_sizes[replicate_idx, :len(_flow_sizes)] = np.sort(_flow_sizes)[::-1]
+
+        # init (K, num_pairs) pair and (K, num_eps) end point info trackers. Only the adjusted distance from target (current distance from target info + target total info) is needed to choose pairs
+        num_pairs = len(self.pairs)
+        pair_target_total_info = self.pair_target_load_rate[None, :] * replicate_durations[:, None]
+        pair_current_total_info = np.zeros((num_replicates, num_pairs))
+        adjusted_pair_distances = 2 * pair_target_total_info
+        max_total_port_infos = self.network_load_config['ep_link_capacity'] * replicate_durations / 2
+        src_total_infos, dst_total_infos = np.zeros((num_replicates, self.num_eps)), np.zeros((num_replicates, self.num_eps))
+        flow_pair_idxs = np.full(flow_sizes.shape, -1, dtype=np.int64)
 
-            # choose a src-dst pair to pack this flow into
-            chosen_pair = self._choose_pair(flow)
+        if self.check_dont_exceed_one_ep_load:
+            # persistent (K, num_pairs) remaining capacity of each pair, of which only the pairs sharing the chosen pair's src or dst are updated after each flow is packed
+            pair_remaining_capacity = np.repeat(max_total_port_infos[:, None], num_pairs, axis=1)
+            # pairs of src end point i are pairs src_to_pair_indptr[i]:src_to_pair_indptr[i+1] (pairs are in src-major order) and pairs of dst end point i are pairs dst_to_pair_idxs[dst_to_pair_indptr[i]:dst_to_pair_indptr[i+1]]. Concatenate the two so that the pairs of a chosen src and dst can be gathered for all replicates at once, with dst i's pairs at ep_to_pair_idxs[ep_to_pair_indptr[num_eps+i]:ep_to_pair_indptr[num_eps+i+1]]
+            src_to_pair_indptr = np.concatenate([[0], np.cumsum(np.bincount(self.pair_src_idxs, minlength=self.num_eps))])
+            dst_to_pair_indptr = np.concatenate([[0], np.cumsum(np.bincount(self.pair_dst_idxs, minlength=self.num_eps))])
+            ep_to_pair_indptr = np.concatenate([src_to_pair_indptr[:-1], num_pairs + dst_to_pair_indptr])
+            ep_to_pair_idxs = np.concatenate([np.arange(num_pairs), np.argsort(self.pair_dst_idxs, kind='stable')])
+
+        all_replicate_idxs = np.arange(num_replicates)
+        for flow_idx in range(flow_sizes.shape[1]):
+            # only pack replicates which have flows left to pack
+            packing_all_replicates = np.all(replicate_num_flows > flow_idx)
+            replicate_idxs = all_replicate_idxs if packing_all_replicates else np.flatnonzero(replicate_num_flows > flow_idx)
+            _flow_sizes = flow_sizes[replicate_idxs, flow_idx]
 
             if self.check_dont_exceed_one_ep_load:
-                if not self._check_if_flow_pair_within_max_load(flow, chosen_pair):
-                    json_loads_pair = self.pair_to_json_loads[chosen_pair]
-                    chosen_src, chosen_dst = json_loads_pair[0], json_loads_pair[1]
-                    raise Exception(f'ERROR: Flow {flow} with size {self.packed_flows[flow]["size"]} has been allocated to chosen_pair {chosen_pair} which has src total info ({self.src_total_infos[chosen_src]}) and/or dst total info ({self.dst_total_infos[chosen_dst]}) + flow size > max_total_port_info ({self.max_total_port_info}) (pair_current_distance_from_target_info: {self.pair_current_distance_from_target_info[self.pair_to_idx[chosen_pair]]} | pair_to_remaining_capacity: {self.pair_to_remaining_capacity[self.pair_to_idx[chosen_pair]]})')
+                # mask out pairs whose src and/or dst would exceed 1.0 load rate were they to be allocated this flow
+                pairs_mask = (pair_remaining_capacity if packing_all_replicates else pair_remaining_capacity[replicate_idxs]) >= _flow_sizes[:, None]
+                candidate_pair_distances = np.where(pairs_mask, adjusted_pair_distances if packing_all_replicates else adjusted_pair_distances[replicate_idxs], -np.inf)
+            else:
+                candidate_pair_distances = adjusted_pair_distances if packing_all_replicates else adjusted_pair_distances[replicate_idxs]
+            max_pair_distances = np.amax(candidate_pair_distances, axis=1)
+            if np.any(max_pair_distances == -np.inf):
+                replicate_idx = replicate_idxs[np.argmax(max_pair_distances == -np.inf)]
+                raise Exception(f'ERROR: Flow with size {flow_sizes[replicate_idx, flow_idx]} of replicate {replicate_idx} cannot be packed into any pair without exceeding max_total_port_info ({max_total_port_infos[replicate_idx]})')
 
-            # pack flow into the chosen src-dst pair
-            self._pack_flow_into_chosen_pair(flow, chosen_pair)
+            # choose the pair furthest from its target load for each replicate. The flat idxs of the max pairs are in replicate-major order, so each replicate's max pairs are a contiguous run of them
+            max_flat_idxs = np.flatnonzero(candidate_pair_distances == max_pair_distances[:, None])
+            num_max_pairs = np.bincount(max_flat_idxs // num_pairs, minlength=len(replicate_idxs))
+            chosen_max_idxs = np.cumsum(num_max_pairs) - num_max_pairs
+            tied = num_max_pairs > 1
+            if np.any(tied):
+                # randomly select between ties (only for replicates with ties) to avoid fade phenomenon in the resultant node dist
+                chosen_max_idxs[tied] += self.rng.integers(num_max_pairs[tied])
+            chosen_pair_idxs = max_flat_idxs[chosen_max_idxs] % num_pairs
+            flow_pair_idxs[replicate_idxs, flow_idx] = chosen_pair_idxs
 
-            pbar.update(1)
+            # pack flows into the chosen pairs (each replicate packs one flow so no repeated indices)
+            chosen_srcs, chosen_dsts = self.pair_src_idxs[chosen_pair_idxs], self.pair_dst_idxs[chosen_pair_idxs]
+            pair_current_total_info[replicate_idxs, chosen_pair_idxs] += _flow_sizes
+            adjusted_pair_distances[replicate_idxs, chosen_pair_idxs] -= _flow_sizes
+            src_total_infos[replicate_idxs, chosen_srcs] += _flow_sizes
+            dst_total_infos[replicate_idxs, chosen_dsts] += _flow_sizes
 
-        # shuffle flow order to maintain randomness for arrival time in simulation (since sorted flows by size above)
-        shuffled_packed_flows = self._shuffle_packed_flows()
+            if self.check_dont_exceed_one_ep_load:
+                # update the remaining capacity of the pairs of each replicate's chosen src and chosen dst
+                ep_starts = np.concatenate([ep_to_pair_indptr[chosen_srcs], ep_to_pair_indptr[self.num_eps + chosen_dsts]])
+                ep_num_pairs = np.concatenate([ep_to_pair_indptr[chosen_srcs + 1], ep_to_pair_indptr[self.num_eps + chosen_dsts + 1]]) - ep_starts
+                updated_replicate_idxs = np.repeat(np.concatenate([replicate_idxs, replicate_idxs]), ep_num_pairs)
+                updated_pair_idxs = ep_to_pair_idxs[np.arange(np.sum(ep_num_pairs)) + np.repeat(ep_starts - (np.cumsum(ep_num_pairs) - ep_num_pairs), ep_num_pairs)]
+                pair_remaining_capacity[updated_replicate_idxs, updated_pair_idxs] = max_total_port_infos[updated_replicate_idxs] - np.maximum(src_total_infos[updated_replicate_idxs, self.pair_src_idxs[updated_pair_idxs]], dst_total_infos[updated_replicate_idxs, self.pair_dst_idxs[updated_pair_idxs]])
+
+            pbar.update(len(replicate_idxs))
+
+        # build each replicate's packed flows, shuffling flow order to maintain randomness for arrival time in simulation (since sorted flows by size above)
+        replicate_shuffled_packed_flows, self.replicate_packing_jensen_shannon_distances = [], []
+        target_pair_dist = self._get_target_pair_dist()
+        for replicate_idx in range(num_replicates):
+            num_flows = replicate_num_flows[replicate_idx]
+            packed_flows = PackedFlows(flow_ids=replicate_flow_ids[replicate_idx],
+                                       sizes=flow_sizes[replicate_idx, :num_flows],
+                                       src_idxs=self.pair_src_idxs[flow_pair_idxs[replicate_idx, :num_flows]],
+                                       dst_idxs=self.pair_dst_idxs[flow_pair_idxs[replicate_idx, :num_flows]],
+                                       eps=self.idx_to_ep).permute(self.rng.permutation(num_flows))
+            replicate_shuffled_packed_flows.append(packed_flows if self.return_packed_flow_arrays else packed_flows.to_dict())
+            achieved_pair_dist = pair_current_total_info[replicate_idx] / np.sum(pair_current_total_info[replicate_idx])
+            self.replicate_packing_jensen_shannon_distances.append(tools.compute_jensen_shannon_distance(target_pair_dist, achieved_pair_dist))
 
         pbar.close()
 
-        # compute tracker metrics
         self.packing_time = time.time() - packing_start_t
-        if np.sum(self.pair_probs) - self.machine_eps <= 0.5:
-            target_pair_dist = self.pair_probs * 2 # sum to 1.0 (previously summed to 0.5 since allocated twice for src-dst and dst-src)
-        else:
-            target_pair_dist = self.pair_probs
-        achieved_pair_load = self.pair_current_total_info / self.duration
-        achieved_pair_dist = achieved_pair_load / np.sum(achieved_pair_load)
-        self.packing_jensen_shannon_distance = tools.compute_jensen_shannon_distance(target_pair_dist, achieved_pair_dist)
 
-        print(f'Packed {len(self.packed_flows)} flows in {self.packing_time:.3f} s | Node distribution Jensen Shannon distance from target achieved: {self.packing_jensen_shannon_distance}')
+        print(f'Packed {num_replicates} replicates of {np.sum(replicate_num_flows)} total flows in {self.packing_time:.3f} s | Mean node distribution Jensen Shannon distance from target achieved: {np.mean(self.replicate_packing_jensen_shannon_distances)}')
 
-        return shuffled_packed_flows
+        return replicate_shuffled_packed_flows
+
+
+def _pack_shard(shard):
+    # init shard's end point info trackers (pair info trackers carry on from any flows already packed)
+    pair_current_total_info = shard['pair_current_total_info']
+    pair_current_distance_from_target_info = shard['pair_current_distance_from_target_info']
+    src_total_infos, dst_total_infos, ep_total_infos = np.zeros(shard['num_eps']), np.zeros(shard['num_eps']), np.zeros(shard['num_eps'])
+
+    flow_pair_idxs = kernels.get_pack_flows_kernel(shard['backend'])(shard['flow_sizes'],
+                                                                      shard['pair_src_idxs'],
+                                                                      shard['pair_dst_idxs'],
+                                                                      shard['pair_target_total_info'],
+                                                                      pair_current_total_info,
+                                                                      pair_current_distance_from_target_info,
+                                                                      src_total_infos,
+                                                                      dst_total_infos,
+                                                                      ep_total_infos,
+                                                                      shard['src_max_infos'],
+                                                                      shard['dst_max_infos'],
+                                                                      shard['check_dont_exceed_one_ep_load'],
+                                                                      shard['seed'])
+
+    return {'flow_pair_idxs': flow_pair_idxs,
+            'pair_current_total_info': pair_current_total_info,
+            'pair_current_distance_from_target_info': pair_current_distance_from_target_info,
+            'src_total_infos': src_total_infos,
+            'dst_total_infos': dst_total_infos,
+            'ep_total_infos': ep_total_infos}